@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Connect the receivers leaving tombstones of deleted orders
+        from api.interfaces import orderchanges  # noqa: F401
@@ -0,0 +1,272 @@
+import hashlib
+import heapq
+import itertools
+import logging
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Replication delay of a Postgres standby, 0 on a primary or a standby that has replayed everything it received
+LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+# Weight of the newest sample in a replica's smoothed latency
+LATENCY_ALPHA = 0.3
+
+# Alias reads of the current request go to, None for the primary
+_read_alias = ContextVar("read_alias", default=None)
+# Whether the current request wrote to the database
+_wrote = ContextVar("wrote", default=False)
+# Shard the customer of the current request lives on, None outside use_shard()
+_shard_alias = ContextVar("shard_alias", default=None)
+
+# Models placed on the shard of their customer when ORDER_SHARDS is set, the others stay on the default database
+SHARDED_MODELS = ("api.customer", "api.order", "api.archivedorder", "api.ordertombstone")
+
+
+class ReplicaSelector(object):
+    """
+    Pick the replica a read-only request reads from.
+    Each replica is checked at most every REPLICA_CHECK_INTERVAL seconds per worker, a replica that fails the
+    check or lags more than REPLICA_MAX_LAG_SECONDS is skipped until the next check. REPLICA_SELECTION is
+    'round_robin' or 'least_latency' (the smoothed round trip of the checks).
+    """
+
+    def __init__(self):
+        self.state = {}
+        self.turn = itertools.count()
+
+    def choose(self):
+        """
+        @return: A healthy replica alias, or None when every replica is down or lagging.
+        """
+        now = time.monotonic()
+        healthy = []
+        for alias in settings.REPLICA_DATABASES:
+            state = self.state.get(alias)
+            if state is None or now - state["checked_at"] >= settings.REPLICA_CHECK_INTERVAL:
+                state = self.check(alias)
+            if state["healthy"]:
+                healthy.append((state["latency"], alias))
+        if not healthy:
+            return None
+        if settings.REPLICA_SELECTION == "least_latency":
+            return min(healthy)[1]
+        return healthy[next(self.turn) % len(healthy)][1]
+
+    def check(self, alias):
+        previous = self.state.get(alias)
+        started = time.perf_counter()
+        try:
+            connection = connections[alias]
+            with connection.cursor() as cursor:
+                cursor.execute(LAG_SQL if connection.vendor == "postgresql" else "SELECT 0")
+                lag = float(cursor.fetchone()[0] or 0)
+            latency = time.perf_counter() - started
+            healthy = lag <= settings.REPLICA_MAX_LAG_SECONDS
+            if not healthy:
+                logger.warning(f"Replica {alias} is {lag:.1f}s behind, reading from the primary")
+        except DatabaseError as ex:
+            logger.warning(f"Replica {alias} is unavailable, reading from the primary: {ex}")
+            healthy, latency = False, math.inf
+        if previous and healthy and math.isfinite(previous["latency"]):
+            latency = previous["latency"] + LATENCY_ALPHA * (latency - previous["latency"])
+        self.state[alias] = {"healthy": healthy, "latency": latency, "checked_at": time.monotonic()}
+        return self.state[alias]
+
+
+selector = ReplicaSelector()
+
+
+def pin_key(user_id):
+    return f"replica:pinned:{user_id}"
+
+
+def pin_to_primary(user_id):
+    """
+    Send the user's reads to the primary for REPLICA_STICKY_SECONDS, so they read their own writes
+    while the replicas catch up. Pins are kept in the Django cache, shared between workers when CACHES is.
+    """
+    cache.set(pin_key(user_id), True, timeout=settings.REPLICA_STICKY_SECONDS)
+
+
+def start_request():
+    """
+    Reset the write flag at the start of a request.
+    @return: A token for finish_request.
+    """
+    return _wrote.set(False)
+
+
+def finish_request(token):
+    """
+    @return: Whether the request wrote to the database.
+    """
+    wrote = _wrote.get()
+    _wrote.reset(token)
+    return wrote
+
+
+def read_replica(view_func):
+    """
+    Decorator sending the reads of a read-only handler to a replica. Apply it under login_required,
+    users that wrote in the last REPLICA_STICKY_SECONDS keep reading from the primary.
+    Works with both plain functions and instance methods, like login_required.
+    """
+
+    @wraps(view_func)
+    def wrapper(*args, **kwargs):
+        if not settings.REPLICA_DATABASES:
+            return view_func(*args, **kwargs)
+        request = args[0] if hasattr(args[0], "method") else args[1]
+        user_id = getattr(request, "user_id", None)
+        alias = None if user_id and cache.get(pin_key(user_id)) else selector.choose()
+        token = _read_alias.set(alias)
+        try:
+            return view_func(*args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+
+    return wrapper
+
+
+class ReplicaRouter(object):
+    """
+    Route reads of handlers decorated with read_replica to a replica, everything else to the primary.
+    Replicas are read-only copies of the primary, so they are never migrated and relations between
+    objects read from either are allowed.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        # Explicit, an object read from a replica must still be saved on the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in settings.REPLICA_DATABASES else None
+
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping and Veach): the bucket of a 64 bit key among buckets. Adding a bucket at the
+    end moves only 1/buckets of the keys, all of them to the new bucket.
+    """
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for_code(code, shards=None):
+    """
+    The database a customer and its orders live on, from a stable hash of the customer code.
+    @param shards: The shard aliases, ORDER_SHARDS by default. Only ever append to them.
+    @return: The alias, or None when customers are not sharded and the usual routing applies.
+    """
+    shards = settings.ORDER_SHARDS if shards is None else shards
+    if not shards:
+        return None
+    key = int.from_bytes(hashlib.blake2b(code.encode(), digest_size=8).digest(), "big")
+    return shards[jump_hash(key, len(shards))]
+
+
+def shard_aliases():
+    """Every shard, or [None] when customers are not sharded, to loop over with use_shard()."""
+    return settings.ORDER_SHARDS or [None]
+
+
+@contextmanager
+def use_shard(alias):
+    """
+    Send the queries of sharded models within the block to the shard alias, e.g. shard_for_code(code).
+    None, when customers are not sharded, leaves the routing as it is.
+    """
+    token = _shard_alias.set(alias)
+    try:
+        yield
+    finally:
+        _shard_alias.reset(token)
+
+
+def shard_db():
+    """The alias of the current shard, for transaction.atomic(using=...) and raw connections."""
+    return _shard_alias.get() or DEFAULT_DB_ALIAS
+
+
+def scatter(queryset):
+    """The queryset on each shard, or just the queryset when customers are not sharded or its model is not."""
+    if queryset.model._meta.label_lower not in SHARDED_MODELS:
+        return [queryset]
+    return [queryset.using(alias) for alias in settings.ORDER_SHARDS] or [queryset]
+
+
+def merge(results, key, limit=None):
+    """
+    Gather the results of scattered queries, each already sorted by key, into one sorted iterator.
+    @param limit: Stop after this many rows.
+    """
+    merged = heapq.merge(*results, key=key)
+    return merged if limit is None else itertools.islice(merged, limit)
+
+
+class ShardRouter(object):
+    """
+    Place each customer, with its orders, archived orders and tombstones, on one of the ORDER_SHARDS databases
+    chosen by shard_for_code. Handlers run a customer's queries inside use_shard(), staff-wide listings
+    scatter() over every shard and merge() the results. Sharded models used outside use_shard() stay on the
+    database of the instance they are related to, or the default database. Every shard is migrated with all
+    tables, the unsharded ones are left empty there.
+    Listed before ReplicaRouter, it does nothing until ORDER_SHARDS is set. Shards have no replicas.
+    """
+
+    def shard(self, model, hints):
+        """
+        @return: The shard a sharded model goes to, or None.
+        """
+        if not settings.ORDER_SHARDS or model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        instance = hints.get("instance")
+        return _shard_alias.get() or (instance._state.db if instance is not None else None)
+
+    @staticmethod
+    def from_shard(hints):
+        """Whether an unsharded model is reached from an object read from a shard, e.g. a customer's user."""
+        instance = hints.get("instance")
+        return (instance is not None and instance._state.db != DEFAULT_DB_ALIAS
+                and instance._state.db in settings.ORDER_SHARDS)
+
+    def db_for_read(self, model, **hints):
+        alias = self.shard(model, hints)
+        if alias is None and self.from_shard(hints):
+            return _read_alias.get() or DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        alias = self.shard(model, hints)
+        if alias is None and self.from_shard(hints):
+            alias = DEFAULT_DB_ALIAS
+        if alias is not None:
+            _wrote.set(True)
+        return alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if settings.ORDER_SHARDS and all(obj._meta.label_lower in SHARDED_MODELS for obj in (obj1, obj2)):
+            return obj1._state.db == obj2._state.db
+        return None
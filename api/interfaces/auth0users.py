@@ -0,0 +1,127 @@
+import math
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from api.models import User
+
+# The Auth0 users endpoint returns at most this many users for one query, however it is paged
+MAX_QUERY_RESULTS = 1000
+# Columns an upsert refreshes on users that exist already. Role, phone number and password stay as managed locally.
+UPSERT_FIELDS = ["email", "name", "date_modified"]
+
+
+class Auth0ManagementClient(object):
+    """
+    Client of the Auth0 Management API over one pooled, thread safe session: keep-alive connections shared by
+    up to `workers` threads, retries with backoff on connection errors, 429 (honouring Retry-After) and 5xx.
+    The management token is fetched with the M2M client credentials on first use.
+    """
+
+    def __init__(self, workers=4, base_url=None, timeout=30):
+        self.base_url = (base_url or settings.AUTH0_MANAGEMENT_URL or f"https://{settings.AUTH0_DOMAIN}").rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        retries = Retry(total=5, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                        allowed_methods=None, respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retries)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.token = None
+        self.lock = threading.Lock()
+
+    def authorization(self):
+        with self.lock:
+            if self.token is None:
+                response = self.session.post(f"{self.base_url}/oauth/token", timeout=self.timeout, json={
+                    "client_id": settings.AUTH0_M2M_CLIENT_ID,
+                    "client_secret": settings.AUTH0_M2M_CLIENT_SECRET,
+                    "audience": f"https://{settings.AUTH0_DOMAIN}/api/v2/",
+                    "grant_type": "client_credentials",
+                })
+                response.raise_for_status()
+                self.token = response.json()["access_token"]
+            return f"Bearer {self.token}"
+
+    def users_page(self, page, per_page, since=None):
+        """
+        One page of users, oldest first.
+        @param since: Only users created at or after this Auth0 created_at timestamp.
+        @return: The Auth0 response, {"users": [...], "total": ..., ...}.
+        """
+        params = {"page": page, "per_page": per_page, "include_totals": "true", "sort": "created_at:1"}
+        if since:
+            params.update(q=f"created_at:[{since} TO *]", search_engine="v3")
+        response = self.session.get(f"{self.base_url}/api/v2/users", params=params, timeout=self.timeout,
+                                    headers={"Authorization": self.authorization()})
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+
+def iter_user_pages(client, executor, per_page, since=None):
+    """
+    Page through the Auth0 users created at or after since, oldest first, fetching the pages of each query
+    concurrently on executor. Auth0 answers a query with MAX_QUERY_RESULTS users at most, so larger tenants are
+    read in windows, each starting at the created_at of the last user of the previous one. Users on a window edge
+    are returned twice, which the upsert absorbs. per_page is capped at MAX_QUERY_RESULTS, a window is one page then.
+    @return: A generator of pages (lists of Auth0 users) in created_at order.
+    """
+    per_page = min(per_page, MAX_QUERY_RESULTS)
+    while True:
+        first = client.users_page(0, per_page, since)
+        pages = min(math.ceil(first.get("total", 0) / per_page), MAX_QUERY_RESULTS // per_page)
+        yield first["users"]
+        last_page = first["users"]
+        for users in executor.map(lambda page: client.users_page(page, per_page, since)["users"], range(1, pages)):
+            yield users
+            last_page = users or last_page
+        if first.get("total", 0) <= MAX_QUERY_RESULTS or not last_page:
+            return
+        next_since = last_page[-1]["created_at"]
+        if next_since == since:
+            raise RuntimeError(f"More than {MAX_QUERY_RESULTS} Auth0 users were created at {since}, "
+                               f"they cannot be paged through")
+        since = next_since
+
+
+def user_from_auth0(data):
+    """The local User of an Auth0 management API user, unsaved."""
+    metadata = data.get("app_metadata") or {}
+    return User(openid_user_id=data["user_id"], email=data.get("email", ""), name=data.get("name", ""),
+                role=metadata.get("role", "user"), phone_number=metadata.get("phone_number") or None)
+
+
+def upsert_users(users, batch_size=1000):
+    """
+    Insert the users, or update those whose openid_user_id exists, with INSERT ... ON CONFLICT in batches.
+    Users whose email or phone number already belongs to another Auth0 user would fail the whole batch, they are
+    left out and returned instead.
+    @return: An (upserted, conflicts) tuple of lists of users.
+    """
+    # The last copy of a user wins when a page boundary repeats it
+    users = list({user.openid_user_id: user for user in users}.values())
+    ids = [user.openid_user_id for user in users]
+    taken = User.objects.exclude(openid_user_id__in=ids)
+    emails = set(taken.filter(email__in=[user.email for user in users]).values_list("email", flat=True))
+    phones = set(taken.filter(phone_number__in=[user.phone_number for user in users if user.phone_number])
+                 .values_list("phone_number", flat=True))
+    seen_emails, seen_phones = set(), set()
+    upserts, conflicts = [], []
+    for user in users:
+        if user.email in emails or user.email in seen_emails or (
+                user.phone_number and (user.phone_number in phones or user.phone_number in seen_phones)):
+            conflicts.append(user)
+            continue
+        seen_emails.add(user.email)
+        if user.phone_number:
+            seen_phones.add(user.phone_number)
+        upserts.append(user)
+    User.objects.bulk_create(upserts, batch_size=batch_size, update_conflicts=True,
+                             unique_fields=["openid_user_id"], update_fields=UPSERT_FIELDS)
+    return upserts, conflicts
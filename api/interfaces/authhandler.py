@@ -203,9 +203,12 @@ class UserManagement(object):
             return JsonResponse({"message": "Phone number added successfully"}, status=200)
         except Exception as ex:
             return JsonResponse({"error": str(ex)}, status=500)
+
+user_management = UserManagement()
+
 urlpatterns = [
-    path('admin-register/', UserManagement().admin_register, name='admin_register'),
-    path('login/', UserManagement().login, name='login'),
-    path('add-user-number/', UserManagement().add_phone_number, name='add_phone_number'),
+    path('admin-register/', user_management.admin_register, name='admin_register'),
+    path('login/', user_management.login, name='login'),
+    path('add-user-number/', user_management.add_phone_number, name='add_phone_number'),
 
 ]
\ No newline at end of file
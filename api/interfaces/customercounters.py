@@ -0,0 +1,80 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Count, F, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from api.models import ArchivedOrder, Customer, Order
+
+COUNTER_FIELDS = ("order_count", "total_amount", "pending_count", "last_order_at")
+
+
+def record_order_created(order):
+    """
+    Add a new order to its customer's counters.
+    Must run in the transaction that inserted the order so both commit together.
+    @param order: The order just created.
+    @type order: Order
+    """
+    Customer.objects.filter(pk=order.customer_id).update(
+        order_count=F("order_count") + 1,
+        total_amount=F("total_amount") + Decimal(str(order.amount)),
+        pending_count=F("pending_count") + (1 if order.status == "Pending" else 0),
+        last_order_at=Greatest(Coalesce("last_order_at", Value(order.date_created)), Value(order.date_created)),
+    )
+
+
+def record_order_confirmed(order):
+    """
+    Move an order out of its customer's pending count.
+    @param order: The order that left the Pending status.
+    @type order: Order
+    """
+    Customer.objects.filter(pk=order.customer_id, pending_count__gt=0).update(pending_count=F("pending_count") - 1)
+
+
+def record_orders_deleted(orders):
+    """
+    Remove orders that are about to be deleted from their customers' counters.
+    Must run in the transaction that deletes them.
+    @param orders: The orders being deleted.
+    """
+    removed = defaultdict(lambda: [0, Decimal(0), 0, set()])
+    for order in orders:
+        totals = removed[order.customer_id]
+        totals[0] += 1
+        totals[1] += Decimal(str(order.amount))
+        totals[2] += 1 if order.status == "Pending" else 0
+        totals[3].add(order.pk)
+    for customer_id, (count, amount, pending, order_ids) in removed.items():
+        remaining = Order.objects.filter(customer_id=customer_id).exclude(pk__in=order_ids).aggregate(
+            last=Max("date_created"))["last"]
+        archived = ArchivedOrder.objects.filter(customer_id=customer_id).aggregate(last=Max("date_created"))["last"]
+        Customer.objects.filter(pk=customer_id).update(
+            order_count=F("order_count") - count,
+            total_amount=F("total_amount") - amount,
+            pending_count=F("pending_count") - pending,
+            last_order_at=max(filter(None, (remaining, archived)), default=None),
+        )
+
+
+def compute_counters(customer_ids):
+    """
+    Compute the counters of the given customers from their hot and archived orders.
+    @return: A dict of customer id to a dict of COUNTER_FIELDS values.
+    """
+    counters = {
+        customer_id: {"order_count": 0, "total_amount": Decimal(0), "pending_count": 0, "last_order_at": None}
+        for customer_id in customer_ids}
+    for model in (Order, ArchivedOrder):
+        rows = model.objects.filter(customer_id__in=customer_ids).order_by().values("customer_id").annotate(
+            count=Count("id"), total=Sum("amount"), pending=Count("id", filter=Q(status="Pending")),
+            last=Max("date_created"))
+        for row in rows:
+            values = counters[row["customer_id"]]
+            values["order_count"] += row["count"]
+            values["total_amount"] += row["total"] or 0
+            values["pending_count"] += row["pending"]
+            if row["last"] and (values["last_order_at"] is None or row["last"] > values["last_order_at"]):
+                values["last_order_at"] = row["last"]
+    return counters
@@ -1,7 +1,7 @@
 from functools import wraps
 from django.http import JsonResponse
 from api.interfaces.oauth import verify_token
-from api.models import User
+from api.interfaces.principal import get_principal
 from django.utils.decorators import method_decorator
 from django.views import View
 
@@ -24,7 +24,8 @@ def auth_required(view_func):
                 return JsonResponse({"error": "Token payload missing required fields"}, status=400)
 
             # IF YOU WANT TO RESTRICT USER CREATION TO JUST API
-            user = User.objects.filter(openid_user_id=user_id).first()
+            # Cached per worker, a user's row is read at most once per PRINCIPAL_CACHE_TTL
+            user = get_principal(openid_user_id=user_id)
             if not user:
                 return JsonResponse({"error": "User does not exist"}, status=403)
 
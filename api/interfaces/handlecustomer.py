@@ -2,27 +2,56 @@ import json
 import logging
 import random
 import string
+from collections import defaultdict
 
 from django.http import JsonResponse
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
 
+from api.dbrouter import shard_for_code, use_shard
 from api.interfaces.decorator import auth_required
 from api.interfaces.jwttokens import login_required
 from api.models import *
 
 logger = logging.getLogger(__name__)
 
+CUSTOMER_CODE_ALPHABET = string.ascii_uppercase + string.digits
+CUSTOMER_CODE_LENGTH = 8
+
+
+def generate_customer_codes(count):
+    """
+    Allocate a batch of unique customer codes.
+    Candidates are checked against the database with one query per round (per shard when customers are
+    sharded, a code always hashes to the same shard) instead of one per code, only the colliding ones are regenerated.
+    @param count: The number of codes to allocate.
+    @type count: int
+    @return: A list of unique, unused codes.
+    """
+    codes = set()
+    while len(codes) < count:
+        candidates = defaultdict(set)
+        pending = 0
+        while pending < count - len(codes):
+            code = ''.join(random.choices(CUSTOMER_CODE_ALPHABET, k=CUSTOMER_CODE_LENGTH))
+            shard = candidates[shard_for_code(code)]
+            if code not in codes and code not in shard:
+                shard.add(code)
+                pending += 1
+        for alias, shard in candidates.items():
+            with use_shard(alias):
+                taken = set(Customer.objects.filter(code__in=shard).values_list("code", flat=True))
+            codes.update(shard - taken)
+    return list(codes)
+
+
 class CustomersManager:
     def _generate_customer_code(self):
         """
         Generate a unique customer code.
         The code consists of 8 uppercase letters and digits.
         """
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-        if Customer.objects.filter(code=code).exists():
-            return self._generate_customer_code()
-        return code
+        return generate_customer_codes(1)[0]
 
     @csrf_exempt
     @login_required
@@ -49,11 +78,12 @@ class CustomersManager:
             if not user.phone_number:
                 return JsonResponse({"error": "User phone number is required kindly add phone number to the user "}, status=400)
 
-            customer = Customer.objects.create(
-                name=name,
-                user = user,
-                code=code
-            )
+            with use_shard(shard_for_code(code)):
+                customer = Customer.objects.create(
+                    name=name,
+                    user = user,
+                    code=code
+                )
             return JsonResponse(
                 {"message": "Customer created successfully", "customer_id": str(customer.id),"customer_code":code}, status=201)
         except Exception as ex:
@@ -1,24 +1,57 @@
 import json
 import logging
+from datetime import timedelta
+from operator import itemgetter
 
-from django.http import JsonResponse
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
 from django.urls import path
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
+from api.dbrouter import merge, read_replica, scatter, shard_db, shard_for_code, use_shard
+from api.interfaces.customercounters import record_order_confirmed, record_order_created
+from api.interfaces.idempotency import idempotent
+from api.interfaces.jobqueue import enqueue
+from api.interfaces.orderchanges import CursorExpired, changes_since
+from api.interfaces.orderevents import notify_order_status, order_events
 from api.interfaces.jwttokens import login_required
+from api.interfaces.orderfilters import build_order_filters, encode_cursor, ordering, parse_limit, parse_page
+from api.interfaces.orderexport import EXPORT_FORMATS, export_queryset, gzip_stream, iter_export_chunks, \
+    parse_bound, parse_checkpoint
+from api.interfaces.projection import parse_fields
+from api.interfaces.serializers import CustomerOrderSerializer, OrderDetailSerializer, OrderSerializer
 from api.interfaces.smsnotify import SendSms
-from api.models import Order, Customer
+from api.models import ArchivedOrder, Order, Customer
 
 logger = logging.getLogger(__name__)
 
+# Staff-wide order listings are sorted by these, so the rows of each shard can be merged
+LISTING_KEYS = ("date_created", "id")
+
+
+def send_order_sms(phone_number, message):
+    """
+    Job texting a customer about their order, queued by the order handlers. Raises when the SMS fails so
+    the job is retried.
+    """
+    response = SendSms().send(phone_number, message)
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return response
+
+
 class OrdersManager:
     """
     Orders management interface.
     """
     @csrf_exempt
     @login_required
+    @idempotent
     def create_order(self, request):
         """
         Attempts to create an order.
+        Retries carrying the same Idempotency-Key header replay the first response.
         @param request: The Django HTTP request received.
         @type request: HttpRequest
         @response with the details.
@@ -39,17 +72,22 @@ class OrdersManager:
             if not amount:
                 return JsonResponse({"error": "Amount is required"}, status=400)
 
-            customer = Customer.objects.filter(code=customer_code).first()
-
-            # Create order in the database
-            order = Order.objects.create(
-                customer=customer,
-                item=item,
-                amount=amount,
-                status=status
-            )
-            afrika_feedback = SendSms().send(customer.user.phone_number, f"Dear {customer.name}, your order for {item} has been created successfully. Order ID: {order.id}. Amount: {amount}. Status: {status}. Thank you for your business.")
-            return JsonResponse({"message": "Order created successfully", "order_id": str(order.id),"Sms message status":afrika_feedback}, status=201)
+            with use_shard(shard_for_code(customer_code)):
+                customer = Customer.objects.filter(code=customer_code).first()
+
+                # Create order in the database
+                with transaction.atomic(using=shard_db()):
+                    order = Order.objects.create(
+                        customer=customer,
+                        item=item,
+                        amount=amount,
+                        status=status
+                    )
+                    record_order_created(order)
+                    notify_order_status(order.id, customer.id, order.status, order.date_modified)
+                    # Texted by a worker once the order is committed
+                    enqueue(send_order_sms, args=(customer.user.phone_number, f"Dear {customer.name}, your order for {item} has been created successfully. Order ID: {order.id}. Amount: {amount}. Status: {status}. Thank you for your business."))
+            return JsonResponse({"message": "Order created successfully", "order_id": str(order.id),"Sms message status":{"status": "Queued"}}, status=201)
         except Exception as ex:
             logger.exception("Error creating order: %s", ex)
             return JsonResponse({"error": str(ex)}, status=500)
@@ -65,41 +103,127 @@ class OrdersManager:
         @type order_id: str
         """
         try:
-            order = Order.objects.get(id=order_id)
-            order_data = {
-                "id": str(order.id),
-                "customer_id": str(order.customer.id),
-                "item": order.item,
-                "amount": order.amount,
-                "status": order.status,
-                "date_created": order.date_created.isoformat()
-            }
-            return JsonResponse({"order": order_data}, status=200)
-        except Order.DoesNotExist:
-            return JsonResponse({"error": "Order not found"}, status=404)
+            serializer = OrderDetailSerializer()
+            order = None
+            # The order id does not tell the shard, each is asked in turn
+            for orders, archived in zip(scatter(Order.objects.filter(id=order_id)),
+                                        scatter(ArchivedOrder.objects.filter(id=order_id))):
+                # Closed orders may have been moved to the archive
+                order = serializer.rows(orders).first() or serializer.rows(archived).first()
+                if order is not None:
+                    break
+            if order is None:
+                return JsonResponse({"error": "Order not found"}, status=404)
+            return JsonResponse({"order": serializer.serialize_one(order)}, status=200)
         except Exception as ex:
             logger.exception("Error retrieving order: %s", ex)
             return JsonResponse({"error": str(ex)}, status=500)
 
     @csrf_exempt
     @login_required
+    @read_replica
     def get_all_orders(self, request):
         """
         Attempts to get all orders.
+        date_from and date_to bound date_created, date_from defaults to ORDER_LISTING_DAYS ago.
+        fields (comma separated) narrows the returned fields, only those columns are read.
         @param request: The Django HTTP request received.
         """
         try:
-            orders = Order.objects.all().values("id", "customer__id", "item", "amount", "status", "date_created")
-            return JsonResponse({"orders": list(orders)}, status=200)
+            try:
+                date_from = parse_bound(request.GET.get("date_from"))
+                date_to = parse_bound(request.GET.get("date_to"), end=True)
+                serializer = OrderSerializer(parse_fields(request.GET.get("fields"), OrderSerializer.FIELDS))
+            except ValueError as ex:
+                return JsonResponse({"error": str(ex)}, status=400)
+            # Both bounds let Postgres prune the partitions outside them when the orders table is partitioned
+            now = timezone.now()
+            orders = Order.objects.filter(
+                date_created__gte=date_from or now - timedelta(days=settings.ORDER_LISTING_DAYS),
+                date_created__lt=date_to or now + timedelta(days=1))
+            # Orders come in (date_created, id) order, merged from every shard when customers are sharded
+            rows = serializer.rows(orders.order_by(*LISTING_KEYS), *LISTING_KEYS)
+            key = itemgetter(*(serializer.columns_with(*LISTING_KEYS).index(column) for column in LISTING_KEYS))
+            return JsonResponse({"orders": serializer.serialize(merge(scatter(rows), key=key))}, status=200)
         except Exception as ex:
             logger.exception("Error retrieving all orders: %s", ex)
             return JsonResponse({"error": str(ex)}, status=500)
 
     @csrf_exempt
     @login_required
+    def export_orders(self, request):
+        """
+        Stream orders as CSV or NDJSON in (date_created, id) order.
+        Query parameters: format (csv|ndjson), date_from, date_to, customer_code, status (comma separated),
+        after (a `<date_created>,<id>` checkpoint to resume from) and gzip (1 to compress on the fly).
+        @param request: The Django HTTP request received.
+        @type request: HttpRequest
+        """
+        try:
+            if request.method != "GET":
+                return JsonResponse({"error": "Invalid request method, kindly use GET Request"}, status=405)
+            export_format = request.GET.get("format", "csv")
+            if export_format not in EXPORT_FORMATS:
+                return JsonResponse({"error": "Format must be csv or ndjson"}, status=400)
+            try:
+                date_from = parse_bound(request.GET.get("date_from"))
+                date_to = parse_bound(request.GET.get("date_to"), end=True)
+                after = parse_checkpoint(request.GET["after"]) if request.GET.get("after") else None
+            except ValueError as ex:
+                return JsonResponse({"error": str(ex)}, status=400)
+            statuses = [status for status in request.GET.get("status", "").split(",") if status]
+            orders = export_queryset(
+                date_from=date_from, date_to=date_to, customer_code=request.GET.get("customer_code"),
+                statuses=statuses, after=after)
+
+            chunks = (text for text, _, _ in iter_export_chunks(orders, export_format, include_header=after is None))
+            filename = f"orders.{export_format}"
+            content_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+            if request.GET.get("gzip") in ("1", "true"):
+                response = StreamingHttpResponse(gzip_stream(chunks), content_type="application/gzip")
+                filename += ".gz"
+            else:
+                response = StreamingHttpResponse(chunks, content_type=f"{content_type}; charset=utf-8")
+            response["Content-Disposition"] = f'attachment; filename="{filename}"'
+            return response
+        except Exception as ex:
+            logger.exception("Error exporting orders: %s", ex)
+            return JsonResponse({"error": str(ex)}, status=500)
+
+    @csrf_exempt
+    @login_required
+    def get_order_changes(self, request):
+        """
+        Incremental feed of order changes for mirrors: orders created or modified, and deleted orders, after
+        the since cursor (the next_cursor of the previous page, absent on the first call), limit at a time.
+        Reads the primary, a lagging replica could let the cursor pass changes it has not replayed yet.
+        @param request: The Django HTTP request received.
+        @type request: HttpRequest
+        """
+        try:
+            if request.method != "GET":
+                return JsonResponse({"error": "Invalid request method, kindly use GET Request"}, status=405)
+            try:
+                limit = parse_limit(request.GET)
+                changes, next_cursor, has_more = changes_since(request.GET.get("since"), limit)
+            except ValueError as ex:
+                return JsonResponse({"error": str(ex)}, status=400)
+            except CursorExpired as ex:
+                return JsonResponse({"error": str(ex), "code": "cursor_expired"}, status=410)
+            return JsonResponse({"changes": changes, "next_cursor": next_cursor, "has_more": has_more}, status=200)
+        except Exception as ex:
+            logger.exception("Error retrieving order changes: %s", ex)
+            return JsonResponse({"error": str(ex)}, status=500)
+
+    @csrf_exempt
+    @login_required
+    @read_replica
     def get_customer_orders(self, request):
         """
-        Attempts to get orders for a specific customer.
+        Attempts to get orders for a specific customer, one keyset paginated page at a time.
+        Optional filters: status, date_from, date_to, amount_min, amount_max, item (substring) and item_prefix.
+        sort is one of date_created, -date_created (default), amount or -amount, limit caps the page size and
+        cursor is the next_cursor of the previous page. fields (a list or comma separated) narrows the returned fields.
         @param request: The Django HTTP request received.
 
         """
@@ -110,12 +234,30 @@ class OrdersManager:
             customer_code = data.get("customer_code", "")
             if not customer_code:
                 return JsonResponse({"error": "Customer code is required"}, status=400)
-            customer = Customer.objects.filter(code=customer_code).first()
-            if not customer:
-                return JsonResponse({"error": "Customer not found"}, status=404)
-            orders = Order.objects.filter(
-                customer=customer).values("id", "item", "amount", "status", "date_created")
-            return JsonResponse({"orders": list(orders)}, status=200)
+            try:
+                filters = build_order_filters(data)
+                sort, limit, cursor = parse_page(data)
+                serializer = CustomerOrderSerializer(parse_fields(data.get("fields"), CustomerOrderSerializer.FIELDS))
+            except ValueError as ex:
+                return JsonResponse({"error": str(ex)}, status=400)
+            with use_shard(shard_for_code(customer_code)):
+                customer = Customer.objects.filter(code=customer_code).first()
+                if not customer:
+                    return JsonResponse({"error": "Customer not found"}, status=404)
+                # The cursor keys are always read, even when they are not returned
+                cursor_keys = ("id", sort.lstrip("-"))
+                # Orders never predate their customer, the bound prunes older partitions
+                hot = serializer.rows(
+                    Order.objects.filter(filters, cursor, customer=customer, date_created__gte=customer.date_created),
+                    *cursor_keys)
+                archived = serializer.rows(
+                    ArchivedOrder.objects.filter(filters, cursor, customer=customer), *cursor_keys)
+                orders = list(hot.union(archived, all=True).order_by(*ordering(sort))[:limit + 1])
+            next_cursor = None
+            if len(orders) > limit:
+                last = dict(zip(serializer.columns_with(*cursor_keys), orders[limit - 1]))
+                next_cursor = encode_cursor(sort, last)
+            return JsonResponse({"orders": serializer.serialize(orders[:limit]), "next_cursor": next_cursor}, status=200)
         except Exception as ex:
             logger.exception("Error retrieving customer orders: %s", ex)
             return JsonResponse({"error": str(ex)}, status=500)
@@ -140,14 +282,23 @@ class OrdersManager:
             customer_code = data.get("customer_code", "")
             if not customer_code:
                 return JsonResponse({"error": "Customer code is required"}, status=400)
-            customer = Customer.objects.filter(code=customer_code).first()
-            if not customer:
-                return JsonResponse({"error": "Customer not found"}, status=404)
-            order = Order.objects.get(id=order_id, customer=customer)
-            if order.status != "Pending":
-                return JsonResponse({"error": "Order cannot be confirmed"}, status=400)
-            order.status = "Confirmed"
-            order.save()
+            with use_shard(shard_for_code(customer_code)):
+                customer = Customer.objects.filter(code=customer_code).first()
+                if not customer:
+                    return JsonResponse({"error": "Customer not found"}, status=404)
+                order = Order.objects.get(id=order_id, customer=customer, date_created__gte=customer.date_created)
+                if order.status != "Pending":
+                    return JsonResponse({"error": "Order cannot be confirmed"}, status=400)
+                with transaction.atomic(using=shard_db()):
+                    # Conditional update so concurrent confirmations only count once
+                    date_modified = timezone.now()
+                    confirmed = Order.objects.filter(
+                        id=order.id, date_created=order.date_created, status="Pending").update(
+                        status="Confirmed", date_modified=date_modified, synced=False)
+                    if not confirmed:
+                        return JsonResponse({"error": "Order cannot be confirmed"}, status=400)
+                    record_order_confirmed(order)
+                    notify_order_status(order.id, customer.id, "Confirmed", date_modified)
             return JsonResponse({"message": "Order confirmed successfully"}, status=200)
         except Order.DoesNotExist:
             return JsonResponse({"error": "Order not found"}, status=404)
@@ -159,11 +310,16 @@ class OrdersManager:
 
 
 
+orders_manager = OrdersManager()
+
 urlpatterns = [
-    path('create/', OrdersManager().create_order, name='create_order'),
-    path('<str:order_id>/', OrdersManager().get_order, name='get_order'),
-    path('', OrdersManager().get_all_orders, name='get_all_orders'),
-    path('customer/all-orders/', OrdersManager().get_customer_orders, name='get_customer_orders'),
-    path('customer-order/confirm/', OrdersManager().confirm_order, name='confirm_order'),
+    path('create/', orders_manager.create_order, name='create_order'),
+    path('export/', orders_manager.export_orders, name='export_orders'),
+    path('changes/', orders_manager.get_order_changes, name='get_order_changes'),
+    path('events/<str:customer_code>/', order_events, name='order_events'),
+    path('<str:order_id>/', orders_manager.get_order, name='get_order'),
+    path('', orders_manager.get_all_orders, name='get_all_orders'),
+    path('customer/all-orders/', orders_manager.get_customer_orders, name='get_customer_orders'),
+    path('customer-order/confirm/', orders_manager.confirm_order, name='confirm_order'),
 
 ]
\ No newline at end of file
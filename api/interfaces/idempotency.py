@@ -0,0 +1,149 @@
+import hashlib
+import logging
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from api.models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+POLL_INTERVAL = 0.05
+
+
+def idempotent(view_func):
+    """
+    Decorator making a handler safe to retry with an Idempotency-Key header.
+    The first request with a key claims it and runs the handler, its response is stored for IDEMPOTENCY_KEY_TTL
+    seconds. Retries replay the stored response without running the handler again. A duplicate that arrives
+    while the first is still running waits for it (single flight) instead of executing in parallel. On Postgres
+    the running request holds an advisory lock on the key, so only a request that died loses it to a duplicate.
+    Keys are scoped to the authenticated user and the handler, so it must be applied under login_required.
+    Requests without the header run as usual.
+    """
+    endpoint = view_func.__name__
+
+    @wraps(view_func)
+    def _wrapped_view(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or request.method != "POST":
+            return view_func(self, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field("key").max_length:
+            return JsonResponse({"error": "Idempotency-Key is too long"}, status=400)
+
+        user_id = str(getattr(request, "user_id", ""))
+        request_hash = hashlib.sha256(request.body).hexdigest()
+        record, owner = _claim(user_id, endpoint, key, request_hash)
+        if record.request_hash != request_hash:
+            return JsonResponse({"error": "Idempotency-Key was already used with a different request"}, status=422)
+        if not owner:
+            record = _wait_for(record)
+            if record is None:
+                return JsonResponse({"error": "A request with this Idempotency-Key is still in progress"}, status=409)
+            response = HttpResponse(bytes(record.response_body), status=record.status_code, content_type=record.content_type)
+            response["Idempotent-Replayed"] = "true"
+            return response
+
+        _advisory_lock("pg_advisory_lock", record)
+        try:
+            try:
+                response = view_func(self, request, *args, **kwargs)
+            except Exception:
+                IdempotencyKey.objects.filter(pk=record.pk).delete()
+                raise
+            if response.status_code >= 500 or getattr(response, "streaming", False):
+                # Failures are not remembered so the client can retry them
+                IdempotencyKey.objects.filter(pk=record.pk).delete()
+            elif not IdempotencyKey.objects.filter(pk=record.pk).update(
+                    status_code=response.status_code, response_body=response.content,
+                    content_type=response.get("Content-Type", "")):
+                logger.error(f"Idempotency-Key {key!r} of {endpoint} was taken over while its request ran, "
+                             f"the response was not stored and a duplicate may have executed")
+        finally:
+            _advisory_lock("pg_advisory_unlock", record)
+        return response
+
+    return _wrapped_view
+
+
+def _claim(user_id, endpoint, key, request_hash):
+    """
+    Insert the key or find the request that already holds it.
+    The unique constraint makes the insert the single point where concurrent duplicates are told apart.
+    Expired keys and in-flight keys whose lease ran out are taken over, the latter only when no request holds
+    their advisory lock any more.
+    @return: A (record, owner) tuple, owner is True when this request must execute the handler.
+    """
+    now = timezone.now()
+    while True:
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user_id=user_id, endpoint=endpoint, key=key, request_hash=request_hash,
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL))
+            return record, True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user_id=user_id, endpoint=endpoint, key=key).first()
+        if record is None:
+            continue
+        stale = record.status_code is None and record.date_created < now - timedelta(
+            seconds=settings.IDEMPOTENCY_LEASE_SECONDS) and _owner_gone(record)
+        if record.expires_at > now and not stale:
+            return record, False
+        # Only one of the racing requests manages to remove the old record, the loop retries the insert
+        IdempotencyKey.objects.filter(pk=record.pk, date_created=record.date_created).delete()
+
+
+def _advisory_lock(function, record):
+    """
+    Call a Postgres advisory lock function, e.g. pg_advisory_lock, on the key of record, on its database.
+    Session level locks outlive the handler's transactions and go with the connection of a request that died.
+    @return: The function's result, None on other databases.
+    """
+    connection = connections[router.db_for_write(IdempotencyKey)]
+    if connection.vendor != "postgresql":
+        return None
+    digest = hashlib.blake2b(f"{record.user_id}:{record.endpoint}:{record.key}".encode(), digest_size=8).digest()
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {function}(%s)", [int.from_bytes(digest, "big", signed=True)])
+        return cursor.fetchone()[0]
+
+
+def _owner_gone(record):
+    """Whether the request that claimed an in-flight key no longer holds its lock, always so without locks."""
+    if _advisory_lock("pg_try_advisory_lock", record) is False:
+        return False
+    _advisory_lock("pg_advisory_unlock", record)
+    return True
+
+
+def _wait_for(record):
+    """
+    Wait until the request holding the key stores its response.
+    @return: The completed record, or None if it did not complete within IDEMPOTENCY_WAIT_SECONDS.
+    """
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while record.status_code is None:
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+        if record is None:
+            # The first request failed and released the key
+            return None
+    return record
+
+
+def purge_expired_keys():
+    """
+    Delete expired idempotency records.
+    @return: The number of records deleted.
+    """
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
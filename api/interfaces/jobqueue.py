@@ -0,0 +1,110 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from api.dbrouter import shard_db
+from api.models import Job
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of run_next()
+DONE, RETRIED, FAILED = "done", "retried", "failed"
+
+
+def func_path(func):
+    """The dotted path a job function is stored and imported by, e.g. api.interfaces.handleorders.send_order_sms"""
+    return func if isinstance(func, str) else f"{func.__module__}.{func.__qualname__}"
+
+
+def enqueue(func, args=(), kwargs=None, priority=0, run_at=None, max_attempts=None):
+    """
+    Defer a call of func to the `run_workers` workers. Jobs only run once the caller's transaction commits:
+    on the default database the job is inserted within that transaction and rolled back with it, inside a
+    transaction on a shard it is inserted right after the shard commits.
+    @param func: A module level function, or its dotted path. args and kwargs must be JSON serializable.
+    @param priority: Higher runs first among due jobs.
+    @param run_at: Not before this time, now by default.
+    @param max_attempts: Runs before the job is given up as failed, JOB_MAX_ATTEMPTS by default.
+    @return: The Job, not saved yet when it waits for a shard to commit.
+    """
+    job = Job(
+        func=func_path(func), args=list(args), kwargs=kwargs or {}, priority=priority,
+        run_at=run_at or timezone.now(), max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS)
+    alias = shard_db()
+    if alias == DEFAULT_DB_ALIAS:
+        job.save(using=DEFAULT_DB_ALIAS)
+    else:
+        transaction.on_commit(lambda: job.save(using=DEFAULT_DB_ALIAS), using=alias)
+    return job
+
+
+def retry_delay(attempts):
+    """Exponential backoff after a failed run: JOB_RETRY_SECONDS, then twice that, and so on."""
+    return timedelta(seconds=settings.JOB_RETRY_SECONDS * 2 ** (attempts - 1))
+
+
+def run_next():
+    """
+    Claim the most urgent due job with SKIP LOCKED and run it, so any number of workers take different jobs.
+    The row stays locked while the job runs, and the job's writes to the default database commit together
+    with its removal. A worker that dies mid-job rolls back and the job is due again at once.
+    A failed run is retried after retry_delay() until max_attempts, then the job is kept as failed.
+    @return: A (func, outcome) tuple, outcome is DONE, RETRIED or FAILED. None when no job is due.
+    """
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        job = (Job.objects.using(DEFAULT_DB_ALIAS).select_for_update(skip_locked=True)
+               .filter(status=Job.QUEUED, run_at__lte=timezone.now()).order_by("-priority", "run_at").first())
+        if job is None:
+            return None
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                import_string(job.func)(*job.args, **job.kwargs)
+        except Exception as ex:
+            job.attempts += 1
+            job.last_error = f"{type(ex).__name__}: {ex}"
+            if job.attempts >= job.max_attempts:
+                job.status = Job.FAILED
+                outcome = FAILED
+                logger.error("Job %s %s failed for good after %s attempts: %s", job.id, job.func, job.attempts, ex)
+            else:
+                job.run_at = timezone.now() + retry_delay(job.attempts)
+                outcome = RETRIED
+                logger.warning("Job %s %s failed, attempt %s of %s: %s",
+                               job.id, job.func, job.attempts, job.max_attempts, ex)
+            job.save(update_fields=["attempts", "last_error", "status", "run_at"])
+            return job.func, outcome
+        job.delete()
+    return job.func, DONE
+
+
+def retry_failed(func=None):
+    """
+    Queue the failed jobs, of func only if given, again for a full set of attempts.
+    @return: The number of jobs queued.
+    """
+    jobs = Job.objects.using(DEFAULT_DB_ALIAS).filter(status=Job.FAILED)
+    if func:
+        jobs = jobs.filter(func=func_path(func))
+    return jobs.update(status=Job.QUEUED, attempts=0, run_at=timezone.now())
+
+
+def queue_stats():
+    """
+    @return: Per job function: the jobs due now, those scheduled later, the failed ones and how many seconds
+    the oldest due job has waited (None when none is due).
+    """
+    now = timezone.now()
+    queued = Q(status=Job.QUEUED)
+    due = queued & Q(run_at__lte=now)
+    stats = (Job.objects.using(DEFAULT_DB_ALIAS).values("func")
+             .annotate(due=Count("id", filter=due), scheduled=Count("id", filter=queued & Q(run_at__gt=now)),
+                       failed=Count("id", filter=Q(status=Job.FAILED)), oldest_due=Min("run_at", filter=due))
+             .order_by("func"))
+    return [{"func": row["func"], "due": row["due"], "scheduled": row["scheduled"], "failed": row["failed"],
+             "wait_seconds": (now - row["oldest_due"]).total_seconds() if row["oldest_due"] else None}
+            for row in stats]
@@ -4,21 +4,49 @@ import logging
 from django.conf import settings
 from django.http import JsonResponse
 from django.core.cache import cache
-from functools import wraps
+from django.utils.functional import SimpleLazyObject
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from collections import namedtuple
+from functools import lru_cache, wraps
 import secrets
 
+from api.interfaces.principal import get_principal
+
 logger = logging.getLogger(__name__)
 
-# JWT settings with better defaults
-JWT_SECRET = getattr(settings, 'JWT_SECRET', None)
-if not JWT_SECRET:
-    raise RuntimeError("JWT_SECRET must be set in Django settings")
+JWTSettings = namedtuple('JWTSettings', ('secret', 'algorithm', 'expiration', 'audience', 'issuer', 'leeway'))
+
+
+@lru_cache(maxsize=None)
+def jwt_settings():
+    """
+    Reads the JWT settings on first use rather than at import, so that importing this module (every URLconf
+    and management command does) neither touches settings nor fails when JWT_SECRET is not configured.
+
+    Returns:
+        JWTSettings: The settings, with defaults for the optional ones
+
+    Raises:
+        RuntimeError: If JWT_SECRET is not set
+    """
+    secret = getattr(settings, 'JWT_SECRET', None)
+    if not secret:
+        raise RuntimeError("JWT_SECRET must be set in Django settings")
+    return JWTSettings(
+        secret=secret,
+        algorithm=getattr(settings, 'JWT_ALGORITHM', 'HS256'),
+        expiration=getattr(settings, 'JWT_TOKEN_EXPIRATION', 30 * 24 * 60),  # 30 days in minutes
+        audience=getattr(settings, 'JWT_AUDIENCE', 'your-app-name'),
+        issuer=getattr(settings, 'JWT_ISSUER', 'your-api-domain'),
+        leeway=getattr(settings, 'JWT_LEEWAY', 60),  # 60 seconds leeway for clock skew
+    )
+
 
-JWT_ALGORITHM = getattr(settings, 'JWT_ALGORITHM', 'HS256')
-JWT_TOKEN_EXPIRATION = getattr(settings, 'JWT_TOKEN_EXPIRATION', 30 * 24 * 60)  # 30 days in minutes
-JWT_AUDIENCE = getattr(settings, 'JWT_AUDIENCE', 'your-app-name')
-JWT_ISSUER = getattr(settings, 'JWT_ISSUER', 'your-api-domain')
-JWT_LEEWAY = getattr(settings, 'JWT_LEEWAY', 60)  # 60 seconds leeway for clock skew
+@receiver(setting_changed)
+def reset_jwt_settings(setting, **kwargs):
+    if setting.startswith('JWT_'):
+        jwt_settings.cache_clear()
 
 
 class JWTError(Exception):
@@ -51,6 +79,7 @@ def generate_token(user):
     Returns:
         dict: Dictionary containing token and expiration
     """
+    config = jwt_settings()
     iat = datetime.utcnow()
     jti = secrets.token_hex(16)  # JWT ID for token revocation
 
@@ -59,16 +88,16 @@ def generate_token(user):
         'username': user.name,
         'email': user.email,
         'is_staff': user.role == 'admin',
-        'exp': iat + timedelta(minutes=JWT_TOKEN_EXPIRATION),
+        'exp': iat + timedelta(minutes=config.expiration),
         'iat': iat,
-        'iss': JWT_ISSUER,
-        'aud': JWT_AUDIENCE,
+        'iss': config.issuer,
+        'aud': config.audience,
         'jti': jti
     }
 
     return {
-        'token': jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM),
-        'expires_in': JWT_TOKEN_EXPIRATION * 60  # in seconds
+        'token': jwt.encode(payload, config.secret, algorithm=config.algorithm),
+        'expires_in': config.expiration * 60  # in seconds
     }
 
 
@@ -87,6 +116,7 @@ def decode_token(token):
         InvalidTokenError: If token is invalid
         BlacklistedTokenError: If token has been blacklisted
     """
+    config = jwt_settings()
     try:
         # Check if token is blacklisted
         if is_token_blacklisted(token):
@@ -95,19 +125,19 @@ def decode_token(token):
         # Verify and decode the token
         payload = jwt.decode(
             token,
-            JWT_SECRET,
-            algorithms=[JWT_ALGORITHM],
+            config.secret,
+            algorithms=[config.algorithm],
             options={
                 'verify_signature': True,
                 'verify_exp': True,
                 'verify_iat': True,
-                'verify_aud': True if JWT_AUDIENCE else False,
-                'verify_iss': True if JWT_ISSUER else False,
+                'verify_aud': True if config.audience else False,
+                'verify_iss': True if config.issuer else False,
                 'require': ['exp', 'iat', 'user_id']
             },
-            audience=JWT_AUDIENCE,
-            issuer=JWT_ISSUER,
-            leeway=JWT_LEEWAY
+            audience=config.audience,
+            issuer=config.issuer,
+            leeway=config.leeway
         )
         return payload
     except jwt.ExpiredSignatureError:
@@ -250,6 +280,8 @@ def login_required(view_func=None, *, required=True, verify_staff=False):
                 request.username = payload.get('username', '')
                 request.is_authenticated = True
                 request.token_payload = payload  # Store full payload
+                # The user's Principal, only loaded (and then cached) when a handler uses it
+                request.principal = SimpleLazyObject(lambda: get_principal(user_id=payload['user_id']))
 
                 # Call the view function with the right arguments
                 if len(args) >= 2 and hasattr(args[1], 'method'):
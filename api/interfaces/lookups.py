@@ -1,14 +1,95 @@
 from django.core.paginator import Paginator
 from django.http import JsonResponse
 import logging
+from operator import itemgetter
 
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
 
+from api.dbrouter import merge, read_replica, scatter
 from api.interfaces.jwttokens import login_required
+from api.interfaces.orderfilters import cursor_filter, encode_cursor
+from api.interfaces.projection import parse_fields
+from api.interfaces.serializers import CustomerSerializer, UserSerializer
+from api.interfaces.syncengine import sync_lag, sync_models
 from api.models import User, Customer
 
 logger = logging.getLogger(__name__)
+
+DEFAULT_PER_PAGE = 10
+MAX_PER_PAGE = 100
+# Lookups page in this order, backed by a (date_created, id) index on both tables
+PAGE_KEYS = ("date_created", "id")
+
+
+def paginate(params, queryset, serializer, key):
+    """
+    Serialize one page of a lookup, in PAGE_KEYS order.
+    With a cursor parameter (empty for the first page) pages are keyset paginated, each one is a single
+    index range scan whatever its depth. Without one the page parameter is used and a total count is returned.
+    Both modes return next_cursor. Sharded customers are paged by cursor only, one page is read from every
+    shard and the pages are merged.
+    @param params: The query parameters.
+    @param key: The name of the list in the response.
+    @return: The response data.
+    @raise ValueError: When a parameter is malformed.
+    """
+    try:
+        per_page = int(params.get("per_page") or DEFAULT_PER_PAGE)
+        page = int(params.get("page") or 1)
+    except ValueError:
+        raise ValueError("page and per_page must be numbers")
+    if not 1 <= per_page <= MAX_PER_PAGE:
+        raise ValueError(f"per_page must be between 1 and {MAX_PER_PAGE}")
+    if page < 1:
+        raise ValueError("page must be positive")
+    sharded = len(scatter(queryset)) > 1
+    extra = (*PAGE_KEYS, "user_id") if sharded else PAGE_KEYS
+    columns = serializer.columns_with(*extra)
+    rows = serializer.rows(queryset.order_by(*PAGE_KEYS), *extra)
+    if "cursor" in params:
+        if params["cursor"]:
+            rows = rows.filter(cursor_filter(PAGE_KEYS[0], params["cursor"]))
+        order = itemgetter(*(columns.index(column) for column in PAGE_KEYS))
+        rows = list(merge([shard[:per_page + 1] for shard in scatter(rows)], key=order, limit=per_page + 1))
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        if sharded:
+            rows = attach_users(rows, columns)
+        data = {key: serializer.serialize(rows), "per_page": per_page}
+    elif sharded:
+        raise ValueError("Customers are sharded, page with cursor instead of page")
+    else:
+        paginator = Paginator(rows, per_page)
+        paginated = paginator.get_page(page)
+        rows, has_next = list(paginated), paginated.has_next()
+        data = {key: serializer.serialize(rows), "page": page, "per_page": per_page, "total_pages": paginator.num_pages}
+    last = dict(zip(columns, rows[-1])) if rows else None
+    data["next_cursor"] = encode_cursor(PAGE_KEYS[0], last) if has_next else None
+    return data
+
+
+def attach_users(rows, columns):
+    """
+    Fill in the user__ columns of customer rows read from shards. Users live on the default database, the
+    shards' users table is empty, so they are read from there in one query.
+    """
+    fields = [(index, column[len("user__"):]) for index, column in enumerate(columns) if column.startswith("user__")]
+    if not fields:
+        return rows
+    user_index = columns.index("user_id")
+    users = {
+        user["id"]: user for user in User.objects.filter(id__in={row[user_index] for row in rows})
+        .values("id", *(field for _, field in fields))}
+    filled = []
+    for row in rows:
+        row, user = list(row), users.get(row[user_index], {})
+        for index, field in fields:
+            row[index] = user.get(field)
+        filled.append(tuple(row))
+    return filled
+
+
 class LookupManagement:
     """
     A class to manage user authentication and authorization using Auth0.
@@ -18,33 +99,23 @@ class LookupManagement:
     @staticmethod
     @csrf_exempt
     @login_required
+    @read_replica
     def lookup_all_users(request):
         """
         Lookup all users in the database with pagination.
+        per_page is capped at MAX_PER_PAGE, pass cursor (the previous next_cursor, empty for the first page)
+        instead of page for keyset pagination. fields (comma separated) narrows the returned fields,
+        only those columns are read.
         """
         try:
             if request.method != "POST":
                 return JsonResponse({"error": "Invalid request method, kindly use POST Request"}, status=405)
-            page = int(request.GET.get("page", 1))
-            per_page = int(request.GET.get("per_page", 10))
-            users = User.objects.all()
-            paginator = Paginator(users, per_page)
-            paginated_users = paginator.get_page(page)
-            return JsonResponse({
-                "users": [
-                    {
-                        "id": str(user.id),
-                        "email": user.email,
-                        "name": user.name,
-                        "role": user.role,
-                        "phone_number": user.phone_number,
-                    }
-                    for user in paginated_users
-                ],
-                "page": page,
-                "per_page": per_page,
-                "total_pages": paginator.num_pages,
-            }, status=200)
+            try:
+                serializer = UserSerializer(parse_fields(request.GET.get("fields"), UserSerializer.FIELDS))
+                data = paginate(request.GET, User.objects.all(), serializer, "users")
+            except ValueError as ex:
+                return JsonResponse({"error": str(ex)}, status=400)
+            return JsonResponse(data, status=200)
         except Exception as e:
             logger.error(f"Error fetching users: {e}")
             return JsonResponse({"error": f"Error fetching users: {e}"}, status=400)
@@ -52,38 +123,43 @@ class LookupManagement:
     @staticmethod
     @csrf_exempt
     @login_required
+    @read_replica
     def lookup_customers(request):
         """
-        Lookup all customers in the database with pagination.
+        Lookup all customers in the database with pagination, with the same paging parameters as lookup_all_users.
+        fields (comma separated) narrows the returned fields, the users table is only joined for user fields.
         """
         try:
             if request.method != "POST":
                 return JsonResponse({"error": "Invalid request method, kindly use POST Request"}, status=405)
-            page = int(request.GET.get("page", 1))
-            per_page = int(request.GET.get("per_page", 10))
-            customers = Customer.objects.all()
-            paginator = Paginator(customers, per_page)
-            paginated_customers = paginator.get_page(page)
-            return JsonResponse({
-                "customers": [
-                    {
-                        "id": str(customer.id),
-                        "email": customer.user.email,
-                        "name": customer.user.name,
-                        "phone_number": customer.user.phone_number,
-                        "code": customer.code,
-                    }
-                    for customer in paginated_customers
-                ],
-                "page": page,
-                "per_page": per_page,
-                "total_pages": paginator.num_pages,
-            }, status=200)
+            try:
+                serializer = CustomerSerializer(parse_fields(request.GET.get("fields"), CustomerSerializer.FIELDS))
+                data = paginate(request.GET, Customer.objects.all(), serializer, "customers")
+            except ValueError as ex:
+                return JsonResponse({"error": str(ex)}, status=400)
+            return JsonResponse(data, status=200)
         except Exception as e:
             logger.error(f"Error fetching customers: {e}")
             return JsonResponse({"error": f"Error fetching customers: {e}"}, status=400)
 
+    @staticmethod
+    @csrf_exempt
+    @login_required(verify_staff=True)
+    def lookup_sync_lag(request):
+        """
+        The sync lag of each sync model: unsynced rows, the oldest unsynced change and its age in seconds.
+        Meant for monitoring, staff only. `manage.py sync_models lag` prints the same.
+        """
+        try:
+            if request.method != "GET":
+                return JsonResponse({"error": "Invalid request method, kindly use GET Request"}, status=405)
+            return JsonResponse({"models": [sync_lag(model) for model in sync_models()]}, status=200)
+        except Exception as e:
+            logger.error(f"Error fetching sync lag: {e}")
+            return JsonResponse({"error": f"Error fetching sync lag: {e}"}, status=400)
+
 urlpatterns = [
     path("all-users/", LookupManagement.lookup_all_users, name="lookup_all_users"),
     path("all-customers/", LookupManagement.lookup_customers, name="lookup_customers"),
+    path("sync-lag/", LookupManagement.lookup_sync_lag, name="lookup_sync_lag"),
 ]
\ No newline at end of file
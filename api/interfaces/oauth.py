@@ -1,7 +1,5 @@
 import os
 import requests
-from jose import jwt
-from jose.exceptions import JWTError
 
 from customer_app import settings
 
@@ -16,6 +14,10 @@ def get_jwk():
     return response.json()
 
 def verify_token(token: str):
+    # python-jose is only needed for Auth0 tokens, import it on the first one
+    from jose import jwt
+    from jose.exceptions import JWTError
+
     try:
         jwks = get_jwk()
         unverified_header = jwt.get_unverified_header(token)
@@ -0,0 +1,140 @@
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q, QuerySet
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.dbrouter import scatter
+from api.interfaces.orderfilters import decode_cursor, encode_cursor
+from api.interfaces.serializers import OrderSerializer, json_datetime
+from api.models import ArchivedOrder, Customer, Order, OrderTombstone
+
+# Set while orders are moved elsewhere rather than deleted, see moving_orders
+_moving = threading.local()
+
+
+class OrderChangeSerializer(OrderSerializer):
+    __slots__ = ()
+    FIELDS = {**OrderSerializer.FIELDS, "date_modified": ("date_modified", json_datetime)}
+
+
+class CursorExpired(Exception):
+    """The cursor predates the oldest tombstone kept, deletions since then may be lost."""
+    pass
+
+
+def record_deleted_orders(orders, using=None):
+    """
+    Leave a tombstone for each order about to be deleted, for the change feed.
+    @param orders: The orders (or archived orders) being deleted, with id and customer_id.
+    @param using: The database they are deleted from, routed like the orders when None.
+    """
+    OrderTombstone.objects.using(using).bulk_create(
+        [OrderTombstone(id=order.pk, customer_id=order.customer_id) for order in orders], ignore_conflicts=True)
+
+
+def record_deleted_customers(customers, using=None):
+    """
+    Leave tombstones for the orders, hot and archived, deleted along with the given customers.
+    """
+    for model in (Order, ArchivedOrder):
+        record_deleted_orders(
+            model.objects.using(using).filter(customer__in=customers).only("id", "customer_id"), using)
+
+
+@contextmanager
+def moving_orders():
+    """
+    Delete orders and customers within the block without tombstones, for the commands that move them instead:
+    archive_orders to the archive table, which is still served, and rebalance_shards to another shard.
+    """
+    moving = getattr(_moving, "active", False)
+    _moving.active = True
+    try:
+        yield
+    finally:
+        _moving.active = moving
+
+
+def deleted_model(origin):
+    """The model whose delete() call started a deletion, given the origin sent with pre_delete."""
+    return origin.model if isinstance(origin, QuerySet) else type(origin)
+
+
+@receiver(pre_delete, sender=Customer)
+def customer_deleted(sender, instance, using, **kwargs):
+    """
+    Leave tombstones for the orders deleted with a customer, however it is deleted: the admin, a cascade from
+    its user or any ORM delete. Raw SQL deletes are not seen.
+    """
+    if not getattr(_moving, "active", False):
+        record_deleted_customers([instance], using)
+
+
+@receiver(pre_delete, sender=Order)
+@receiver(pre_delete, sender=ArchivedOrder)
+def order_deleted(sender, instance, using, origin=None, **kwargs):
+    """
+    Leave a tombstone for an order deleted on its own. Those deleted with their customer already have one from
+    customer_deleted, written in bulk.
+    """
+    if not getattr(_moving, "active", False) and deleted_model(origin) in (Order, ArchivedOrder):
+        record_deleted_orders([instance], using)
+
+
+def changes_since(cursor, limit):
+    """
+    One page of the order change feed: orders created or modified, and orders deleted, after cursor, in
+    (time, id) order through the (date_modified, id) and (date_deleted, id) indexes.
+    Changes of the last ORDER_CHANGES_SETTLE_SECONDS are held back: date_modified is set before the writing
+    transaction commits, so a change may become visible after younger ones. Holding back the recent ones keeps
+    the feed from moving its cursor past a change that has not committed yet.
+    When customers are sharded each shard is read up to limit changes and the results are merged.
+    @param cursor: The next_cursor of the previous page, None to start from the beginning.
+    @return: A (changes, next_cursor, has_more) tuple, next_cursor is the cursor passed in when there is nothing new.
+    @raise ValueError: When the cursor is malformed.
+    @raise CursorExpired: When tombstones after the cursor may have been purged.
+    """
+    now = timezone.now()
+    horizon = now - timedelta(seconds=settings.ORDER_CHANGES_SETTLE_SECONDS)
+    orders, tombstones = Q(date_modified__lt=horizon), Q(date_deleted__lt=horizon)
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        if value < now - timedelta(days=settings.ORDER_TOMBSTONE_TTL_DAYS):
+            raise CursorExpired("Cursor is older than the tombstones kept, resync from scratch")
+        orders &= Q(date_modified__gt=value) | Q(date_modified=value, id__gt=last_id)
+        tombstones &= Q(date_deleted__gt=value) | Q(date_deleted=value, id__gt=last_id)
+
+    serializer = OrderChangeSerializer()
+    modified, key = serializer.columns.index("date_modified"), serializer.columns.index("id")
+    rows = serializer.rows(Order.objects.filter(orders).order_by("date_modified", "id"))
+    rows = [row for shard in scatter(rows) for row in shard[:limit + 1]]
+    changes = [
+        (row[modified], row[key], {"op": "upsert", "order": order})
+        for row, order in zip(rows, serializer.serialize(rows))]
+    deleted = OrderTombstone.objects.filter(tombstones).order_by("date_deleted", "id").values_list(
+        "id", "customer_id", "date_deleted")
+    changes += [
+        (date_deleted, order_id, {"op": "delete", "id": str(order_id), "customer_id": str(customer_id)})
+        for shard in scatter(deleted) for order_id, customer_id, date_deleted in shard[:limit + 1]]
+    changes.sort(key=lambda change: change[:2])
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if changes:
+        changed_at, order_id, _ = changes[-1]
+        cursor = encode_cursor("changed_at", {"changed_at": changed_at, "id": order_id})
+    return [change for _, _, change in changes], cursor, has_more
+
+
+def purge_tombstones():
+    """
+    Delete tombstones older than ORDER_TOMBSTONE_TTL_DAYS, cursors that old are refused with CursorExpired.
+    @return: The number of tombstones deleted.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.ORDER_TOMBSTONE_TTL_DAYS)
+    return sum(shard.delete()[0] for shard in scatter(OrderTombstone.objects.filter(date_deleted__lt=cutoff)))
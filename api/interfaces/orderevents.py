@@ -0,0 +1,279 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import suppress
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.dbrouter import shard_aliases, shard_db, shard_for_code
+from api.interfaces import jwttokens
+from api.interfaces.orderfilters import decode_cursor, encode_cursor
+from api.interfaces.serializers import json_datetime
+from api.models import Customer, Order
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "order_status"
+# Put on a stream's queue when events may have been missed: the LISTEN connection dropped or the stream
+# fell QUEUE_SIZE events behind. The stream then catches up from the database.
+RESYNC = object()
+QUEUE_SIZE = 100
+# Events read per query when a stream catches up after Last-Event-ID or a resync
+REPLAY_LIMIT = 500
+# How long the listener waits for a notification before checking its connection again
+LISTEN_POLL_SECONDS = 5
+
+
+def notify_order_status(order_id, customer_id, status, date_modified):
+    """
+    Announce an order's status to the event streams with pg_notify. Call it in the transaction that writes the
+    status, on the customer's shard: Postgres only delivers the notification when that transaction commits.
+    Other databases have no event streams, nothing is sent there.
+    """
+    connection = connections[shard_db()]
+    if connection.vendor != "postgresql":
+        return
+    payload = json.dumps({
+        "id": str(order_id), "customer_id": str(customer_id), "status": status,
+        "date_modified": date_modified.isoformat()})
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, payload])
+
+
+def event_id(order_id, date_modified):
+    """The SSE id of a status event, a change feed cursor, so Last-Event-ID can be replayed from api_order."""
+    return encode_cursor("changed_at", {"changed_at": date_modified, "id": order_id})
+
+
+class OrderEventHub(object):
+    """
+    Fan out order status notifications to the event streams of this worker.
+    A single thread per worker and Postgres shard LISTENs on its own database connection and hands each
+    notification to the streams of the order's customer, on their event loop. The threads start with the first
+    stream and reconnect with backoff when the connection drops, then tell every stream to resync.
+    """
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.count = 0
+        self.lock = threading.Lock()
+        self.listeners = {}
+
+    def subscribe(self, customer_id):
+        """
+        @return: The asyncio.Queue the customer's events arrive on, or None when the worker already serves
+        ORDER_EVENTS_MAX_STREAMS streams.
+        """
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self.lock:
+            if self.full():
+                return None
+            self.subscribers[str(customer_id)].add((asyncio.get_running_loop(), queue))
+            self.count += 1
+        self.ensure_listener()
+        return queue
+
+    def full(self):
+        return self.count >= settings.ORDER_EVENTS_MAX_STREAMS
+
+    def unsubscribe(self, customer_id, queue):
+        with self.lock:
+            streams = self.subscribers[str(customer_id)]
+            for subscriber in [subscriber for subscriber in streams if subscriber[1] is queue]:
+                streams.discard(subscriber)
+                self.count -= 1
+            if not streams:
+                del self.subscribers[str(customer_id)]
+
+    def ensure_listener(self):
+        with self.lock:
+            for alias in (alias or DEFAULT_DB_ALIAS for alias in shard_aliases()):
+                listener = self.listeners.get(alias)
+                if connections[alias].vendor == "postgresql" and (listener is None or not listener.is_alive()):
+                    self.listeners[alias] = threading.Thread(
+                        target=self.listen, args=(alias,), name=f"order-events-listener-{alias}", daemon=True)
+                    self.listeners[alias].start()
+
+    def publish(self, payload):
+        """
+        Deliver a notification payload from notify_order_status to the streams of its customer.
+        Safe to call from any thread.
+        """
+        event = json.loads(payload)
+        with self.lock:
+            streams = list(self.subscribers.get(event["customer_id"], ()))
+        for loop, queue in streams:
+            loop.call_soon_threadsafe(self.deliver, queue, event)
+
+    def resync_all(self):
+        with self.lock:
+            streams = [stream for streams in self.subscribers.values() for stream in streams]
+        for loop, queue in streams:
+            loop.call_soon_threadsafe(self.deliver, queue, RESYNC)
+
+    @staticmethod
+    def deliver(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A stream this far behind catches up from the database instead
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC)
+
+    def listen(self, alias):
+        backoff = 1
+        connection = connections[alias]
+        while True:
+            try:
+                connection.ensure_connection()
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                if backoff > 1:
+                    self.resync_all()
+                backoff = 1
+                raw = connection.connection
+                while True:
+                    select.select([raw], [], [], LISTEN_POLL_SECONDS)
+                    raw.poll()
+                    while raw.notifies:
+                        self.publish(raw.notifies.pop(0).payload)
+            except Exception as ex:
+                logger.warning(f"Order events listener on {alias} lost its connection, retrying in {backoff}s: {ex}")
+                with suppress(Exception):
+                    connection.close()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+
+hub = OrderEventHub()
+
+
+def format_event(order_id, status, date_modified):
+    data = json.dumps({"id": str(order_id), "status": status, "date_modified": json_datetime(date_modified)})
+    return f"id: {event_id(order_id, date_modified)}\nevent: status\ndata: {data}\n\n"
+
+
+async def changes_after(customer_id, cursor, shard):
+    """Status events of the customer's orders modified after the (date_modified, id) cursor, oldest first."""
+    value, last_id = cursor
+    orders = Order.objects.using(shard).filter(
+        Q(date_modified__gt=value) | Q(date_modified=value, id__gt=last_id), customer_id=customer_id)
+    rows = orders.order_by("date_modified", "id").values_list("id", "status", "date_modified")[:REPLAY_LIMIT]
+    return [row async for row in rows]
+
+
+async def replay(customer_id, cursor, shard):
+    """Every status event after the cursor, oldest first, read REPLAY_LIMIT at a time until none are left."""
+    while True:
+        rows = await changes_after(customer_id, cursor, shard)
+        for row in rows:
+            yield row
+        if len(rows) < REPLAY_LIMIT:
+            return
+        order_id, _, date_modified = rows[-1]
+        cursor = (date_modified, order_id)
+
+
+async def event_stream(customer_id, cursor, shard=None):
+    """
+    The SSE body: a retry hint, the events missed since Last-Event-ID, then live events, with a comment line
+    every ORDER_EVENTS_HEARTBEAT_SECONDS so proxies keep the connection open.
+    @param cursor: The (date_modified, id) of Last-Event-ID, None for a new stream.
+    @param shard: The customer's shard, None when customers are not sharded.
+    """
+    # Subscribe before replaying, so nothing committed in between is lost. The subscription is only taken
+    # once the response starts streaming, then the finally clause always releases it.
+    queue = hub.subscribe(customer_id)
+    if queue is None:
+        yield f"retry: {settings.ORDER_EVENTS_RETRY_MS}\n\n"
+        return
+    try:
+        yield f"retry: {settings.ORDER_EVENTS_RETRY_MS}\n\n"
+        # Live events queued meanwhile may repeat the last replay's events, those are skipped. Only the last
+        # replay is kept and each entry goes once matched, so a long lived stream does not grow it.
+        replayed = set()
+        if cursor is None:
+            cursor = (timezone.now(), uuid.UUID(int=0))
+        else:
+            async for order_id, status, date_modified in replay(customer_id, cursor, shard):
+                replayed.add((str(order_id), date_modified))
+                cursor = (date_modified, order_id)
+                yield format_event(order_id, status, date_modified)
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), settings.ORDER_EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            if event is RESYNC:
+                replayed = set()
+                async for order_id, status, date_modified in replay(customer_id, cursor, shard):
+                    replayed.add((str(order_id), date_modified))
+                    cursor = (date_modified, order_id)
+                    yield format_event(order_id, status, date_modified)
+                continue
+            date_modified = parse_datetime(event["date_modified"])
+            if (event["id"], date_modified) in replayed:
+                replayed.discard((event["id"], date_modified))
+                continue
+            cursor = (date_modified, uuid.UUID(event["id"]))
+            yield format_event(event["id"], event["status"], date_modified)
+    finally:
+        hub.unsubscribe(customer_id, queue)
+
+
+async def order_events(request, customer_code):
+    """
+    Server-Sent Events stream of the status changes of a customer's orders, served by the ASGI application
+    (customer_app.asgi). EventSource cannot set headers, so the JWT may be passed as ?token=.
+    Reconnecting clients send Last-Event-ID and first get the changes they missed.
+    @param request: The Django HTTP request received.
+    @param customer_code: The code of the customer whose orders to follow.
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Invalid request method, kindly use GET Request"}, status=405)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Order events are only served by the ASGI application"}, status=501)
+    token = jwttokens.get_token_from_request(request)
+    if not token:
+        return JsonResponse({"error": "Authentication required"}, status=401)
+    try:
+        await sync_to_async(jwttokens.decode_token)(token)
+    except jwttokens.JWTError as ex:
+        return JsonResponse({"error": str(ex)}, status=401)
+    except Exception as ex:
+        logger.error(f"Unexpected error authenticating an order event stream: {ex!r}")
+        return JsonResponse({"error": "Authentication error"}, status=401)
+    cursor = None
+    if request.headers.get("Last-Event-ID"):
+        try:
+            cursor = decode_cursor(request.headers["Last-Event-ID"])
+        except ValueError as ex:
+            return JsonResponse({"error": str(ex)}, status=400)
+    shard = shard_for_code(customer_code)
+    customer = await Customer.objects.using(shard).filter(code=customer_code).only("id").afirst()
+    if customer is None:
+        return JsonResponse({"error": "Customer not found"}, status=404)
+
+    if hub.full():
+        response = JsonResponse({"error": "Too many event streams, try again later"}, status=503)
+        response["Retry-After"] = "5"
+        return response
+    response = StreamingHttpResponse(event_stream(customer.id, cursor, shard), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Tell nginx not to buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,151 @@
+import csv
+import io
+import json
+import uuid
+import zlib
+from datetime import datetime, time, timedelta
+from operator import itemgetter
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from api.dbrouter import merge, scatter
+from api.models import ArchivedOrder, Order
+
+EXPORT_FORMATS = ("csv", "ndjson")
+EXPORT_FIELDS = ("id", "customer_id", "customer__code", "item", "amount", "status", "date_created", "date_modified")
+EXPORT_COLUMNS = ("id", "customer_id", "customer_code", "item", "amount", "status", "date_created", "date_modified")
+
+# Rows fetched per round trip from the server-side cursor and rows buffered per emitted chunk
+CURSOR_CHUNK_SIZE = 2000
+ROWS_PER_CHUNK = 500
+
+
+def parse_bound(value, end=False):
+    """
+    Parse a date range bound.
+    A bare date covers the whole day, so as an end bound it is moved to the next midnight.
+    @param value: An ISO date or datetime.
+    @param end: Whether the value is the upper bound of the range.
+    @return: An aware datetime or None when no value is given.
+    @raise ValueError: When the value cannot be parsed.
+    """
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is not None:
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    else:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError(f"Invalid date: {value}")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_checkpoint(value):
+    """
+    Parse a `<date_created>,<id>` checkpoint as produced by format_checkpoint.
+    @raise ValueError: When the checkpoint is malformed.
+    """
+    date_created, _, order_id = (value or "").rpartition(",")
+    moment = parse_datetime(date_created)
+    if moment is None:
+        raise ValueError(f"Invalid checkpoint: {value}")
+    return moment, uuid.UUID(order_id)
+
+
+def format_checkpoint(row):
+    """
+    The checkpoint positioned right after an export row.
+    """
+    return f"{row[EXPORT_COLUMNS.index('date_created')].isoformat()},{row[EXPORT_COLUMNS.index('id')]}"
+
+
+def export_queryset(date_from=None, date_to=None, customer_code=None, statuses=None, after=None):
+    """
+    Build the ordered export query.
+    Rows are ordered by (date_created, id) so an export can resume strictly after any row it has emitted.
+    @param date_from: Inclusive lower bound on date_created.
+    @param date_to: Exclusive upper bound on date_created.
+    @param customer_code: Only export orders of this customer.
+    @param statuses: Only export orders with one of these statuses.
+    @param after: A (date_created, id) checkpoint to resume after.
+    @return: A values_list queryset yielding tuples in EXPORT_COLUMNS order.
+    """
+    filters = Q()
+    if date_from:
+        filters &= Q(date_created__gte=date_from)
+    if date_to:
+        filters &= Q(date_created__lt=date_to)
+    if customer_code:
+        filters &= Q(customer__code=customer_code)
+    if statuses:
+        filters &= Q(status__in=statuses)
+    if after:
+        after_date, after_id = after
+        filters &= Q(date_created__gt=after_date) | Q(date_created=after_date, id__gt=after_id)
+    # Archived orders are part of the history, both tiers are merged in the same order
+    hot = Order.objects.filter(filters).values_list(*EXPORT_FIELDS)
+    archived = ArchivedOrder.objects.filter(filters).values_list(*EXPORT_FIELDS)
+    return hot.union(archived, all=True).order_by("date_created", "id")
+
+
+def iter_export_chunks(queryset, export_format, include_header=True):
+    """
+    Encode the export rows into text chunks.
+    The queryset is consumed through `iterator()`, which on Postgres reads from a named server-side cursor,
+    so only one fetch and one chunk are ever held in memory. When customers are sharded one cursor is read
+    per shard and the rows are merged in (date_created, id) order.
+    @return: A generator of (text, row count, last row) tuples; the CSV header comes as (text, 0, None).
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == "csv" else None
+    if writer and include_header:
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue(), 0, None
+        buffer.seek(0)
+        buffer.truncate()
+
+    pending, last = 0, None
+    key = itemgetter(EXPORT_COLUMNS.index("date_created"), EXPORT_COLUMNS.index("id"))
+    for row in merge([shard.iterator(chunk_size=CURSOR_CHUNK_SIZE) for shard in scatter(queryset)], key=key):
+        if writer:
+            writer.writerow(_format_csv_row(row))
+        else:
+            buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), cls=DjangoJSONEncoder))
+            buffer.write("\n")
+        pending, last = pending + 1, row
+        if pending >= ROWS_PER_CHUNK:
+            yield buffer.getvalue(), pending, last
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue(), pending, last
+
+
+def gzip_compressor():
+    """
+    A zlib compressor writing the gzip container format.
+    """
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def gzip_stream(chunks):
+    """
+    Compress a stream of text chunks on the fly into a single gzip member.
+    """
+    compressor = gzip_compressor()
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _format_csv_row(row):
+    return [value.isoformat() if isinstance(value, datetime) else value for value in row]
@@ -0,0 +1,130 @@
+import base64
+import json
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from api.interfaces.orderexport import parse_bound
+
+# Sort keys clients may ask for, each one is backed by a (customer, key, id) index
+SORT_KEYS = ("date_created", "-date_created", "amount", "-amount")
+DEFAULT_SORT = "-date_created"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def build_order_filters(params):
+    """
+    Translate listing parameters into a filter.
+    Supported parameters: status (a name or a list), date_from, date_to, amount_min, amount_max,
+    item (case-insensitive substring) and item_prefix (case-insensitive prefix).
+    @param params: The decoded request parameters.
+    @type params: dict
+    @return: A Q object usable on both Order and ArchivedOrder.
+    @raise ValueError: When a parameter is malformed.
+    """
+    filters = Q()
+    statuses = params.get("status")
+    if statuses:
+        filters &= Q(status__in=[statuses] if isinstance(statuses, str) else list(statuses))
+    date_from = parse_bound(params.get("date_from"))
+    date_to = parse_bound(params.get("date_to"), end=True)
+    if date_from:
+        filters &= Q(date_created__gte=date_from)
+    if date_to:
+        filters &= Q(date_created__lt=date_to)
+    amount_min, amount_max = _parse_amount(params.get("amount_min")), _parse_amount(params.get("amount_max"))
+    if amount_min is not None:
+        filters &= Q(amount__gte=amount_min)
+    if amount_max is not None:
+        filters &= Q(amount__lte=amount_max)
+    if params.get("item"):
+        filters &= Q(item__icontains=params["item"])
+    if params.get("item_prefix"):
+        filters &= Q(item__istartswith=params["item_prefix"])
+    return filters
+
+
+def parse_page(params):
+    """
+    Read and validate the sort key, page size and cursor of a keyset paginated listing.
+    @return: A (sort, limit, cursor filter) tuple.
+    @raise ValueError: When a parameter is malformed.
+    """
+    sort = params.get("sort") or DEFAULT_SORT
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Sort must be one of {', '.join(SORT_KEYS)}")
+    cursor = params.get("cursor")
+    return sort, parse_limit(params), cursor_filter(sort, cursor) if cursor else Q()
+
+
+def parse_limit(params):
+    """
+    @return: The page size asked for, DEFAULT_PAGE_SIZE when absent.
+    @raise ValueError: When it is not a number between 1 and MAX_PAGE_SIZE.
+    """
+    try:
+        limit = int(params.get("limit") or DEFAULT_PAGE_SIZE)
+    except (TypeError, ValueError):
+        raise ValueError("Limit must be a number")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"Limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def ordering(sort):
+    """
+    The ORDER BY for a sort key, id breaks ties so the keyset is total.
+    """
+    return (sort, "-id") if sort.startswith("-") else (sort, "id")
+
+
+def encode_cursor(sort, row):
+    """
+    An opaque cursor pointing right after the given row.
+    @param row: An order as a dict holding at least id and the sort field.
+    """
+    value = row[sort.lstrip("-")]
+    value = value.isoformat() if hasattr(value, "isoformat") else str(value)
+    return base64.urlsafe_b64encode(json.dumps([value, str(row["id"])]).encode()).decode()
+
+
+def cursor_filter(sort, cursor):
+    """
+    The filter selecting rows after a cursor from encode_cursor, for date_created or amount sorts.
+    @raise ValueError: When the cursor is malformed.
+    """
+    field = sort.lstrip("-")
+    value, last_id = decode_cursor(cursor, datetime=field == "date_created")
+    after = "lt" if sort.startswith("-") else "gt"
+    return Q(**{f"{field}__{after}": value}) | Q(**{field: value, f"id__{after}": last_id})
+
+
+def decode_cursor(cursor, datetime=True):
+    """
+    The (value, id) pair of a cursor from encode_cursor, the value is a datetime or, for amount sorts, a Decimal.
+    @raise ValueError: When the cursor is malformed.
+    """
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        last_id = uuid.UUID(last_id)
+        value = parse_datetime(value) if datetime else Decimal(value)
+    except (ValueError, TypeError, InvalidOperation):
+        raise ValueError("Invalid cursor")
+    if value is None:
+        raise ValueError("Invalid cursor")
+    return value, last_id
+
+
+def _parse_amount(value):
+    if value in (None, ""):
+        return None
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        amount = None
+    if amount is None or not amount.is_finite():
+        raise ValueError(f"Invalid amount: {value}")
+    return amount
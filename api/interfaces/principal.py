@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.models import User
+
+PRINCIPAL_FIELDS = ("id", "openid_user_id", "email", "name", "role", "phone_number")
+# Expired entries are dropped once the cache holds this many
+PRUNE_SIZE = 10000
+
+
+class Principal(namedtuple("Principal", PRINCIPAL_FIELDS)):
+    """
+    The authenticated user as the auth decorators see it, an immutable snapshot of the columns they need.
+    It stands in for a User on request.user, so it answers the same is_staff and is_authenticated questions.
+    """
+    __slots__ = ()
+    is_authenticated = True
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def is_staff(self):
+        return self.role == "admin"
+
+
+class PrincipalCache(object):
+    """
+    Principals of recently authenticated users, per worker, keyed by both id and openid_user_id.
+    Entries live PRINCIPAL_CACHE_TTL seconds, so each user costs at most one query per TTL per worker.
+    Saving or deleting a User drops its entry in the worker that did it, other workers pick the change
+    up when their entry expires. Bulk updates bypass signals and are only seen after the TTL as well.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, field, value):
+        """
+        @param field: 'id' or 'openid_user_id'.
+        @return: The Principal, or None when there is no such user.
+        """
+        key = (field, str(value))
+        entry = self.entries.get(key)
+        now = time.monotonic()
+        if entry and entry[1] > now:
+            return entry[0]
+        generation = self.generation
+        row = User.objects.filter(**{field: value}).values_list(*PRINCIPAL_FIELDS).first()
+        if row is None:
+            return None
+        principal = Principal(*row)
+        with self.lock:
+            # A user saved while we were reading it must not be cached with the old values
+            if generation == self.generation:
+                if len(self.entries) >= PRUNE_SIZE:
+                    self.entries = {key: entry for key, entry in self.entries.items() if entry[1] > now}
+                entry = (principal, now + settings.PRINCIPAL_CACHE_TTL)
+                self.entries[("id", str(principal.id))] = entry
+                self.entries[("openid_user_id", principal.openid_user_id)] = entry
+        return principal
+
+    def invalidate(self, user):
+        with self.lock:
+            self.generation += 1
+            # By id rather than by key, the openid_user_id may be the one that changed
+            self.entries = {key: entry for key, entry in self.entries.items() if entry[0].id != user.id}
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+principals = PrincipalCache()
+
+
+def get_principal(user_id=None, openid_user_id=None):
+    """
+    Resolve the principal of a user by id (login_required tokens) or openid_user_id (Auth0 tokens).
+    @return: The Principal, or None when there is no such user.
+    """
+    if user_id is not None:
+        return principals.get("id", user_id)
+    return principals.get("openid_user_id", openid_user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_principal(sender, instance, **kwargs):
+    principals.invalidate(instance)
@@ -0,0 +1,186 @@
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+# What a profiled request records: cProfile stats, sampled stacks for a flamegraph, or live allocations
+MODES = ("cpu", "sample", "memory")
+# Salt of the X-Profile trigger tokens, a token signed for anything else is not accepted
+TRIGGER_SALT = "api.profiling"
+# Every stored profile gets a line here, `manage.py profile_requests report` aggregates from it
+INDEX_FILE = "index.ndjson"
+EXTENSIONS = {"cpu": "prof", "sample": "folded", "memory": "json"}
+
+# tracemalloc traces the whole process, memory profiles are taken one at a time
+_memory_lock = threading.Lock()
+
+
+def sign_trigger(mode):
+    """An X-Profile header value that profiles a request in mode, valid for PROFILING_TRIGGER_MAX_AGE seconds."""
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    return signing.dumps({"mode": mode}, salt=TRIGGER_SALT)
+
+
+def read_trigger(value):
+    """
+    @return: The mode of a valid, unexpired X-Profile header value, None for anything else.
+    """
+    try:
+        mode = signing.loads(value, salt=TRIGGER_SALT, max_age=settings.PROFILING_TRIGGER_MAX_AGE).get("mode")
+    except (signing.BadSignature, AttributeError):
+        return None
+    return mode if mode in MODES else None
+
+
+class CpuProfiler(object):
+    """Deterministic cProfile of the request's thread, stored as a pstats file."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Another profiler is active on this thread
+            return False
+        return True
+
+    def stop(self, path):
+        self.profile.disable()
+        self.profile.dump_stats(path)
+
+
+class StackSampler(object):
+    """
+    Sample the stack of the request's thread from another thread every PROFILING_SAMPLE_INTERVAL_MS and store
+    the counts in the folded format (root;...;leaf count) that flamegraph.pl and speedscope read.
+    It costs far less than cProfile on deep call trees, at the price of missing short calls.
+    """
+
+    def __init__(self):
+        self.thread_id = threading.get_ident()
+        self.interval = settings.PROFILING_SAMPLE_INTERVAL_MS / 1000
+        self.stacks = Counter()
+        self.done = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, name="profile-sampler", daemon=True)
+
+    def sample(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.sampler.start()
+        return True
+
+    def stop(self, path):
+        self.done.set()
+        self.sampler.join()
+        with open(path, "w") as output:
+            output.writelines(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class MemoryProfiler(object):
+    """
+    Trace allocations with tracemalloc while the request runs and store the source lines holding the most memory
+    still allocated at its end, with the peak. Only one request per process is traced at a time.
+    """
+
+    def __init__(self):
+        self.started_tracing = False
+
+    def start(self):
+        if not _memory_lock.acquire(blocking=False):
+            return False
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(settings.PROFILING_TRACEMALLOC_FRAMES)
+            self.started_tracing = True
+        tracemalloc.reset_peak()
+        self.baseline = tracemalloc.take_snapshot()
+        return True
+
+    def stop(self, path):
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            if self.started_tracing:
+                tracemalloc.stop()
+            _memory_lock.release()
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        allocations = [
+            {"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+             "size": stat.size_diff, "count": stat.count_diff}
+            for stat in snapshot.filter_traces(ignore).compare_to(self.baseline.filter_traces(ignore), "lineno")
+            if stat.size_diff > 0][:settings.PROFILING_TOP_ALLOCATIONS]
+        with open(path, "w") as output:
+            json.dump({"peak": peak, "allocations": allocations}, output)
+
+
+PROFILERS = {
+    "cpu": CpuProfiler,
+    "sample": StackSampler,
+    "memory": MemoryProfiler,
+}
+
+
+def endpoint_of(request):
+    """The URL name of the view a request reached, e.g. create_order, or its path when it matched none."""
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match and match.view_name else request.path
+
+
+def endpoint_slug(endpoint):
+    """The endpoint made safe to use in a file name."""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", endpoint).strip("_") or "root"
+
+
+def store_profile(profiler, mode, request, status, duration):
+    """
+    Save a finished profile under PROFILING_DIR and add it to the index.
+    @return: The path of the profile.
+    """
+    endpoint = endpoint_of(request)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint_slug(endpoint)}-{os.urandom(4).hex()}.{EXTENSIONS[mode]}"
+    path = os.path.join(settings.PROFILING_DIR, name)
+    try:
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    finally:
+        # Stopping releases what the profiler holds before writing, even when the directory is unusable
+        profiler.stop(path)
+    record = {"file": name, "endpoint": endpoint, "mode": mode, "method": request.method, "path": request.path,
+              "status": status, "duration_ms": round(duration * 1000, 3), "at": timezone.now().isoformat()}
+    # One O_APPEND write per line, so workers sharing the directory never interleave
+    fd = os.open(os.path.join(settings.PROFILING_DIR, INDEX_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(record) + "\n").encode())
+    finally:
+        os.close(fd)
+    return path
+
+
+def load_index(directory):
+    """@return: The index records of the profiles stored in directory whose files still exist."""
+    path = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as lines:
+        records = [json.loads(line) for line in lines if line.strip()]
+    return [record for record in records if os.path.exists(os.path.join(directory, record["file"]))]
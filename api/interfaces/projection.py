@@ -0,0 +1,17 @@
+def parse_fields(value, available):
+    """
+    Narrow the fields a list endpoint returns to those the client asked for.
+    @param value: The fields parameter, a comma separated string or a list. Empty means every field.
+    @param available: The fields an endpoint offers, e.g. a Serializer's FIELDS.
+    @type available: dict
+    @return: The requested subset of available.
+    @raise ValueError: When an unknown field is requested.
+    """
+    if not value:
+        return dict(available)
+    names = value.split(",") if isinstance(value, str) else value
+    names = {str(name).strip() for name in names} - {""}
+    unknown = sorted(names - set(available))
+    if unknown or not names:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available fields: {', '.join(available)}")
+    return {name: lookup for name, lookup in available.items() if name in names}
@@ -0,0 +1,112 @@
+from django.core.serializers.json import DjangoJSONEncoder
+
+_encoder = DjangoJSONEncoder()
+
+
+def json_datetime(value):
+    """The format DjangoJSONEncoder gives datetimes, e.g. 2025-01-03T10:00:00.123Z."""
+    return _encoder.default(value)
+
+
+def isoformat(value):
+    return value.isoformat()
+
+
+class Serializer(object):
+    """
+    Turn values_list() rows into JSON ready dicts without instantiating models.
+    The rows are the transfer objects, plain tuples holding only the selected columns. FIELDS maps each output
+    name to the lookup it is read from and the function turning the value into a JSON type (None when it already
+    is one), so JsonResponse's encoder never falls back to its slow per-object default().
+    """
+    __slots__ = ("fields", "columns")
+    FIELDS = {}
+
+    def __init__(self, names=None):
+        """
+        @param names: The output names to serialize, e.g. from parse_fields. None for every field.
+        """
+        self.fields = [(name, *spec) for name, spec in self.FIELDS.items() if names is None or name in names]
+        self.columns = list(dict.fromkeys(lookup for _, lookup, _ in self.fields))
+
+    def rows(self, queryset, *extra):
+        """
+        The values_list() of the serialized columns. Extra lookups the view needs itself (e.g. cursor keys)
+        are selected after them and left out of the output.
+        """
+        return queryset.values_list(*self.columns_with(*extra))
+
+    def columns_with(self, *extra):
+        """The columns of rows() for the same extra lookups, in order."""
+        return self.columns + [lookup for lookup in extra if lookup not in self.columns]
+
+    def serialize(self, rows):
+        """
+        @param rows: Tuples from rows().
+        @return: A list of dicts of JSON types.
+        """
+        plan = [(name, self.columns.index(lookup), to_json) for name, lookup, to_json in self.fields]
+        return [
+            {name: row[index] if to_json is None or row[index] is None else to_json(row[index])
+             for name, index, to_json in plan}
+            for row in rows]
+
+    def serialize_one(self, row):
+        return self.serialize([row])[0]
+
+
+class OrderSerializer(Serializer):
+    __slots__ = ()
+    FIELDS = {
+        "id": ("id", str),
+        "customer__id": ("customer__id", str),
+        "item": ("item", None),
+        "amount": ("amount", str),
+        "status": ("status", None),
+        "date_created": ("date_created", json_datetime),
+    }
+
+
+class CustomerOrderSerializer(OrderSerializer):
+    """Orders listed under their customer, the customer is implied."""
+    __slots__ = ()
+    FIELDS = {name: spec for name, spec in OrderSerializer.FIELDS.items() if name != "customer__id"}
+
+
+class OrderDetailSerializer(Serializer):
+    __slots__ = ()
+    FIELDS = {
+        "id": ("id", str),
+        "customer_id": ("customer_id", str),
+        "item": ("item", None),
+        "amount": ("amount", str),
+        "status": ("status", None),
+        "date_created": ("date_created", isoformat),
+    }
+
+
+class UserSerializer(Serializer):
+    __slots__ = ()
+    FIELDS = {
+        "id": ("id", str),
+        "email": ("email", None),
+        "name": ("name", None),
+        "role": ("role", None),
+        "phone_number": ("phone_number", None),
+    }
+
+
+class CustomerSerializer(Serializer):
+    __slots__ = ()
+    FIELDS = {
+        "id": ("id", str),
+        "email": ("user__email", None),
+        "name": ("user__name", None),
+        "phone_number": ("user__phone_number", None),
+        "code": ("code", None),
+        # Order summary straight from the customer row, api_order is never queried
+        "order_count": ("order_count", None),
+        "total_amount": ("total_amount", str),
+        "pending_count": ("pending_count", None),
+        "last_order_at": ("last_order_at", json_datetime),
+    }
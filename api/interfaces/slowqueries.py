@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Literals and placeholders a fingerprint abstracts away, in the order they are replaced
+FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s|\$\d+"), "?"),
+    (re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE), "IN (...)"),
+    (re.compile(r"\bVALUES\s*\([?,\s]*\)(?:\s*,\s*\([?,\s]*\))*", re.IGNORECASE), "VALUES (...)"),
+    (re.compile(r"\s+"), " "),
+]
+# Statements a plan is captured for. Plain EXPLAIN only plans them, nothing is executed.
+EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+# What keeps a read from being re-run under EXPLAIN ANALYZE, which executes it: locking clauses, data-modifying
+# CTEs and functions with side effects, e.g. a second pg_notify would reach the order event streams twice
+NOT_READ_ONLY = re.compile(
+    r"\bFOR\s+(UPDATE|SHARE|NO\s+KEY\s+UPDATE|KEY\s+SHARE)\b|\b(INSERT|UPDATE|DELETE|MERGE)\b"
+    r"|\b(pg_notify|nextval|setval|set_config|pg_(try_)?advisory_\w+|lo_\w+)\s*\(", re.IGNORECASE)
+
+# Fingerprints this process has captured a plan for, the first slow run of each is always explained
+_explained = set()
+_explained_lock = threading.Lock()
+# Set while a plan is captured, so the EXPLAIN itself is not recorded
+_capturing = threading.local()
+
+
+def normalize(sql):
+    """The SQL with literals, placeholders and IN lists replaced, so every run of a query reads the same."""
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(normalized):
+    """A short stable id of a normalized statement."""
+    return hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()
+
+
+def read_only(sql):
+    """
+    Whether the statement is a plain read, safe to execute again under EXPLAIN ANALYZE: a SELECT or WITH with no
+    locking clause, data-modifying CTE or call to a function in NOT_READ_ONLY, string literals aside.
+    """
+    sql = FINGERPRINT_PATTERNS[0][0].sub("?", sql)
+    return bool(re.match(r"\s*(SELECT|WITH)\b", sql, re.IGNORECASE)) and not NOT_READ_ONLY.search(sql)
+
+
+class SlowQueryRecorder(object):
+    """
+    Database execute wrapper appending every query slower than SLOW_QUERY_MS to SLOW_QUERY_LOG, one JSON line with
+    the normalized SQL, its fingerprint, the endpoint, the database alias and the duration. For the first slow
+    run of each fingerprint in a process, and a SLOW_QUERY_EXPLAIN_RATE share of the later ones, the plan is
+    captured on the same connection: with EXPLAIN (ANALYZE, BUFFERS) for plain reads, which runs them again,
+    with plain EXPLAIN for everything else.
+    """
+
+    def __init__(self, endpoint):
+        """
+        @param endpoint: The name recorded as the caller, or a callable returning it when a query is recorded.
+        """
+        self.endpoint = endpoint
+        self.threshold = settings.SLOW_QUERY_MS / 1000
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_capturing, "active", False):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - started
+        if duration >= self.threshold:
+            try:
+                self.record(sql, params, many, context["connection"], duration)
+            except (OSError, DatabaseError) as ex:
+                logger.error(f"Could not record a slow query: {ex}")
+        return result
+
+    def record(self, sql, params, many, connection, duration):
+        normalized = normalize(sql)
+        key = fingerprint(normalized)
+        entry = {
+            "at": timezone.now().isoformat(), "fingerprint": key, "sql": normalized,
+            "endpoint": self.endpoint() if callable(self.endpoint) else self.endpoint,
+            "alias": connection.alias, "duration_ms": round(duration * 1000, 3),
+        }
+        if not many and self.should_explain(key, sql, connection):
+            entry["analyzed"] = read_only(sql)
+            entry["plan"] = explain(sql, params, connection, entry["analyzed"])
+        # One O_APPEND write per line, so workers sharing the log never interleave
+        fd = os.open(settings.SLOW_QUERY_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(entry, default=str) + "\n").encode())
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def should_explain(key, sql, connection):
+        if connection.vendor != "postgresql" or not EXPLAINABLE.match(sql):
+            return False
+        with _explained_lock:
+            first = key not in _explained
+            _explained.add(key)
+        return first or random.random() < settings.SLOW_QUERY_EXPLAIN_RATE
+
+
+def explain(sql, params, connection, analyze):
+    """
+    EXPLAIN the statement in a savepoint, so a failure leaves the caller's transaction usable.
+    @param analyze: Run it again under EXPLAIN (ANALYZE, BUFFERS) for the actual rows and timings, only for
+    statements that are read_only.
+    @return: The plan as Postgres returns it in JSON format, or None when it could not be captured.
+    """
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    _capturing.active = True
+    try:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN ({options}) {sql}", params)
+            plan = cursor.fetchone()[0]
+        return json.loads(plan) if isinstance(plan, str) else plan
+    except DatabaseError as ex:
+        logger.warning(f"Could not explain a slow query: {ex}")
+        return None
+    finally:
+        _capturing.active = False
+
+
+@contextmanager
+def record_slow_queries(endpoint):
+    """Record the slow queries run on any database by this thread within the block, see SlowQueryRecorder."""
+    recorder = SlowQueryRecorder(endpoint)
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        yield recorder
+
+
+def plan_hints(plan):
+    """
+    Walk a JSON plan for the usual signs of a missing index or too little work_mem.
+    @return: A list of short descriptions, e.g. 'Seq Scan on api_order, 99000 rows removed by filter (status = ?)'.
+    """
+    hints = []
+    nodes = [node["Plan"] for node in plan or []]
+    while nodes:
+        node = nodes.pop()
+        nodes.extend(node.get("Plans", []))
+        if node["Node Type"].endswith("Seq Scan") and node.get("Rows Removed by Filter"):
+            hints.append(f"{node['Node Type']} on {node.get('Relation Name')}, "
+                         f"{node['Rows Removed by Filter']} rows removed by filter ({normalize(node.get('Filter', ''))})")
+        elif node["Node Type"] == "Sort" and node.get("Sort Space Type") == "Disk":
+            hints.append(f"Sort on disk ({node.get('Sort Space Used')} kB) by {', '.join(node.get('Sort Key', []))}")
+    return hints
+
+
+def load_log(path, since=None):
+    """@return: The slow query entries logged in path, those at or after the datetime since only."""
+    if not os.path.exists(path):
+        return []
+    with open(path) as lines:
+        entries = [json.loads(line) for line in lines if line.strip()]
+    if since is not None:
+        entries = [entry for entry in entries if entry["at"] >= since.isoformat()]
+    return entries
@@ -1,19 +1,34 @@
-import africastalking
+from functools import lru_cache
+
 from customer_app import settings
 
 
+@lru_cache(maxsize=None)
+def sms_client():
+    """
+    Import and initialize the AfricasTalking SDK on the first message sent, once per process,
+    so that importing the order handlers does not pay for it
+    """
+    import africastalking
+
+    africastalking.initialize(
+        username=settings.AFRICAS_USERNAME,
+        api_key=settings.AFRICASTALKING_API_KEY
+    )
+    return africastalking.SMS
+
+
 class SendSms:
     def __init__(self):
         """
-        Initialize AfricasTalking API credentials when the class is instantiated
+        The AfricasTalking client is shared and only created when the first message is sent
         """
-        africastalking.initialize(
-            username=settings.AFRICAS_USERNAME,
-            api_key=settings.AFRICASTALKING_API_KEY
-        )
-        self.sms = africastalking.SMS
         self.sender = settings.AFRICASTALKING_SENDER_ID
 
+    @property
+    def sms(self):
+        return sms_client()
+
     def send(self, phone_number, message):
         """
         Send message to a phone number
@@ -0,0 +1,123 @@
+import json
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from api.dbrouter import scatter, shard_db
+from api.interfaces.serializers import Serializer, json_datetime
+
+
+class OrderSyncSerializer(Serializer):
+    __slots__ = ()
+    FIELDS = {
+        "id": ("id", str),
+        "customer_id": ("customer_id", str),
+        "item": ("item", None),
+        "amount": ("amount", str),
+        "status": ("status", None),
+        "date_created": ("date_created", json_datetime),
+        "date_modified": ("date_modified", json_datetime),
+    }
+
+
+class CustomerSyncSerializer(Serializer):
+    """The customer's own fields, the order counters follow every order write and are not synced."""
+    __slots__ = ()
+    FIELDS = {
+        "id": ("id", str),
+        "user_id": ("user_id", str),
+        "name": ("name", None),
+        "description": ("description", None),
+        "code": ("code", None),
+        "date_created": ("date_created", json_datetime),
+        "date_modified": ("date_modified", json_datetime),
+    }
+
+
+# What is sent for each model with SYNC_MODEL set, keyed by model label
+SERIALIZERS = {
+    "api.Order": OrderSyncSerializer,
+    "api.Customer": CustomerSyncSerializer,
+}
+
+
+class NdjsonFileSink(object):
+    """
+    Append synced records to <directory>/<model label>.ndjson, one JSON object per line.
+    Each batch is a single write on a file opened with O_APPEND, so parallel workers never interleave lines,
+    and it is fsynced before the rows are marked synced.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, label, records):
+        data = "".join(json.dumps({"model": label, **record}) + "\n" for record in records).encode()
+        path = os.path.join(self.directory, f"{label}.ndjson")
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+SINKS = {
+    "ndjson": NdjsonFileSink,
+}
+
+
+def get_sink():
+    """
+    The sink named by SYNC_SINK, a key of SINKS or the dotted path of a class with a write(label, records)
+    method, created with SYNC_SINK_OPTIONS as keyword arguments.
+    """
+    sink = SINKS.get(settings.SYNC_SINK) or import_string(settings.SYNC_SINK)
+    return sink(**settings.SYNC_SINK_OPTIONS)
+
+
+def sync_models():
+    """The models with SYNC_MODEL set."""
+    return [model for model in apps.get_app_config("api").get_models() if getattr(model, "SYNC_MODEL", False)]
+
+
+def sync_batch(model, sink, size):
+    """
+    Send one batch of unsynced rows of model to sink, oldest change first, and mark them synced.
+    The rows are claimed with SKIP LOCKED through the partial index on synced = false, so parallel workers
+    take disjoint batches. A write to a claimed row waits for this transaction and unsets synced again.
+    Delivery is at least once: rows whose sink write succeeded but whose transaction failed are sent again.
+    Run it inside use_shard() for each shard when customers are sharded.
+    @return: The number of rows synced.
+    """
+    label = model._meta.label
+    serializer = SERIALIZERS[label]()
+    key = serializer.columns.index("id")
+    with transaction.atomic(using=shard_db()):
+        rows = list(serializer.rows(
+            model.objects.select_for_update(skip_locked=True).filter(synced=False).order_by("date_modified"))[:size])
+        if not rows:
+            return 0
+        sink.write(label, serializer.serialize(rows))
+        model.objects.filter(id__in=[row[key] for row in rows]).update(synced=True)
+    return len(rows)
+
+
+def sync_lag(model):
+    """
+    @return: The number of unsynced rows of model, its oldest unsynced change and how many seconds ago that was,
+    both None when everything is synced. Counted on the partial index, which holds only unsynced rows, of every shard.
+    """
+    shards = [
+        shard.aggregate(unsynced=Count("id"), oldest=Min("date_modified"))
+        for shard in scatter(model.objects.filter(synced=False))]
+    oldest = min((stats["oldest"] for stats in shards if stats["oldest"]), default=None)
+    lag = (timezone.now() - oldest).total_seconds() if oldest else None
+    return {"model": model._meta.label, "unsynced": sum(stats["unsynced"] for stats in shards),
+            "oldest_unsynced": oldest, "lag_seconds": lag}
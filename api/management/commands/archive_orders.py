@@ -0,0 +1,92 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from api.dbrouter import shard_aliases, shard_db, use_shard
+from api.interfaces.orderchanges import moving_orders
+from api.models import ArchivedOrder, Order
+
+ARCHIVED_FIELDS = ("id", "customer_id", "item", "amount", "status", "date_created", "date_modified")
+
+
+class Command(BaseCommand):
+    """
+    Move closed orders out of the hot orders table into the archive table.
+
+    run     moves orders in ORDER_ARCHIVE_STATUSES that were last modified more than --older-than-days ago,
+            one batch per transaction. Rows are claimed with SKIP LOCKED so concurrent runs never collide.
+    report  prints hot and archived row counts and, on Postgres, their on-disk sizes.
+
+    When customers are sharded each shard is archived and reported in turn.
+
+    Reads fall back to the archive, so archived orders stay visible through the orders API.
+    """
+    help = "Archive old closed orders or report on hot vs archived orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["run", "report"])
+        parser.add_argument(
+            "--older-than-days", type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS,
+            help="Archive orders last modified more than this many days ago.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--limit", type=int, help="Stop after archiving this many orders.")
+
+    def handle(self, *args, **options):
+        if options["action"] == "report":
+            self.report()
+            return
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be a positive integer")
+        cutoff = timezone.now() - timedelta(days=options["older_than_days"])
+        limit = options["limit"]
+        archived = 0
+        for alias in shard_aliases():
+            with use_shard(alias):
+                while limit is None or archived < limit:
+                    size = options["batch_size"] if limit is None else min(options["batch_size"], limit - archived)
+                    moved = archive_batch(cutoff, size)
+                    archived += moved
+                    if moved < size:
+                        break
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} orders last modified before {cutoff:%Y-%m-%d}"))
+
+    def report(self):
+        self.stdout.write(f"{'tier':<10}{'rows':>12}{'size':>12}  shard")
+        for alias in shard_aliases():
+            connection = connections[alias or DEFAULT_DB_ALIAS]
+            for tier, model in (("hot", Order), ("archived", ArchivedOrder)):
+                size = "-"
+                if connection.vendor == "postgresql":
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            "SELECT pg_size_pretty(pg_total_relation_size(%s::regclass))", [model._meta.db_table])
+                        size = cursor.fetchone()[0]
+                        if model is Order:
+                            # A partitioned orders table has no storage of its own, sum its partitions
+                            cursor.execute(
+                                "SELECT pg_size_pretty(sum(pg_total_relation_size(inhrelid))) FROM pg_inherits "
+                                "WHERE inhparent = %s::regclass", [model._meta.db_table])
+                            size = cursor.fetchone()[0] or size
+                rows = model.objects.using(alias).count()
+                self.stdout.write(f"{tier:<10}{rows:>12}{size:>12}  {connection.alias}")
+
+
+def archive_batch(cutoff, size):
+    """
+    Move one batch of closed orders modified before cutoff into the archive table.
+    @return: The number of orders moved.
+    """
+    with transaction.atomic(using=shard_db()), moving_orders():
+        rows = list(
+            Order.objects.select_for_update(skip_locked=True)
+            .filter(status__in=settings.ORDER_ARCHIVE_STATUSES, date_modified__lt=cutoff)
+            .values_list(*ARCHIVED_FIELDS)[:size])
+        if not rows:
+            return 0
+        ArchivedOrder.objects.bulk_create(
+            [ArchivedOrder(**dict(zip(ARCHIVED_FIELDS, row))) for row in rows], ignore_conflicts=True)
+        Order.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
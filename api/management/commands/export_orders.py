@@ -0,0 +1,97 @@
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.interfaces.orderexport import EXPORT_FORMATS, export_queryset, format_checkpoint, gzip_compressor, \
+    iter_export_chunks, parse_bound, parse_checkpoint
+
+
+class Command(BaseCommand):
+    """
+    Stream orders to a CSV or NDJSON file, optionally gzip compressed.
+    With --checkpoint the last written (date_created, id) and the output size are saved every
+    --checkpoint-every rows; rerunning the same command truncates the partial tail and resumes after it.
+    """
+    help = "Export orders as CSV or NDJSON using a server-side cursor."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+        parser.add_argument("--output", default="-", help="Output file, '-' writes to stdout.")
+        parser.add_argument("--gzip", action="store_true", help="Compress the output with gzip.")
+        parser.add_argument("--date-from", help="Inclusive lower bound on date_created (ISO date or datetime).")
+        parser.add_argument("--date-to", help="Upper bound on date_created, a bare date includes the whole day.")
+        parser.add_argument("--customer-code", help="Only export orders of this customer.")
+        parser.add_argument("--status", action="append", default=[], help="Only export orders in this status, repeatable.")
+        parser.add_argument("--checkpoint", help="Checkpoint file used to resume an interrupted export.")
+        parser.add_argument("--checkpoint-every", type=int, default=10000, help="Rows written between checkpoints.")
+
+    def handle(self, *args, **options):
+        output, checkpoint_path = options["output"], options["checkpoint"]
+        if checkpoint_path and output == "-":
+            raise CommandError("--checkpoint needs an --output file")
+        try:
+            date_from = parse_bound(options["date_from"])
+            date_to = parse_bound(options["date_to"], end=True)
+            state = self._load_checkpoint(checkpoint_path)
+            after = parse_checkpoint(state["after"]) if state else None
+        except ValueError as ex:
+            raise CommandError(str(ex))
+
+        if output == "-":
+            handle = sys.stdout.buffer
+        elif state:
+            handle = open(output, "r+b")
+            handle.truncate(state["offset"])
+            handle.seek(state["offset"])
+        else:
+            handle = open(output, "wb")
+
+        orders = export_queryset(
+            date_from=date_from, date_to=date_to, customer_code=options["customer_code"],
+            statuses=options["status"], after=after)
+        # Each checkpoint closes the current gzip member, so the file is always a valid multi-member gzip up to it
+        compressor = gzip_compressor() if options["gzip"] else None
+        rows = state["rows"] if state else 0
+        unsaved = 0
+        try:
+            for text, count, last in iter_export_chunks(orders, options["format"], include_header=state is None):
+                data = text.encode("utf-8")
+                handle.write(compressor.compress(data) if compressor else data)
+                rows, unsaved = rows + count, unsaved + count
+                if checkpoint_path and unsaved >= options["checkpoint_every"]:
+                    if compressor:
+                        handle.write(compressor.flush())
+                        compressor = gzip_compressor()
+                    self._save_checkpoint(checkpoint_path, handle, last, rows)
+                    unsaved = 0
+            if compressor:
+                handle.write(compressor.flush())
+            handle.flush()
+        finally:
+            if handle is not sys.stdout.buffer:
+                handle.close()
+
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stderr.write(self.style.SUCCESS(f"Exported {rows} orders"))
+
+    @staticmethod
+    def _load_checkpoint(path):
+        if not path or not os.path.exists(path):
+            return None
+        with open(path) as checkpoint:
+            return json.load(checkpoint)
+
+    @staticmethod
+    def _save_checkpoint(path, handle, last, rows):
+        """
+        Persist the resume position once everything before it is on disk.
+        """
+        handle.flush()
+        os.fsync(handle.fileno())
+        state = {"after": format_checkpoint(last), "offset": handle.tell(), "rows": rows}
+        with open(f"{path}.tmp", "w") as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(f"{path}.tmp", path)
@@ -0,0 +1,247 @@
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models import Q
+
+from api.dbrouter import shard_aliases, shard_db, shard_for_code, use_shard
+from api.interfaces.handlecustomer import generate_customer_codes
+from api.models import Customer, User
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Bulk import customers from a CSV or NDJSON file.
+    Each row needs a `name` and either a `user_id` or an `email` identifying an existing user,
+    `description` is optional. Rows are validated and inserted in batches so memory stays flat
+    regardless of the file size, rows that fail validation are written to a reject file.
+    """
+    help = "Import customers in bulk from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or NDJSON file to import, use '-' to read from stdin.")
+        parser.add_argument("--format", choices=["csv", "ndjson"], help="Input format, guessed from the extension by default.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows validated and inserted per batch.")
+        parser.add_argument("--rejects", help="Reject file path, defaults to <path>.rejects.ndjson.")
+        parser.add_argument(
+            "--method", choices=["auto", "copy", "bulk"], default="auto",
+            help="Insert with COPY (Postgres only) or bulk_create. 'auto' picks COPY where available.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be a positive integer")
+        input_format = options["format"] or ("ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv")
+        method = self._resolve_method(options["method"])
+        rejects_path = options["rejects"] or ("rejects.ndjson" if path == "-" else f"{path}.rejects.ndjson")
+
+        if path == "-":
+            stream = sys.stdin
+        else:
+            try:
+                stream = open(path, newline="", encoding="utf-8-sig")
+            except OSError as ex:
+                raise CommandError(f"Cannot open {path}: {ex}")
+
+        self._rejects_path = rejects_path
+        self._rejects_file = None
+        processed = imported = rejected = 0
+        started = time.monotonic()
+        try:
+            batch = []
+            for entry in self._read_rows(stream, input_format):
+                batch.append(entry)
+                if len(batch) >= batch_size:
+                    ok = self._import_batch(batch, method)
+                    processed, imported, rejected = processed + len(batch), imported + ok, rejected + len(batch) - ok
+                    self._report(processed, imported, rejected, started)
+                    batch = []
+            if batch:
+                ok = self._import_batch(batch, method)
+                processed, imported, rejected = processed + len(batch), imported + ok, rejected + len(batch) - ok
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if self._rejects_file is not None:
+                self._rejects_file.close()
+
+        self._report(processed, imported, rejected, started, final=True)
+        if rejected:
+            self.stdout.write(self.style.WARNING(f"Rejected rows written to {rejects_path}"))
+
+    @staticmethod
+    def _resolve_method(method):
+        """
+        Decide how rows are inserted.
+        COPY needs Postgres connections driven by psycopg2 (to every shard when customers are sharded),
+        everything else falls back to bulk_create.
+        """
+        copy_available = all(
+            connection.vendor == "postgresql" and connection.Database.__name__ == "psycopg2"
+            for connection in (connections[alias or DEFAULT_DB_ALIAS] for alias in shard_aliases()))
+        if method == "copy" and not copy_available:
+            raise CommandError("COPY is only available on Postgres with psycopg2, use --method bulk")
+        if method == "auto":
+            return "copy" if copy_available else "bulk"
+        return method
+
+    @staticmethod
+    def _read_rows(stream, input_format):
+        """
+        Lazily yield (line number, row, parse error) tuples from the input stream.
+        """
+        if input_format == "csv":
+            reader = csv.DictReader(stream)
+            for row in reader:
+                yield reader.line_num, row, None
+            return
+        for line_no, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as ex:
+                yield line_no, {"raw": line}, f"Invalid JSON: {ex}"
+                continue
+            if not isinstance(row, dict):
+                yield line_no, {"raw": line}, "Each line must be a JSON object"
+                continue
+            yield line_no, row, None
+
+    def _import_batch(self, batch, method):
+        """
+        Validate a batch of rows, resolve their users with a single query and insert the valid ones.
+        @return: The number of customers inserted.
+        """
+        candidates = []
+        user_ids, emails = set(), set()
+        for line_no, row, error in batch:
+            if error:
+                self._reject(line_no, row, error)
+                continue
+            name = str(row.get("name") or "").strip()
+            description = str(row.get("description") or "").strip() or None
+            user_id = str(row.get("user_id") or "").strip()
+            email = str(row.get("email") or "").strip()
+            if not name:
+                self._reject(line_no, row, "Name is required")
+                continue
+            if len(name) > Customer._meta.get_field("name").max_length:
+                self._reject(line_no, row, "Name is too long")
+                continue
+            if description and len(description) > Customer._meta.get_field("description").max_length:
+                self._reject(line_no, row, "Description is too long")
+                continue
+            if user_id:
+                try:
+                    user_id = str(uuid.UUID(user_id))
+                except ValueError:
+                    self._reject(line_no, row, "User ID is not a valid UUID")
+                    continue
+                user_ids.add(user_id)
+            elif email:
+                emails.add(email)
+            else:
+                self._reject(line_no, row, "User ID or email is required")
+                continue
+            candidates.append((line_no, row, name, description, user_id, email))
+
+        if not candidates:
+            return 0
+
+        users_by_id, users_by_email = {}, {}
+        users = User.objects.filter(Q(id__in=user_ids) | Q(email__in=emails)).values("id", "email", "phone_number")
+        for user in users:
+            users_by_id[str(user["id"])] = user
+            users_by_email[user["email"]] = user
+
+        customers, sources = [], []
+        for line_no, row, name, description, user_id, email in candidates:
+            user = users_by_id.get(user_id) if user_id else users_by_email.get(email)
+            if user is None:
+                self._reject(line_no, row, "User not found")
+                continue
+            if not user["phone_number"]:
+                self._reject(line_no, row, "User phone number is required kindly add phone number to the user")
+                continue
+            customers.append(Customer(name=name, description=description, user_id=user["id"]))
+            sources.append((line_no, row))
+
+        if not customers:
+            return 0
+        # Each shard's customers are inserted in a transaction of their own
+        shards = defaultdict(list)
+        for customer, source, code in zip(customers, sources, generate_customer_codes(len(customers))):
+            customer.code = code
+            shards[shard_for_code(code)].append((customer, source))
+
+        imported = 0
+        for alias, entries in shards.items():
+            shard_customers = [customer for customer, _ in entries]
+            try:
+                with use_shard(alias), transaction.atomic(using=shard_db()):
+                    if method == "copy":
+                        self._copy_customers(shard_customers, connections[shard_db()])
+                    else:
+                        Customer.objects.bulk_create(shard_customers, batch_size=len(shard_customers))
+            except DatabaseError as ex:
+                logger.exception("Error importing customer batch: %s", ex)
+                for _, (line_no, row) in entries:
+                    self._reject(line_no, row, str(ex))
+                continue
+            imported += len(shard_customers)
+        return imported
+
+    @staticmethod
+    def _copy_customers(customers, connection):
+        """
+        Stream a batch of unsaved customers into the table with COPY FROM STDIN.
+        """
+        fields = Customer._meta.concrete_fields
+        buffer = io.StringIO()
+        for customer in customers:
+            buffer.write("\t".join(
+                Command._copy_value(field.get_db_prep_save(field.pre_save(customer, True), connection))
+                for field in fields))
+            buffer.write("\n")
+        buffer.seek(0)
+        columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {connection.ops.quote_name(Customer._meta.db_table)} ({columns}) FROM STDIN", buffer)
+
+    @staticmethod
+    def _copy_value(value):
+        """
+        Encode a single value in the COPY text format.
+        """
+        if value is None:
+            return "\\N"
+        return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+                .replace("\n", "\\n").replace("\r", "\\r"))
+
+    def _reject(self, line_no, row, error):
+        if self._rejects_file is None:
+            directory = os.path.dirname(self._rejects_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._rejects_file = open(self._rejects_path, "w", encoding="utf-8")
+        self._rejects_file.write(json.dumps({"line": line_no, "error": error, "row": row}, default=str) + "\n")
+
+    def _report(self, processed, imported, rejected, started, final=False):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        message = (f"{processed} rows processed, {imported} imported, {rejected} rejected "
+                   f"in {elapsed:.2f}s ({processed / elapsed:.0f} rows/s)")
+        self.stdout.write(self.style.SUCCESS(message) if final else message)
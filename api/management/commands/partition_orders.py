@@ -0,0 +1,180 @@
+import re
+from datetime import date, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import Order
+
+DEFAULT_PARTITION_SUFFIX = "default"
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+class Command(BaseCommand):
+    """
+    Opt-in monthly range partitioning of the orders table on date_created (Postgres only).
+
+    convert  rebuilds the orders table as a partitioned table, creating one partition per month of existing
+             data plus --months-ahead future ones and a default partition as a safety net. Existing rows are
+             copied under an exclusive lock and the old table is kept as <table>_unpartitioned unless --drop-old.
+    create   creates the partitions for the current month and the next --months-ahead months, it is idempotent
+             and meant to run from cron so inserts never land in the default partition.
+    status   lists partitions with their estimated row counts and sizes.
+
+    Postgres requires the partition key in every unique constraint, so the partitioned table's primary key is
+    (id, date_created) and other unique indexes without date_created are dropped. Postgres then no longer
+    enforces that order ids are unique, while Django keeps treating id as the primary key: ids stay unique only
+    as long as the application generates them (UUIDv7). convert refuses to run without --allow-non-unique.
+    """
+    help = "Manage monthly range partitions of the orders table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["convert", "create", "status"])
+        parser.add_argument("--months-ahead", type=int, default=3, help="Future monthly partitions to keep ready.")
+        parser.add_argument("--drop-old", action="store_true", help="Drop the unpartitioned table after convert.")
+        parser.add_argument("--allow-non-unique", action="store_true",
+                            help="Convert although Postgres will no longer enforce that order ids are unique.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Order partitioning needs a Postgres database")
+        self.table = Order._meta.db_table
+        if options["action"] == "convert":
+            self.convert(options["months_ahead"], options["drop_old"], options["allow_non_unique"])
+        elif options["action"] == "create":
+            if not self.is_partitioned():
+                raise CommandError(f"{self.table} is not partitioned, run `partition_orders convert` first")
+            created = self.create_partitions(self.table, month_start(timezone.now().date()), options["months_ahead"])
+            self.stdout.write(self.style.SUCCESS(f"Created {len(created)} partitions: {', '.join(created) or '-'}"))
+            self.warn_default_rows()
+        else:
+            self.status()
+
+    def is_partitioned(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [self.table])
+            row = cursor.fetchone()
+        return bool(row) and row[0] == "p"
+
+    def create_partitions(self, table, first_month, months_ahead):
+        """
+        Create monthly partitions from first_month up to months_ahead months after the current one.
+        @return: The names of partitions that did not exist yet.
+        """
+        quote = connection.ops.quote_name
+        last_month = add_months(month_start(timezone.now().date()), months_ahead)
+        created = []
+        month = first_month
+        with connection.cursor() as cursor:
+            while month <= last_month:
+                name = partition_name(self.table, month)
+                cursor.execute("SELECT to_regclass(%s)", [name])
+                if cursor.fetchone()[0] is None:
+                    cursor.execute(
+                        f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} FOR VALUES FROM (%s) TO (%s)",
+                        [f"{month.isoformat()} 00:00:00+00", f"{add_months(month, 1).isoformat()} 00:00:00+00"])
+                    created.append(name)
+                month = add_months(month, 1)
+        return created
+
+    def convert(self, months_ahead, drop_old, allow_non_unique):
+        if self.is_partitioned():
+            raise CommandError(f"{self.table} is already partitioned")
+        quote = connection.ops.quote_name
+        table, new_table, old_table = self.table, f"{self.table}_partitioned", f"{self.table}_unpartitioned"
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {quote(table)} IN EXCLUSIVE MODE")
+            cursor.execute(
+                "SELECT c.relname, pg_get_indexdef(i.indexrelid), i.indisprimary, i.indisunique "
+                "FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE i.indrelid = %s::regclass",
+                [table])
+            indexes = cursor.fetchall()
+            lost = ["id (the primary key)"] + [name for name, _, primary, unique in indexes if unique and not primary]
+            if not allow_non_unique:
+                raise CommandError(
+                    f"Partitioning drops the uniqueness of {', '.join(lost)}, Postgres only enforces unique "
+                    f"constraints that include date_created. Rerun with --allow-non-unique to convert anyway.")
+            cursor.execute(
+                "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                "WHERE conrelid = %s::regclass AND contype = 'f'", [table])
+            foreign_keys = cursor.fetchall()
+            cursor.execute(f"SELECT min(date_created) FROM {quote(table)}")
+            oldest = cursor.fetchone()[0]
+
+            cursor.execute(
+                f"CREATE TABLE {quote(new_table)} (LIKE {quote(table)} INCLUDING DEFAULTS INCLUDING STORAGE) "
+                f"PARTITION BY RANGE (date_created)")
+            cursor.execute(f"ALTER TABLE {quote(new_table)} ADD PRIMARY KEY (id, date_created)")
+            for name, definition in foreign_keys:
+                cursor.execute(f"ALTER TABLE {quote(new_table)} ADD CONSTRAINT {quote(name + '_p')} {definition}")
+            for name, definition, primary, unique in indexes:
+                if primary:
+                    continue
+                if unique:
+                    self.stderr.write(self.style.WARNING(
+                        f"Dropping unique index {name}, it does not include the partition key"))
+                    continue
+                cursor.execute(re.sub(
+                    rf" INDEX {re.escape(name)} ON ((?:\S+\.)?){re.escape(table)} USING ",
+                    lambda match: f" INDEX {name}_p ON {match.group(1)}{new_table} USING ", definition, count=1))
+
+            first_month = month_start(oldest.astimezone(dt_timezone.utc).date() if oldest else timezone.now().date())
+            self.create_partitions(new_table, first_month, months_ahead)
+            cursor.execute(
+                f"CREATE TABLE {quote(f'{table}_{DEFAULT_PARTITION_SUFFIX}')} PARTITION OF {quote(new_table)} DEFAULT")
+            cursor.execute(f"INSERT INTO {quote(new_table)} SELECT * FROM {quote(table)}")
+
+            # Move the old table and its index names aside, then give the new ones the original names
+            cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(old_table)}")
+            for name, _, _, _ in indexes:
+                cursor.execute(f"ALTER INDEX {quote(name)} RENAME TO {quote(name + '_u')}")
+            for name, _ in foreign_keys:
+                cursor.execute(f"ALTER TABLE {quote(old_table)} RENAME CONSTRAINT {quote(name)} TO {quote(name + '_u')}")
+            cursor.execute(f"ALTER TABLE {quote(new_table)} RENAME TO {quote(table)}")
+            cursor.execute(f"ALTER TABLE {quote(table)} RENAME CONSTRAINT {quote(new_table + '_pkey')} TO {quote(table + '_pkey')}")
+            for name, _, primary, unique in indexes:
+                if not primary and not unique:
+                    cursor.execute(f"ALTER INDEX {quote(name + '_p')} RENAME TO {quote(name)}")
+            for name, _ in foreign_keys:
+                cursor.execute(f"ALTER TABLE {quote(table)} RENAME CONSTRAINT {quote(name + '_p')} TO {quote(name)}")
+            if drop_old:
+                cursor.execute(f"DROP TABLE {quote(old_table)}")
+
+        self.stdout.write(self.style.SUCCESS(f"{table} is now partitioned by month on date_created"))
+        if not drop_old:
+            self.stdout.write(f"The original table was kept as {old_table}, drop it once verified")
+
+    def warn_default_rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {connection.ops.quote_name(f'{self.table}_{DEFAULT_PARTITION_SUFFIX}')}")
+            rows = cursor.fetchone()[0]
+        if rows:
+            self.stderr.write(self.style.WARNING(
+                f"{rows} orders sit in the default partition, partitions overlapping them cannot be created"))
+
+    def status(self):
+        if not self.is_partitioned():
+            self.stdout.write(f"{self.table} is not partitioned")
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint, "
+                "pg_size_pretty(pg_total_relation_size(c.oid)) FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass ORDER BY c.relname",
+                [self.table])
+            for name, bound, rows, size in cursor.fetchall():
+                self.stdout.write(f"{name:<28} {max(rows, 0):>12} rows {size:>10}  {bound}")
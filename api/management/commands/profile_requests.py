@@ -0,0 +1,106 @@
+import json
+import os
+import pstats
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.interfaces.profiling import MODES, endpoint_slug, load_index, sign_trigger
+
+
+class Command(BaseCommand):
+    """
+    Trigger and read the request profiles of api.middleware.ProfilingMiddleware.
+
+    sign    prints an X-Profile header value that gets a request profiled in --mode, valid for
+            PROFILING_TRIGGER_MAX_AGE seconds. Only holders of the SECRET_KEY can make one.
+    report  aggregates the profiles stored in --directory by endpoint: request durations, the functions with the
+            most cumulative time (cpu), the frames most often on CPU (sample) and the source lines holding the
+            most memory (memory). With --output the sampled stacks of each endpoint are merged into
+            <output>/<endpoint>.folded, ready for flamegraph.pl or speedscope.
+    """
+    help = "Sign a profiling trigger or report on stored request profiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["sign", "report"])
+        parser.add_argument("--mode", choices=MODES, default="cpu")
+        parser.add_argument("--directory", default=settings.PROFILING_DIR)
+        parser.add_argument("--endpoint", action="append", help="Only this endpoint, e.g. create_order. Repeatable.")
+        parser.add_argument("--limit", type=int, default=15, help="Rows printed per endpoint and mode.")
+        parser.add_argument("--output", help="Directory to write merged .folded stacks to.")
+
+    def handle(self, *args, **options):
+        if options["action"] == "sign":
+            self.stdout.write(f"X-Profile: {sign_trigger(options['mode'])}")
+            return
+
+        records = load_index(options["directory"])
+        if options["endpoint"]:
+            records = [record for record in records if record["endpoint"] in options["endpoint"]]
+        if not records:
+            raise CommandError(f"No profiles in {options['directory']}")
+        by_endpoint = defaultdict(list)
+        for record in records:
+            by_endpoint[record["endpoint"]].append(record)
+
+        # Slowest endpoints first
+        for endpoint, profiles in sorted(
+                by_endpoint.items(), key=lambda item: -max(record["duration_ms"] for record in item[1])):
+            durations = sorted(record["duration_ms"] for record in profiles)
+            self.stdout.write(self.style.SUCCESS(
+                f"{endpoint}: {len(profiles)} profiles, median {durations[len(durations) // 2]:.1f} ms, "
+                f"max {durations[-1]:.1f} ms"))
+            files = defaultdict(list)
+            for record in profiles:
+                files[record["mode"]].append(os.path.join(options["directory"], record["file"]))
+            if files["cpu"]:
+                self.cpu(files["cpu"], options["limit"])
+            if files["sample"]:
+                self.sample(endpoint, files["sample"], options["limit"], options["output"])
+            if files["memory"]:
+                self.memory(files["memory"], options["limit"])
+
+    def cpu(self, files, limit):
+        stats = pstats.Stats(*files).stats
+        self.stdout.write(f"  cpu, {len(files)} profiles, per request: cumulative ms, own ms, calls")
+        for (filename, line, name), (_, calls, own, cumulative, _) in sorted(
+                stats.items(), key=lambda item: -item[1][3])[:limit]:
+            self.stdout.write(f"    {cumulative / len(files) * 1000:>10.1f}{own / len(files) * 1000:>10.1f}"
+                              f"{calls // len(files):>10}  {os.path.basename(filename)}:{line}({name})")
+
+    def sample(self, endpoint, files, limit, output):
+        stacks = Counter()
+        for path in files:
+            with open(path) as lines:
+                for line in lines:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    stacks[stack] += int(count)
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        self.stdout.write(f"  sample, {len(files)} profiles, {total} samples: % of samples, innermost frame")
+        for frame, count in leaves.most_common(limit):
+            self.stdout.write(f"    {count / total * 100:>6.1f}  {frame}")
+        if output:
+            os.makedirs(output, exist_ok=True)
+            path = os.path.join(output, f"{endpoint_slug(endpoint)}.folded")
+            with open(path, "w") as merged:
+                merged.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+            self.stdout.write(f"    merged stacks written to {path}")
+
+    def memory(self, files, limit):
+        sizes = Counter()
+        counts = Counter()
+        peak = 0
+        for path in files:
+            with open(path) as profile:
+                report = json.load(profile)
+            peak = max(peak, report["peak"])
+            for allocation in report["allocations"]:
+                sizes[allocation["location"]] += allocation["size"]
+                counts[allocation["location"]] += allocation["count"]
+        self.stdout.write(f"  memory, {len(files)} profiles, peak {peak / 1024:.0f} KiB, per request: KiB, blocks")
+        for location, size in sizes.most_common(limit):
+            self.stdout.write(f"    {size / len(files) / 1024:>10.1f}{counts[location] // len(files):>10}  {location}")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.interfaces.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    """
+    Delete stored Idempotency-Key responses past their TTL, meant to run periodically from cron.
+    """
+    help = "Delete expired idempotency keys."
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f"Deleted {purge_expired_keys()} expired idempotency keys"))
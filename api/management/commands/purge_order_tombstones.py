@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.interfaces.orderchanges import purge_tombstones
+
+
+class Command(BaseCommand):
+    """
+    Delete tombstones of deleted orders past ORDER_TOMBSTONE_TTL_DAYS, meant to run periodically from cron.
+    """
+    help = "Delete expired order tombstones."
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f"Deleted {purge_tombstones()} expired order tombstones"))
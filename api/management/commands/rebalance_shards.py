@@ -0,0 +1,138 @@
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from api.dbrouter import shard_for_code
+from api.interfaces.orderchanges import moving_orders
+from api.models import ArchivedOrder, Customer, Order, OrderTombstone
+
+# Rows of a customer, other than the customer itself, that move with it
+CUSTOMER_ROWS = (Order, ArchivedOrder, OrderTombstone)
+# Rows inserted per executemany while copying
+INSERT_CHUNK_SIZE = 2000
+
+
+class Command(BaseCommand):
+    """
+    Move customers, with their orders, archived orders and tombstones, to the shard their code hashes to
+    under a layout of shards, e.g. after appending a database to ORDER_SHARDS.
+
+    plan   counts, per --from database, the customers that belong on another shard under --shards.
+    copy   copies them there batch by batch, replacing any earlier copy. Nothing is deleted from --from.
+    prune  deletes from each --from database the customers that belong elsewhere and have been copied there.
+
+    To change the layout: add and migrate the new databases (DB_SHARDS, `migrate --database`), pause order
+    writes, run copy with the new --shards, set ORDER_SHARDS to them and restart, resume writes, then run prune.
+    Both copy and prune can be rerun.
+    """
+    help = "Plan, copy or prune customer moves between shards."
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["plan", "copy", "prune"])
+        parser.add_argument(
+            "--shards", help="Comma separated aliases of the target layout, ORDER_SHARDS by default.")
+        parser.add_argument(
+            "--from", dest="sources",
+            help="Comma separated aliases holding customers now, ORDER_SHARDS (or default when unsharded) by default.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Customers moved per transaction.")
+
+    def handle(self, *args, **options):
+        shards = self.aliases(options["shards"]) or settings.ORDER_SHARDS
+        sources = self.aliases(options["sources"]) or settings.ORDER_SHARDS or [DEFAULT_DB_ALIAS]
+        if not shards:
+            raise CommandError("Pass --shards or set ORDER_SHARDS")
+        unknown = set(shards + sources) - set(connections.settings)
+        if unknown:
+            raise CommandError(f"Unknown databases: {', '.join(sorted(unknown))}")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be a positive integer")
+
+        moves = Counter()
+        for source in sources:
+            for batch in self.misplaced(source, shards, options["batch_size"]):
+                for target, ids in batch.items():
+                    if options["action"] == "copy":
+                        copy_customers(ids, source, target)
+                    elif options["action"] == "prune":
+                        ids = prune_customers(ids, source, target)
+                    moves[source, target] += len(ids)
+
+        verb = {"plan": "to move", "copy": "copied", "prune": "pruned"}[options["action"]]
+        for (source, target), count in sorted(moves.items()):
+            self.stdout.write(f"{source} -> {target}: {count} customers {verb}")
+        self.stdout.write(self.style.SUCCESS(f"{sum(moves.values())} customers {verb}"))
+
+    @staticmethod
+    def aliases(value):
+        return [alias.strip() for alias in (value or "").split(",") if alias.strip()]
+
+    @staticmethod
+    def misplaced(source, shards, size):
+        """
+        Walk the customers of source in id order.
+        @return: A generator of {target alias: [customer id]} batches of customers that belong on another shard.
+        """
+        last_id = None
+        while True:
+            customers = Customer.objects.using(source).exclude(code=None).order_by("id")
+            if last_id is not None:
+                customers = customers.filter(id__gt=last_id)
+            rows = list(customers.values_list("id", "code")[:size])
+            if not rows:
+                return
+            batch = defaultdict(list)
+            for customer_id, code in rows:
+                target = shard_for_code(code, shards)
+                if target != source:
+                    batch[target].append(customer_id)
+            yield batch
+            last_id = rows[-1][0]
+
+
+def copy_customers(ids, source, target):
+    """
+    Copy customers and their rows from source to target in one transaction, replacing what target has of them.
+    """
+    with transaction.atomic(using=target), moving_orders():
+        for model in CUSTOMER_ROWS:
+            model.objects.using(target).filter(customer_id__in=ids).delete()
+        Customer.objects.using(target).filter(id__in=ids).delete()
+        insert_rows(Customer, Customer.objects.using(source).filter(id__in=ids), target)
+        for model in CUSTOMER_ROWS:
+            insert_rows(model, model.objects.using(source).filter(customer_id__in=ids), target)
+
+
+def prune_customers(ids, source, target):
+    """
+    Delete from source the customers among ids that target has a copy of.
+    @return: The ids deleted.
+    """
+    copied = list(Customer.objects.using(target).filter(id__in=ids).values_list("id", flat=True))
+    with transaction.atomic(using=source), moving_orders():
+        for model in CUSTOMER_ROWS:
+            model.objects.using(source).filter(customer_id__in=copied).delete()
+        Customer.objects.using(source).filter(id__in=copied).delete()
+    return copied
+
+
+def insert_rows(model, queryset, alias):
+    """
+    Insert the rows of queryset into alias as they are. bulk_create would reset the auto_now and
+    auto_now_add timestamps.
+    """
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    fields = model._meta.concrete_fields
+    sql = (f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(quote(field.column) for field in fields)}) "
+           f"VALUES ({', '.join(['%s'] * len(fields))})")
+    chunk = []
+    with connection.cursor() as cursor:
+        for obj in queryset.iterator(chunk_size=INSERT_CHUNK_SIZE):
+            chunk.append([field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields])
+            if len(chunk) >= INSERT_CHUNK_SIZE:
+                cursor.executemany(sql, chunk)
+                chunk = []
+        if chunk:
+            cursor.executemany(sql, chunk)
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.dbrouter import shard_aliases, shard_db, use_shard
+from api.interfaces.customercounters import COUNTER_FIELDS, compute_counters
+from api.models import Customer
+
+
+class Command(BaseCommand):
+    """
+    Recompute the denormalised order counters on Customer from the hot and archived orders and fix any drift.
+    Customers are walked in primary key order and locked batch by batch, so concurrent order writes
+    either land before the recount or are applied on top of it. Sharded customers are walked shard by shard.
+    """
+    help = "Repair customer order counters from the orders tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Only report customers whose counters drifted.")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be a positive integer")
+        checked = fixed = 0
+        for alias in shard_aliases():
+            with use_shard(alias):
+                shard_checked, shard_fixed = self.reconcile(options)
+            checked, fixed = checked + shard_checked, fixed + shard_fixed
+
+        verb = "would be repaired" if options["dry_run"] else "repaired"
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} customers, {fixed} {verb}"))
+
+    def reconcile(self, options):
+        """
+        Reconcile the customers of the current shard.
+        @return: The numbers of customers checked and repaired.
+        """
+        checked = fixed = 0
+        last_id = None
+        while True:
+            with transaction.atomic(using=shard_db()):
+                customers = Customer.objects.select_for_update().order_by("id").only("id", *COUNTER_FIELDS)
+                if last_id is not None:
+                    customers = customers.filter(id__gt=last_id)
+                customers = list(customers[:options["batch_size"]])
+                if not customers:
+                    break
+                expected = compute_counters([customer.id for customer in customers])
+                drifted = []
+                for customer in customers:
+                    values = expected[customer.id]
+                    if any(getattr(customer, field) != values[field] for field in COUNTER_FIELDS):
+                        for field in COUNTER_FIELDS:
+                            setattr(customer, field, values[field])
+                        drifted.append(customer)
+                if drifted and not options["dry_run"]:
+                    Customer.objects.bulk_update(drifted, COUNTER_FIELDS)
+            checked += len(customers)
+            fixed += len(drifted)
+            last_id = customers[-1].id
+            if options["verbosity"] > 1:
+                for customer in drifted:
+                    self.stdout.write(f"Customer {customer.id} counters drifted")
+        return checked, fixed
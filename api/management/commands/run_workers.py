@@ -0,0 +1,163 @@
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api.interfaces.jobqueue import DONE, FAILED, RETRIED, queue_stats, retry_failed, run_next
+
+
+class Command(BaseCommand):
+    """
+    Run the queued jobs (api.interfaces.jobqueue) with --processes forked processes of --workers threads each.
+    Jobs are claimed with SKIP LOCKED, so every worker, and any number of concurrent runs, takes different jobs.
+    Workers poll every --interval seconds once the queue is empty, with --burst they stop instead.
+    On interrupt the jobs in flight roll back and are run again by the next worker.
+    The jobs run, retried and failed per function and the throughput are printed when the run ends.
+
+    --stats         prints, per job function, the jobs due, scheduled and failed and how long the oldest has waited.
+    --retry-failed  queues the failed jobs again.
+    """
+    help = "Run queued background jobs, or report on the queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=1, help="Worker threads per process.")
+        parser.add_argument("--processes", type=int, default=1)
+        parser.add_argument("--burst", action="store_true", help="Stop once no job is due.")
+        parser.add_argument("--interval", type=float, default=settings.JOB_POLL_SECONDS)
+        parser.add_argument("--stats", action="store_true", help="Report on the queue and exit.")
+        parser.add_argument("--retry-failed", action="store_true", help="Queue the failed jobs again and exit.")
+
+    def handle(self, *args, **options):
+        if options["stats"]:
+            self.stats()
+            return
+        if options["retry_failed"]:
+            self.stdout.write(self.style.SUCCESS(f"Queued {retry_failed()} failed jobs again"))
+            return
+        if options["workers"] < 1 or options["processes"] < 1:
+            raise CommandError("--workers and --processes must be positive integers")
+
+        started = time.monotonic()
+        if options["processes"] == 1:
+            counts, errors = self.pool(options)
+        else:
+            counts, errors = self.fork(options)
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(f"{'job':<50}{DONE:>8}{RETRIED:>9}{FAILED:>8}")
+        for func in sorted({func for func, _ in counts}):
+            self.stdout.write(
+                f"{func:<50}{counts[func, DONE]:>8}{counts[func, RETRIED]:>9}{counts[func, FAILED]:>8}")
+        ran = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Ran {ran} jobs in {elapsed:.1f}s ({ran / elapsed if elapsed else 0:.1f} jobs/s)"))
+        if errors:
+            raise CommandError(f"Worker failed: {errors[0]}")
+
+    @staticmethod
+    def work(options, stop):
+        """Run jobs until stop is set, or no job is due with --burst. @return: A Counter of (func, outcome)."""
+        counts = Counter()
+        try:
+            while not stop.is_set():
+                ran = run_next()
+                if ran:
+                    counts[ran] += 1
+                elif options["burst"]:
+                    break
+                else:
+                    stop.wait(options["interval"])
+        except KeyboardInterrupt:
+            pass
+        return counts
+
+    def pool(self, options):
+        """
+        Run --workers threads in this process.
+        @return: The Counter of (func, outcome) of all of them and the errors that stopped any.
+        """
+        stop = threading.Event()
+        # A single worker runs on the command's own thread and connection
+        if options["workers"] == 1:
+            return self.work(options, stop), []
+
+        counts = Counter()
+        lock = threading.Lock()
+        errors = []
+
+        def thread_work():
+            try:
+                ran = self.work(options, stop)
+                with lock:
+                    counts.update(ran)
+            except Exception as ex:
+                errors.append(ex)
+            finally:
+                connections.close_all()
+
+        workers = [
+            threading.Thread(target=thread_work, name=f"jobs-{number}", daemon=True)
+            for number in range(options["workers"])]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            stop.set()
+            for worker in workers:
+                worker.join()
+        return counts, errors
+
+    def fork(self, options):
+        """
+        Fork --processes processes each running pool(), and gather what they ran.
+        """
+        # Children must not share the parent's database sockets
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+
+        def process_work():
+            try:
+                counts, errors = self.pool(options)
+                results.put((counts, [str(error) for error in errors]))
+            finally:
+                connections.close_all()
+
+        processes = [context.Process(target=process_work, name=f"jobs-p{number}")
+                     for number in range(options["processes"])]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            # Passed on in case only this process was interrupted, the children finish their jobs in flight
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGINT)
+            for process in processes:
+                process.join()
+
+        counts = Counter()
+        errors = []
+        while not results.empty():
+            ran, failed = results.get()
+            counts.update(ran)
+            errors.extend(failed)
+        errors.extend(f"process {process.name} exited with {process.exitcode}"
+                      for process in processes if process.exitcode)
+        return counts, errors
+
+    def stats(self):
+        self.stdout.write(f"{'job':<50}{'due':>8}{'scheduled':>11}{'failed':>8}{'wait (s)':>10}")
+        for row in queue_stats():
+            wait = f"{row['wait_seconds']:.0f}" if row["wait_seconds"] is not None else "-"
+            self.stdout.write(f"{row['func']:<50}{row['due']:>8}{row['scheduled']:>11}{row['failed']:>8}{wait:>10}")
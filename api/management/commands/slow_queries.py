@@ -0,0 +1,65 @@
+import os
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.interfaces.slowqueries import load_log, plan_hints
+
+
+class Command(BaseCommand):
+    """
+    Report on the slow query log (SLOW_QUERY_LOG) written by api.middleware.SlowQueryMiddleware.
+
+    report  prints the --limit query fingerprints with the most total time, with their calls, mean and max
+            duration, the endpoints running them and, from the latest captured plan, sequential scans
+            discarding rows (missing indexes) and sorts spilling to disk.
+    clear   empties the log.
+    """
+    help = "Report the slowest queries by fingerprint or clear the slow query log."
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["report", "clear"])
+        parser.add_argument("--log", default=settings.SLOW_QUERY_LOG)
+        parser.add_argument("--limit", type=int, default=20)
+        parser.add_argument("--hours", type=float, help="Only queries logged in the last hours.")
+        parser.add_argument("--endpoint", help="Only queries run by this endpoint, e.g. get_all_orders.")
+
+    def handle(self, *args, **options):
+        if options["action"] == "clear":
+            if os.path.exists(options["log"]):
+                os.truncate(options["log"], 0)
+            self.stdout.write(self.style.SUCCESS(f"Cleared {options['log']}"))
+            return
+
+        since = timezone.now() - timedelta(hours=options["hours"]) if options["hours"] else None
+        entries = load_log(options["log"], since)
+        if options["endpoint"]:
+            entries = [entry for entry in entries if entry["endpoint"] == options["endpoint"]]
+        if not entries:
+            raise CommandError(f"No slow queries in {options['log']}")
+
+        by_fingerprint = defaultdict(list)
+        for entry in entries:
+            by_fingerprint[entry["fingerprint"]].append(entry)
+        ranked = sorted(by_fingerprint.items(), key=lambda item: -sum(entry["duration_ms"] for entry in item[1]))
+
+        self.stdout.write(f"{'fingerprint':<18}{'calls':>8}{'total ms':>12}{'mean ms':>10}{'max ms':>10}  endpoints")
+        for key, runs in ranked[:options["limit"]]:
+            durations = [entry["duration_ms"] for entry in runs]
+            endpoints = Counter(entry["endpoint"] for entry in runs)
+            self.stdout.write(
+                f"{key:<18}{len(runs):>8}{sum(durations):>12.1f}{sum(durations) / len(runs):>10.1f}"
+                f"{max(durations):>10.1f}  {', '.join(f'{name} ({count})' for name, count in endpoints.most_common(3))}")
+            self.stdout.write(f"    {runs[-1]['sql'][:500]}")
+            planned = [entry for entry in runs if entry.get("plan")]
+            if planned:
+                if not planned[-1].get("analyzed", True):
+                    self.stdout.write("    plan estimated with EXPLAIN only, the statement is not a plain read")
+                for hint in plan_hints(planned[-1]["plan"]) or ["plan captured, no sequential scan or disk sort"]:
+                    self.stdout.write(f"    {hint}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(entries)} slow queries, {len(by_fingerprint)} fingerprints, "
+            f"{sum(entry['duration_ms'] for entry in entries):.1f} ms in total"))
@@ -0,0 +1,68 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.interfaces.auth0users import Auth0ManagementClient, iter_user_pages, upsert_users, user_from_auth0
+
+
+class Command(BaseCommand):
+    """
+    Copy the users of the Auth0 tenant into the User table, e.g. when onboarding an existing tenant.
+    Pages of --per-page users are fetched oldest first by --workers threads over one pooled client and upserted
+    on openid_user_id one page at a time. Existing users get their email and name refreshed, their role and
+    phone number are left alone. Users whose email or phone number belongs to another user are skipped and listed.
+    With --checkpoint the created_at of the last upserted user is saved after every page, rerunning the same
+    command resumes from it. The file is removed once the sync completes.
+    """
+    help = "Upsert the Auth0 tenant's users into the User table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--per-page", type=int, default=100, help="Users per Auth0 request, 100 at most.")
+        parser.add_argument("--workers", type=int, default=4, help="Concurrent Auth0 requests.")
+        parser.add_argument("--checkpoint", help="Checkpoint file used to resume an interrupted sync.")
+
+    def handle(self, *args, **options):
+        if not 1 <= options["per_page"] <= 100:
+            raise CommandError("--per-page must be between 1 and 100")
+        if options["workers"] < 1:
+            raise CommandError("--workers must be a positive integer")
+        checkpoint_path = options["checkpoint"]
+        since = self._load_checkpoint(checkpoint_path)
+
+        # Keyed by openid_user_id, users on the edge of two query windows are fetched twice
+        synced, skipped = set(), {}
+        client = Auth0ManagementClient(workers=options["workers"])
+        try:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+                for page in iter_user_pages(client, executor, options["per_page"], since):
+                    if not page:
+                        continue
+                    upserted, conflicts = upsert_users([user_from_auth0(user) for user in page])
+                    synced.update(user.openid_user_id for user in upserted)
+                    skipped.update((user.openid_user_id, user) for user in conflicts)
+                    if checkpoint_path:
+                        self._save_checkpoint(checkpoint_path, page[-1]["created_at"])
+        finally:
+            client.close()
+
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        for user in skipped.values():
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {user.openid_user_id}: email {user.email} or phone number taken by another user"))
+        self.stdout.write(self.style.SUCCESS(f"Synced {len(synced)} Auth0 users, {len(skipped)} skipped"))
+
+    @staticmethod
+    def _load_checkpoint(path):
+        if not path or not os.path.exists(path):
+            return None
+        with open(path) as checkpoint:
+            return json.load(checkpoint)["since"]
+
+    @staticmethod
+    def _save_checkpoint(path, since):
+        with open(f"{path}.tmp", "w") as checkpoint:
+            json.dump({"since": since}, checkpoint)
+        os.replace(f"{path}.tmp", path)
@@ -0,0 +1,99 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api.dbrouter import shard_aliases, use_shard
+from api.interfaces.syncengine import get_sink, sync_batch, sync_lag, sync_models
+
+
+class Command(BaseCommand):
+    """
+    Send unsynced rows of the sync models (SYNC_MODEL) to the SYNC_SINK and mark them synced.
+
+    run  syncs batches of --batch-size rows until nothing is left, with --workers threads. Rows are claimed
+         with SKIP LOCKED, so the workers, and any number of concurrent runs, never send a row twice at once.
+         With --follow it keeps polling every --interval seconds once caught up.
+    lag  prints, per model, the unsynced rows and the age of the oldest unsynced change.
+    """
+    help = "Sync unsynced rows to the configured sink or report the sync lag."
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["run", "lag"])
+        parser.add_argument("--model", action="append", help="Model label to sync, e.g. api.Order. Repeatable.")
+        parser.add_argument("--batch-size", type=int, default=settings.SYNC_BATCH_SIZE)
+        parser.add_argument("--workers", type=int, default=1)
+        parser.add_argument("--follow", action="store_true", help="Keep syncing new changes until interrupted.")
+        parser.add_argument("--interval", type=float, default=settings.SYNC_POLL_SECONDS)
+
+    def handle(self, *args, **options):
+        models = sync_models()
+        if options["model"]:
+            unknown = set(options["model"]) - {model._meta.label for model in models}
+            if unknown:
+                raise CommandError(f"Not sync models: {', '.join(sorted(unknown))}")
+            models = [model for model in models if model._meta.label in options["model"]]
+        if options["action"] == "lag":
+            self.lag(models)
+            return
+        if options["batch_size"] < 1 or options["workers"] < 1:
+            raise CommandError("--batch-size and --workers must be positive integers")
+
+        counts = {model._meta.label: 0 for model in models}
+        lock = threading.Lock()
+        errors = []
+
+        def work():
+            sink = get_sink()
+            try:
+                while True:
+                    synced = 0
+                    for alias in shard_aliases():
+                        for model in models:
+                            with use_shard(alias):
+                                moved = sync_batch(model, sink, options["batch_size"])
+                            with lock:
+                                counts[model._meta.label] += moved
+                            synced += moved
+                    if not synced:
+                        if not options["follow"]:
+                            return
+                        time.sleep(options["interval"])
+            except Exception as ex:
+                errors.append(ex)
+
+        def thread_work():
+            try:
+                work()
+            finally:
+                connections.close_all()
+
+        try:
+            # A single worker runs on the command's own thread and connection
+            if options["workers"] == 1:
+                work()
+            else:
+                workers = [
+                    threading.Thread(target=thread_work, name=f"sync-{number}", daemon=True)
+                    for number in range(options["workers"])]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+        except KeyboardInterrupt:
+            # Batches in flight roll back and their rows stay unsynced
+            pass
+        for label, count in counts.items():
+            self.stdout.write(f"Synced {count} {label} rows")
+        if errors:
+            raise CommandError(f"Sync failed: {errors[0]}")
+
+    def lag(self, models):
+        self.stdout.write(f"{'model':<16}{'unsynced':>12}{'oldest':>28}{'lag (s)':>12}")
+        for model in models:
+            stats = sync_lag(model)
+            oldest = f"{stats['oldest_unsynced']:%Y-%m-%d %H:%M:%S}" if stats["oldest_unsynced"] else "-"
+            lag = f"{stats['lag_seconds']:.0f}" if stats["lag_seconds"] is not None else "-"
+            self.stdout.write(f"{stats['model']:<16}{stats['unsynced']:>12}{oldest:>28}{lag:>12}")
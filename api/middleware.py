@@ -0,0 +1,413 @@
+import gzip
+import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connection
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+
+from api import dbrouter
+from api.interfaces import jwttokens, profiling
+from api.interfaces.slowqueries import record_slow_queries
+from api.models import RateLimitBucket
+
+try:
+    import brotli
+except ImportError:  # Optional, responses fall back to gzip without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# A bucket holds `limit` tokens and refills at limit / period tokens per second
+RateLimitRule = namedtuple("RateLimitRule", ["prefix", "limit", "period"])
+
+# Idle buckets are dropped every PRUNE_EVERY requests, a dropped bucket is the same as a full one
+PRUNE_EVERY = 1000
+# Weight of the newest sample in the smoothed queue time
+QUEUE_DELAY_ALPHA = 0.2
+
+
+class MemoryStorage(object):
+    """
+    Token buckets held in the worker process. Each worker enforces the limits on its own,
+    so the effective limit is multiplied by the number of workers.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def consume(self, key, rule):
+        """
+        Take a token from a bucket.
+        @return: An (allowed, remaining tokens, seconds until a token is available) tuple.
+        """
+        rate = rule.limit / rule.period
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (rule.limit, now))
+            tokens = min(rule.limit, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return True, tokens - 1, 0
+            self.buckets[key] = (tokens, now)
+        return False, tokens, (1 - tokens) / rate
+
+    def prune(self, idle_seconds):
+        cutoff = time.monotonic() - idle_seconds
+        with self.lock:
+            self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[1] >= cutoff}
+
+
+class DatabaseStorage(object):
+    """
+    Token buckets shared by all workers in the api_ratelimitbucket table (Postgres).
+    Refilling and taking a token is a single upsert, so concurrent requests cannot overdraw a bucket.
+    """
+    TABLE = RateLimitBucket._meta.db_table
+
+    def __init__(self):
+        if connection.vendor != "postgresql":
+            raise ImproperlyConfigured("RATE_LIMIT_STORAGE 'database' needs a Postgres database")
+
+    def consume(self, key, rule):
+        rate = rule.limit / rule.period
+        refilled = f"LEAST(%s, {self.TABLE}.tokens + EXTRACT(EPOCH FROM statement_timestamp() - {self.TABLE}.updated_at) * %s)"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.TABLE} (key, tokens, updated_at) VALUES (%s, %s, statement_timestamp()) "
+                f"ON CONFLICT (key) DO UPDATE SET tokens = {refilled} - 1, updated_at = statement_timestamp() "
+                f"WHERE {refilled} >= 1 RETURNING tokens",
+                [key, rule.limit - 1, rule.limit, rate, rule.limit, rate])
+            row = cursor.fetchone()
+            if row is not None:
+                return True, row[0], 0
+            # The bucket is empty and was left untouched, read it to tell the client when to come back
+            cursor.execute(
+                f"SELECT tokens + EXTRACT(EPOCH FROM statement_timestamp() - updated_at) * %s FROM {self.TABLE} "
+                f"WHERE key = %s", [rate, key])
+            row = cursor.fetchone()
+        tokens = min(float(row[0]), 1) if row else 0
+        return False, tokens, (1 - tokens) / rate
+
+    def prune(self, idle_seconds):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.TABLE} WHERE updated_at < statement_timestamp() - make_interval(secs => %s)",
+                [idle_seconds])
+
+
+class CacheStorage(object):
+    """
+    Counters in the Django cache, shared by all workers when CACHES points at Redis or Memcached.
+    Caches have no compare-and-set, so instead of a token bucket this counts requests in fixed windows
+    of the rule's period with atomic increments. A client can burst up to twice the limit across a window edge.
+    """
+
+    def consume(self, key, rule):
+        now = time.time()
+        window = int(now // rule.period)
+        cache_key = f"ratelimit:{key}:{window}"
+        cache.add(cache_key, 0, timeout=rule.period + 1)
+        try:
+            count = cache.incr(cache_key)
+        except ValueError:
+            # Evicted between add and incr
+            cache.set(cache_key, 1, timeout=rule.period + 1)
+            count = 1
+        return count <= rule.limit, max(rule.limit - count, 0), (window + 1) * rule.period - now
+
+    def prune(self, idle_seconds):
+        """Cache entries expire on their own."""
+
+
+STORAGES = {
+    "memory": MemoryStorage,
+    "database": DatabaseStorage,
+    "cache": CacheStorage,
+}
+
+
+def client_key(request):
+    """
+    Identify who a request counts against: the user_id of a valid JWT, otherwise the client IP.
+    The token is verified here because the middleware runs before login_required, an unverified
+    user_id would let a client spend someone else's budget.
+    """
+    token = jwttokens.get_token_from_request(request)
+    if token:
+        try:
+            return f"user:{jwttokens.decode_token(token)['user_id']}"
+        except jwttokens.JWTError:
+            pass
+        except Exception as ex:
+            # A missing JWT_SECRET or a token without user_id, login_required answers those
+            logger.error(f"Could not identify the rate limited client by its token: {ex!r}")
+    ip = request.META.get("REMOTE_ADDR", "")
+    if settings.RATE_LIMIT_TRUST_X_FORWARDED_FOR:
+        ip = request.META.get("HTTP_X_FORWARDED_FOR", ip).split(",")[0].strip()
+    return f"ip:{ip}"
+
+
+class RateLimitMiddleware(object):
+    """
+    Per client token bucket rate limiting of the API.
+    RATE_LIMIT_RULES lists (path prefix, requests, period in seconds), the first prefix matching a request
+    applies and each client gets a bucket per rule. Requests over the limit get a 429 with Retry-After.
+    RATE_LIMIT_STORAGE picks where buckets live: 'memory' (per worker), 'database' or 'cache' (shared).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rules = [RateLimitRule(*rule) for rule in settings.RATE_LIMIT_RULES]
+        if settings.RATE_LIMIT_STORAGE not in STORAGES:
+            raise ImproperlyConfigured(f"RATE_LIMIT_STORAGE must be one of {', '.join(STORAGES)}")
+        self.storage = STORAGES[settings.RATE_LIMIT_STORAGE]()
+        self.idle_seconds = max((rule.period for rule in self.rules), default=0)
+        self.requests = 0
+
+    def __call__(self, request):
+        rule = next((rule for rule in self.rules if request.path.startswith(rule.prefix)), None)
+        if rule is None or request.method == "OPTIONS":
+            return self.get_response(request)
+
+        self.requests += 1
+        if self.requests % PRUNE_EVERY == 0:
+            self.storage.prune(self.idle_seconds)
+        key = client_key(request)
+        allowed, remaining, retry_after = self.storage.consume(f"{rule.prefix}:{key}", rule)
+        if allowed:
+            response = self.get_response(request)
+        else:
+            logger.info(f"Rate limited {key} on {rule.prefix}")
+            response = JsonResponse({"error": "Too many requests"}, status=429)
+            response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+        response["X-RateLimit-Limit"] = str(rule.limit)
+        response["X-RateLimit-Remaining"] = str(int(remaining))
+        return response
+
+
+def queue_delay(request):
+    """
+    Time a request spent queued before reaching the worker, from the X-Request-Start header a proxy sets
+    (e.g. nginx `proxy_set_header X-Request-Start "t=${msec}";`). Seconds, milliseconds and microseconds
+    since the epoch are accepted.
+    @return: The delay in seconds, or None without the header.
+    """
+    value = request.headers.get("X-Request-Start")
+    if not value:
+        return None
+    try:
+        started = float(value.removeprefix("t="))
+    except ValueError:
+        return None
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    return max(0.0, time.time() - started)
+
+
+class LoadSheddingMiddleware(object):
+    """
+    Turn requests away with a 503 and Retry-After while the worker is overloaded, so a backlog drains
+    instead of every client timing out. A worker is overloaded when it already runs LOAD_SHED_MAX_IN_FLIGHT
+    requests (threaded or async workers), or when the smoothed queue time of recent requests is over
+    LOAD_SHED_MAX_QUEUE_MS. Smoothing keeps a single slow request from triggering it, shedding stops once
+    the queue time drops back. Either check is disabled by setting it to 0.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.max_in_flight = settings.LOAD_SHED_MAX_IN_FLIGHT
+        self.max_queue_delay = settings.LOAD_SHED_MAX_QUEUE_MS / 1000
+        self.in_flight = 0
+        self.smoothed_delay = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        if not request.path.startswith(settings.LOAD_SHED_PATH_PREFIX):
+            return self.get_response(request)
+        delay = queue_delay(request)
+        with self.lock:
+            if delay is not None:
+                self.smoothed_delay += QUEUE_DELAY_ALPHA * (delay - self.smoothed_delay)
+            queued = bool(self.max_queue_delay) and self.smoothed_delay > self.max_queue_delay
+            busy = bool(self.max_in_flight) and self.in_flight >= self.max_in_flight
+            if not (queued or busy):
+                self.in_flight += 1
+        if queued or busy:
+            logger.warning(f"Shedding {request.path}: {self.in_flight} in flight, {self.smoothed_delay:.3f}s queued")
+            response = JsonResponse({"error": "Service overloaded, retry later"}, status=503)
+            response["Retry-After"] = str(max(1, math.ceil(self.smoothed_delay if queued else 1)))
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+# Content types worth compressing, images and archives are already compressed
+COMPRESSIBLE_TYPES = re.compile(r"^(text/|application/(json|x-ndjson|javascript|xml))")
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Pick the response encoding from an Accept-Encoding header, honouring q-values.
+    Brotli is preferred over gzip at equal weight when the brotli package is installed.
+    @return: 'br', 'gzip' or None to send the response as is.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        match = re.search(r"q\s*=\s*([0-9.]+)", params)
+        if match:
+            try:
+                weight = float(match.group(1))
+            except ValueError:
+                weight = 0.0
+        weights[coding] = weight
+    best, best_weight = None, 0.0
+    for coding in ("br", "gzip") if brotli else ("gzip",):
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+class CompressionMiddleware(object):
+    """
+    Compress text and JSON responses of at least COMPRESSION_MIN_BYTES with brotli or gzip, as negotiated
+    with Accept-Encoding. Smaller bodies are sent as is, compressing them costs more CPU than it saves on the wire.
+    Streaming responses are left alone, the orders export compresses itself with gzip=1.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_length = settings.COMPRESSION_MIN_BYTES
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header("Content-Encoding") or len(response.content) < self.min_length:
+            return response
+        if not COMPRESSIBLE_TYPES.match(response.get("Content-Type", "")):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+        if encoding is None:
+            return response
+
+        if encoding == "br":
+            compressed = brotli.compress(response.content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+        else:
+            compressed = gzip.compress(response.content, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = encoding
+        if response.has_header("ETag"):
+            # The body changed, so the ETag can only be a weak one
+            response["ETag"] = re.sub(r'^"', 'W/"', response["ETag"])
+        return response
+
+
+class ReplicaPinningMiddleware(object):
+    """
+    Pin a user's reads to the primary for REPLICA_STICKY_SECONDS after a request of theirs wrote to the
+    database, so replica lag never hides their own changes. See api.dbrouter.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = dbrouter.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = dbrouter.finish_request(token)
+        user_id = getattr(request, "user_id", None)
+        if wrote and user_id and settings.REPLICA_DATABASES:
+            dbrouter.pin_to_primary(user_id)
+        return response
+
+
+class ProfilingMiddleware(object):
+    """
+    Profile API requests on demand: those carrying a valid X-Profile header signed by
+    `manage.py profile_requests sign`, and a random PROFILING_SAMPLE_RATE share of the rest in PROFILING_SAMPLE_MODE.
+    Profiles are stored under PROFILING_DIR, see api.interfaces.profiling. Unless PROFILING_ENABLED is set the
+    middleware removes itself from the stack at startup and costs nothing.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        if settings.PROFILING_SAMPLE_MODE not in profiling.MODES:
+            raise ImproperlyConfigured(f"PROFILING_SAMPLE_MODE must be one of {', '.join(profiling.MODES)}")
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+
+    def mode(self, request):
+        """@return: How to profile the request, or None to leave it alone."""
+        if not request.path.startswith(settings.PROFILING_PATH_PREFIX):
+            return None
+        trigger = request.headers.get("X-Profile")
+        if trigger:
+            mode = profiling.read_trigger(trigger)
+            if mode is None:
+                logger.warning(f"Ignoring an invalid X-Profile header on {request.path}")
+            return mode
+        if self.sample_rate and random.random() < self.sample_rate:
+            return settings.PROFILING_SAMPLE_MODE
+        return None
+
+    def __call__(self, request):
+        mode = self.mode(request)
+        if mode is None:
+            return self.get_response(request)
+        profiler = profiling.PROFILERS[mode]()
+        if not profiler.start():
+            return self.get_response(request)
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            try:
+                profiling.store_profile(profiler, mode, request, status, time.perf_counter() - started)
+            except OSError as ex:
+                logger.error(f"Could not store the profile of {request.path}: {ex}")
+
+
+class SlowQueryMiddleware(object):
+    """
+    Log the queries of a request slower than SLOW_QUERY_MS with the endpoint that ran them, on every database,
+    see api.interfaces.slowqueries. Queries run while a streaming response is consumed are not covered.
+    With SLOW_QUERY_MS at 0 the middleware removes itself from the stack at startup.
+    """
+
+    def __init__(self, get_response):
+        if not settings.SLOW_QUERY_MS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_slow_queries(lambda: profiling.endpoint_of(request)):
+            return self.get_response(request)
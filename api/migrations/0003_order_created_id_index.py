@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_remove_customer_email_remove_customer_phone_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['date_created', 'id'], name='api_order_created_id_idx'),
+        ),
+    ]
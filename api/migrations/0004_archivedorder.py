@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-19 13:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_order_created_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('item', models.CharField(max_length=100)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(max_length=20)),
+                ('date_created', models.DateTimeField()),
+                ('date_modified', models.DateTimeField()),
+                ('date_archived', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to='api.customer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', 'date_created'], name='api_archorder_cust_created_idx'), models.Index(fields=['date_created', 'id'], name='api_archorder_created_id_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2 on 2026-10-19 13:37
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+
+def backfill_counters(apps, schema_editor):
+    """Fill the new counters from existing orders, hot and archived, in one UPDATE."""
+    Customer = apps.get_model('api', 'Customer')
+    Order = apps.get_model('api', 'Order')
+    ArchivedOrder = apps.get_model('api', 'ArchivedOrder')
+
+    def aggregate(model, expression, output_field):
+        return Coalesce(Subquery(
+            model.objects.filter(customer=OuterRef('pk')).order_by().values('customer')
+            .annotate(value=expression).values('value')[:1], output_field=output_field), Value(0, output_field))
+
+    integer, decimal = IntegerField(), DecimalField(max_digits=14, decimal_places=2)
+    last_hot = Subquery(Order.objects.filter(customer=OuterRef('pk')).order_by('-date_created').values('date_created')[:1])
+    last_archived = Subquery(
+        ArchivedOrder.objects.filter(customer=OuterRef('pk')).order_by('-date_created').values('date_created')[:1])
+    Customer.objects.update(
+        order_count=aggregate(Order, Count('id'), integer) + aggregate(ArchivedOrder, Count('id'), integer),
+        total_amount=aggregate(Order, Sum('amount'), decimal) + aggregate(ArchivedOrder, Sum('amount'), decimal),
+        pending_count=aggregate(Order, Count('id', filter=Q(status='Pending')), integer),
+        last_order_at=Greatest(Coalesce(last_hot, last_archived), Coalesce(last_archived, last_hot)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_archivedorder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='last_order_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='order_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='pending_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
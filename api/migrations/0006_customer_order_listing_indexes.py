@@ -0,0 +1,66 @@
+# Generated by Django 5.2 on 2026-10-19 13:39
+
+import logging
+
+import django.db.models.deletion
+from django.db import DatabaseError, migrations, models, transaction
+
+logger = logging.getLogger(__name__)
+
+TRIGRAM_INDEX = 'api_order_item_trgm_idx'
+
+
+def create_item_trigram_index(apps, schema_editor):
+    """
+    Back case-insensitive substring search on item with a pg_trgm GIN index on UPPER(item), the expression
+    Django's icontains lookup compares on Postgres. Other databases, or servers without pg_trgm, keep
+    plain LIKE scans within a customer's orders.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            logger.warning("pg_trgm is not available, %s was not created", TRIGRAM_INDEX)
+            return
+    try:
+        with transaction.atomic(using=connection.alias):
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON api_order USING gin (UPPER(item) gin_trgm_ops)")
+    except DatabaseError as ex:
+        logger.warning("Could not create %s: %s", TRIGRAM_INDEX, ex)
+
+
+def drop_item_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"DROP INDEX IF EXISTS {TRIGRAM_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_customer_order_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'date_created', 'id'], name='api_order_cust_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'status', 'date_created'], name='api_order_cust_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'amount', 'id'], name='api_order_cust_amount_idx'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='api.customer'),
+        ),
+        migrations.RunPython(create_item_trigram_index, drop_item_trigram_index),
+    ]
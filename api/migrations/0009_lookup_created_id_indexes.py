@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-19 13:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_ratelimitbucket'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['date_created', 'id'], name='api_customer_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['date_created', 'id'], name='api_user_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2 on 2026-10-19 14:20
+
+import logging
+
+from django.db import DatabaseError, migrations, transaction
+
+logger = logging.getLogger(__name__)
+
+# The admin's search fields, icontains compares UPPER(field) on Postgres
+TRIGRAM_INDEXES = {
+    'api_customer_name_trgm_idx': ('api_customer', 'name'),
+    'api_customer_code_trgm_idx': ('api_customer', 'code'),
+    'api_user_openid_trgm_idx': ('api_user', 'openid_user_id'),
+    'api_user_name_trgm_idx': ('api_user', 'name'),
+    'api_user_email_trgm_idx': ('api_user', 'email'),
+}
+
+
+def create_search_trigram_indexes(apps, schema_editor):
+    """
+    Back the admin changelist searches with pg_trgm GIN indexes, as 0006 does for order items.
+    Other databases, or servers without pg_trgm, keep sequential scans.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            logger.warning("pg_trgm is not available, the admin search indexes were not created")
+            return
+    for name, (table, column) in TRIGRAM_INDEXES.items():
+        try:
+            with transaction.atomic(using=connection.alias):
+                schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                schema_editor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (UPPER({column}) gin_trgm_ops)")
+        except DatabaseError as ex:
+            logger.warning("Could not create %s: %s", name, ex)
+
+
+def drop_search_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name in TRIGRAM_INDEXES:
+            schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_lookup_created_id_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_trigram_indexes, drop_search_trigram_indexes),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-19 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_admin_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderTombstone',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('customer_id', models.UUIDField()),
+                ('date_deleted', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date_deleted', 'id'], name='api_tombstone_deleted_id_idx')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['date_modified', 'id'], name='api_order_modified_id_idx'),
+        ),
+    ]
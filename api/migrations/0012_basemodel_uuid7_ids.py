@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-19 15:10
+
+import api.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_order_change_feed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='id',
+            field=models.UUIDField(default=api.ids.uuid7, editable=False, primary_key=True, serialize=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='id',
+            field=models.UUIDField(default=api.ids.uuid7, editable=False, primary_key=True, serialize=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='id',
+            field=models.UUIDField(default=api.ids.uuid7, editable=False, primary_key=True, serialize=False, unique=True),
+        ),
+    ]
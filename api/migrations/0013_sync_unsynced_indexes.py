@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_basemodel_uuid7_ids'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(condition=models.Q(('synced', False)), fields=['date_modified'], name='api_customer_unsynced_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('synced', False)), fields=['date_modified'], name='api_order_unsynced_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-19 16:40
+
+import copy
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, migrations, models
+
+
+def alter_shard_constraint(db_constraint):
+    """
+    Drop (or restore) the customer to user foreign key on the shard databases only. Users stay on the default
+    database, a customer on a shard references one that is not there. The default database keeps the constraint.
+    """
+    def alter(apps, schema_editor):
+        if schema_editor.connection.alias == DEFAULT_DB_ALIAS:
+            return
+        Customer = apps.get_model('api', 'Customer')
+        field = Customer._meta.get_field('user')
+        old_field, new_field = copy.copy(field), copy.copy(field)
+        old_field.db_constraint, new_field.db_constraint = not db_constraint, db_constraint
+        schema_editor.alter_field(Customer, old_field, new_field)
+    return alter
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_sync_unsynced_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='customer',
+                    name='user',
+                    field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='customers', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(alter_shard_constraint(False), alter_shard_constraint(True)),
+            ],
+        ),
+    ]
@@ -1,8 +1,8 @@
-import uuid
-
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.db import models
 
+from api.ids import uuid7
+
 # Create your models here.
 from django.contrib.auth.base_user import BaseUserManager
 
@@ -28,11 +28,13 @@ class BaseModel(models.Model):
     """
 	Define repetitive methods to avoid cycles of redefining in every model.
 	"""
-    id = models.UUIDField(max_length=40, default=uuid.uuid4, unique=True, editable=False, primary_key=True)
+    # Time-ordered ids, so new rows are appended to the primary key index rather than scattered over it
+    id = models.UUIDField(max_length=40, default=uuid7, unique=True, editable=False, primary_key=True)
     date_modified = models.DateTimeField(auto_now=True)
     date_created = models.DateTimeField(auto_now_add=True)
     synced = models.BooleanField(default=False)
 
+    # Rows of sync models are sent downstream by `manage.py sync_models`, see api.interfaces.syncengine
     SYNC_MODEL = False
 
     objects = models.Manager()
@@ -41,6 +43,13 @@ class BaseModel(models.Model):
         """Meta"""
         abstract = True
 
+    def save(self, *args, **kwargs):
+        if self.SYNC_MODEL:
+            self.synced = False
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'synced'}
+        super().save(*args, **kwargs)
+
 
 class GenericBaseModel(BaseModel):
     """
@@ -87,6 +96,13 @@ class User(BaseModel,AbstractBaseUser):
         # Admin users are staff
         return self.role == 'admin'
 
+    class Meta(object):
+        """Meta"""
+        indexes = [
+            # Stable, indexed order for paging through users
+            models.Index(fields=['date_created', 'id'], name='api_user_created_id_idx'),
+        ]
+
 
 
 # customers model
@@ -95,21 +111,173 @@ class Customer(GenericBaseModel):
    The Customer model represents a customer in the system.
    it inherits from GenericBaseModel to include common fields like name and description.
     """
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='customers', null=True, blank=True)
+    # Users stay on the default database when customers are sharded, so migration 0014 drops the foreign key
+    # constraint on the shards. The default database keeps it.
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='customers', null=True, blank=True, db_constraint=False)
     code= models.TextField(blank=True, null=True, unique=True)
+    # Denormalised order summary, kept in step by api.interfaces.customercounters and
+    # repaired by `manage.py reconcile_customer_counters`. Archived orders are included.
+    order_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    pending_count = models.PositiveIntegerField(default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+
+    SYNC_MODEL = True
+
     def __str__(self):
         return self.name
 
+    class Meta(object):
+        """Meta"""
+        indexes = [
+            models.Index(fields=['date_created', 'id'], name='api_customer_created_id_idx'),
+            # The sync engine's queue, only unsynced rows are indexed
+            models.Index(fields=['date_modified'], condition=models.Q(synced=False), name='api_customer_unsynced_idx'),
+        ]
+
 class Order(BaseModel):
     """
    The Order model represents an order placed by a customer.
    it inherits from BaseModel to include common fields like id, date_modified, and date_created.
     """
 
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders')
+    # Indexed through the composite (customer, ...) indexes below
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders', db_index=False)
     item = models.CharField(max_length=100)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=[('Pending', 'Pending'), ('Completed', 'Completed')])
 
+    SYNC_MODEL = True
+
+    class Meta(object):
+        """Meta"""
+        indexes = [
+            # Backs exports and checkpoints that walk orders in (date_created, id) order
+            models.Index(fields=['date_created', 'id'], name='api_order_created_id_idx'),
+            # Customer order listings: one index per filterable sort key, id completes the keyset
+            models.Index(fields=['customer', 'date_created', 'id'], name='api_order_cust_created_idx'),
+            models.Index(fields=['customer', 'status', 'date_created'], name='api_order_cust_status_idx'),
+            models.Index(fields=['customer', 'amount', 'id'], name='api_order_cust_amount_idx'),
+            # The change feed walks orders in (date_modified, id) order
+            models.Index(fields=['date_modified', 'id'], name='api_order_modified_id_idx'),
+            # The sync engine's queue, only unsynced rows are indexed
+            models.Index(fields=['date_modified'], condition=models.Q(synced=False), name='api_order_unsynced_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} - {self.customer.name}"
+
+
+class ArchivedOrder(models.Model):
+    """
+   The ArchivedOrder model is the cold copy of an Order moved out of the hot orders table by the
+   archive_orders command. It keeps the original id and timestamps, so it does not use BaseModel's defaults.
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='archived_orders', db_index=False)
+    item = models.CharField(max_length=100)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20)
+    date_created = models.DateTimeField()
+    date_modified = models.DateTimeField()
+    date_archived = models.DateTimeField(auto_now_add=True)
+
+    class Meta(object):
+        """Meta"""
+        indexes = [
+            models.Index(fields=['customer', 'date_created'], name='api_archorder_cust_created_idx'),
+            models.Index(fields=['date_created', 'id'], name='api_archorder_created_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.id}"
+
+
+class OrderTombstone(models.Model):
+    """
+   The OrderTombstone model records a deleted order, so the change feed can tell mirrors to drop it.
+   Tombstones older than ORDER_TOMBSTONE_TTL_DAYS are purged by `manage.py purge_order_tombstones`.
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    # No foreign key, the customer may be deleted along with its orders
+    customer_id = models.UUIDField()
+    date_deleted = models.DateTimeField(auto_now_add=True)
+
+    class Meta(object):
+        """Meta"""
+        indexes = [
+            models.Index(fields=['date_deleted', 'id'], name='api_tombstone_deleted_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"Deleted order {self.id}"
+
+
+class IdempotencyKey(models.Model):
+    """
+   The IdempotencyKey model records a client supplied Idempotency-Key and the response it produced,
+   so a retried request is answered from here instead of being executed again.
+    """
+    user_id = models.CharField(max_length=64)
+    key = models.CharField(max_length=255)
+    endpoint = models.CharField(max_length=100)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.BinaryField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    date_created = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta(object):
+        """Meta"""
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'endpoint', 'key'], name='api_idempotency_key_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.key}"
+
+
+class RateLimitBucket(models.Model):
+    """
+   The RateLimitBucket model is the shared token bucket state used by the rate limiting middleware when
+   RATE_LIMIT_STORAGE is 'database'. A missing row is a full bucket.
+    """
+    key = models.CharField(max_length=255, primary_key=True)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key} {self.tokens:.2f}"
+
+
+class Job(models.Model):
+    """
+   The Job model is a piece of deferred work, a function called by its dotted path with JSON arguments by the
+   `manage.py run_workers` workers, see api.interfaces.jobqueue. A job is deleted once it succeeds, one out of
+   attempts is kept as failed.
+    """
+    QUEUED = 'queued'
+    FAILED = 'failed'
+
+    func = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)
+    run_at = models.DateTimeField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField()
+    status = models.CharField(max_length=10, choices=[(QUEUED, 'Queued'), (FAILED, 'Failed')], default=QUEUED)
+    last_error = models.TextField(blank=True, default='')
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta(object):
+        """Meta"""
+        indexes = [
+            # Workers take the most urgent due job, the index only holds queued jobs
+            models.Index(fields=['-priority', 'run_at'], name='api_job_ready_idx', condition=models.Q(status='queued')),
+        ]
+
+    def __str__(self):
+        return f"{self.func} ({self.status})"
@@ -0,0 +1,124 @@
+"""
+Benchmark recent-order queries on a plain orders table against a monthly range partitioned one.
+
+Scratch tables shaped like api_order are filled with --rows synthetic orders spread over --months months, the
+same recent-order queries then run against both. Needs the Postgres database from the Django settings and
+leaves no tables behind unless --keep is passed.
+
+    python benchmarks/bench_order_partitioning.py --rows 10000000 --months 36
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "customer_app.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection
+from django.utils import timezone
+
+PLAIN, PARTITIONED = "bench_order_plain", "bench_order_parted"
+CUSTOMERS = 50000
+
+# Bounds are passed as parameters like the ORM does, so Postgres can prune partitions at plan time
+QUERIES = {
+    "customer_last_30_days": (
+        "SELECT id, item, amount, status, date_created FROM {table} "
+        "WHERE customer_id = %(customer)s AND date_created >= %(month_ago)s "
+        "ORDER BY date_created DESC LIMIT 50"
+    ),
+    "totals_last_7_days": (
+        "SELECT count(*), sum(amount) FROM {table} WHERE date_created >= %(week_ago)s"
+    ),
+}
+
+
+def params(customer):
+    now = timezone.now()
+    return {"customer": customer, "month_ago": now - timedelta(days=30), "week_ago": now - timedelta(days=7)}
+
+
+def build(cursor, rows, months):
+    columns = "id uuid NOT NULL, customer_id integer NOT NULL, item varchar(100) NOT NULL, " \
+              "amount numeric(10, 2) NOT NULL, status varchar(20) NOT NULL, date_created timestamptz NOT NULL"
+    cursor.execute(f"DROP TABLE IF EXISTS {PLAIN}, {PARTITIONED}")
+    cursor.execute(f"CREATE TABLE {PLAIN} ({columns}, PRIMARY KEY (id))")
+    cursor.execute(f"CREATE TABLE {PARTITIONED} ({columns}, PRIMARY KEY (id, date_created)) PARTITION BY RANGE (date_created)")
+    cursor.execute(
+        f"SELECT generate_series(date_trunc('month', now() - interval '{months} months'), "
+        f"date_trunc('month', now() + interval '1 month'), interval '1 month')")
+    for (start,) in cursor.fetchall():
+        cursor.execute(
+            f"CREATE TABLE {PARTITIONED}_{start:%Y%m} PARTITION OF {PARTITIONED} "
+            f"FOR VALUES FROM (%s) TO (%s::timestamptz + interval '1 month')", [start, start])
+
+    started = time.perf_counter()
+    cursor.execute(
+        f"INSERT INTO {PLAIN} SELECT md5(g::text)::uuid, g %% {CUSTOMERS}, 'Item ' || (g %% 500), (g %% 10000) / 100.0, "
+        f"CASE WHEN g %% 3 = 0 THEN 'Pending' ELSE 'Completed' END, "
+        f"now() - (%s::float8 * g / %s) * interval '1 month' FROM generate_series(1, %s) g", [months, rows, rows])
+    cursor.execute(f"INSERT INTO {PARTITIONED} SELECT * FROM {PLAIN}")
+    for table in (PLAIN, PARTITIONED):
+        cursor.execute(f"CREATE INDEX ON {table} (customer_id, date_created)")
+        cursor.execute(f"CREATE INDEX ON {table} (date_created)")
+        cursor.execute(f"VACUUM ANALYZE {table}")
+    print(f"Loaded {rows} rows over {months} months in {time.perf_counter() - started:.1f}s")
+
+
+def measure(cursor, table, sql, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cursor.execute(sql.format(table=table), params(random.randrange(1, CUSTOMERS)))
+        cursor.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def scanned_relations(cursor, table, sql):
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql.format(table=table), params(1))
+    plan = cursor.fetchone()[0]
+    plan = plan[0]["Plan"] if isinstance(plan, list) else plan
+    relations, stack = set(), [plan]
+    while stack:
+        node = stack.pop()
+        if "Relation Name" in node:
+            relations.add(node["Relation Name"])
+        stack.extend(node.get("Plans", []))
+    return len(relations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--months", type=int, default=36)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch tables for further inspection.")
+    args = parser.parse_args()
+    if connection.vendor != "postgresql":
+        parser.error("The benchmark needs a Postgres database")
+
+    with connection.cursor() as cursor:
+        build(cursor, args.rows, args.months)
+        try:
+            print(f"{'query':<24}{'table':<14}{'relations':>10}{'p50 ms':>10}{'p95 ms':>10}")
+            for name, sql in QUERIES.items():
+                for label, table in (("plain", PLAIN), ("partitioned", PARTITIONED)):
+                    p50, p95 = measure(cursor, table, sql, args.repeat)
+                    print(f"{name:<24}{label:<14}{scanned_relations(cursor, table, sql):>10}{p50:>10.2f}{p95:>10.2f}")
+        finally:
+            if not args.keep:
+                cursor.execute(f"DROP TABLE IF EXISTS {PLAIN}, {PARTITIONED}")
+
+
+if __name__ == "__main__":
+    main()
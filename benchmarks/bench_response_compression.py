@@ -0,0 +1,114 @@
+"""
+Benchmark bytes on the wire and server CPU for typical list pages, with and without compression and fields=.
+
+Pages shaped like the list endpoints' responses are built from synthetic rows, serialised the way JsonResponse
+does and passed through CompressionMiddleware for each Accept-Encoding. No database is needed.
+
+    python benchmarks/bench_response_compression.py --repeat 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "customer_app.settings")
+
+import django
+
+django.setup()
+
+from django.http import JsonResponse
+from django.test import RequestFactory
+from django.utils import timezone
+
+from api.interfaces.projection import parse_fields
+from api.interfaces.serializers import CustomerOrderSerializer, CustomerSerializer, OrderSerializer
+from api.middleware import CompressionMiddleware, brotli
+
+ITEMS = ["Mango", "Apple", "Banana", "Green mango", "Pear", "Mango juice", "Avocado", "Pineapple"]
+STATUSES = ["Pending", "Confirmed", "Completed"]
+
+
+def order_row(customer_id):
+    return {
+        "id": uuid.uuid4(),
+        "customer__id": customer_id,
+        "item": random.choice(ITEMS),
+        "amount": Decimal(random.randrange(100, 100000)) / 100,
+        "status": random.choice(STATUSES),
+        "date_created": timezone.now() - timedelta(minutes=random.randrange(500000)),
+    }
+
+
+def customer_row():
+    code = uuid.uuid4().hex[:8].upper()
+    return {
+        "id": uuid.uuid4(),
+        "user__email": f"{code.lower()}@example.com",
+        "user__name": f"Customer {code}",
+        "user__phone_number": f"+2547{random.randrange(10 ** 8):08d}",
+        "code": code,
+        "order_count": random.randrange(500),
+        "total_amount": Decimal(random.randrange(10 ** 7)) / 100,
+        "pending_count": random.randrange(10),
+        "last_order_at": timezone.now(),
+    }
+
+
+def page(key, rows, serializer_class, fields):
+    serializer = serializer_class(parse_fields(fields, serializer_class.FIELDS))
+    return {key: serializer.serialize([[row[column] for column in serializer.columns] for row in rows])}
+
+
+def pages():
+    customer_id = uuid.uuid4()
+    orders = [order_row(customer_id) for _ in range(200)]
+    customers = [customer_row() for _ in range(50)]
+    return {
+        "customer orders, 50": page("orders", orders[:50], CustomerOrderSerializer, None),
+        "customer orders, 50, fields=id,status": page("orders", orders[:50], CustomerOrderSerializer, "id,status"),
+        "all orders, 200": page("orders", orders, OrderSerializer, None),
+        "all orders, 200, fields=id,amount": page("orders", orders, OrderSerializer, "id,amount"),
+        "customers, 50": page("customers", customers, CustomerSerializer, None),
+        "customers, 50, fields=code,name": page("customers", customers, CustomerSerializer, "code,name"),
+    }
+
+
+def measure(payload, accept_encoding, repeat):
+    """
+    @return: The bytes sent and the median CPU microseconds to serialise and compress one response.
+    """
+    request = RequestFactory().get("/api/orders/", HTTP_ACCEPT_ENCODING=accept_encoding)
+    timings = []
+    for _ in range(repeat):
+        started = time.process_time()
+        response = CompressionMiddleware(lambda request: JsonResponse(payload))(request)
+        timings.append((time.process_time() - started) * 1e6)
+    timings.sort()
+    return len(response.content), timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    encodings = ["identity", "gzip"] + (["br"] if brotli else [])
+    if not brotli:
+        print("brotli is not installed, only gzip is measured")
+    print(f"{'page':<40}{'encoding':<10}{'bytes':>10}{'ratio':>8}{'cpu us':>10}")
+    for name, payload in pages().items():
+        identity = None
+        for encoding in encodings:
+            size, cpu = measure(payload, encoding, args.repeat)
+            identity = identity or size
+            print(f"{name:<40}{encoding:<10}{size:>10}{identity / size:>8.1f}{cpu:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark building order list responses from model instances, values() dicts and Serializer rows.
+
+A scratch customer with --rows orders is inserted in a transaction that is rolled back at the end, pages of
+--page-size orders are then turned into a JsonResponse each way. Time is the median wall time per page and
+memory the peak traced allocation while building one. Needs the database from the Django settings.
+
+    python benchmarks/bench_serializers.py --rows 5000 --page-size 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "customer_app.settings")
+
+import django
+
+django.setup()
+
+from django.db import transaction
+from django.http import JsonResponse
+
+from api.interfaces.serializers import OrderSerializer
+from api.models import Customer, Order, User
+
+
+def from_instances(orders):
+    """The per-instance dicts handlers built before the serializer layer."""
+    return JsonResponse({"orders": [
+        {
+            "id": str(order.id),
+            "customer__id": str(order.customer_id),
+            "item": order.item,
+            "amount": order.amount,
+            "status": order.status,
+            "date_created": order.date_created,
+        }
+        for order in orders]})
+
+
+def from_values(orders):
+    return JsonResponse({"orders": list(orders.values(*OrderSerializer.FIELDS))})
+
+
+def from_serializer(orders):
+    serializer = OrderSerializer()
+    return JsonResponse({"orders": serializer.serialize(serializer.rows(orders))})
+
+
+def measure(build, queryset, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        build(queryset.all())
+        timings.append((time.perf_counter() - started) * 1000)
+    tracemalloc.start()
+    response = build(queryset.all())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(timings), peak, response.content
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with transaction.atomic():
+        suffix = uuid.uuid4().hex[:8]
+        user = User.objects.create(
+            name="Bench", email=f"bench-{suffix}@example.com", openid_user_id=f"bench|{suffix}")
+        customer = Customer.objects.create(name="Bench", user=user, code=suffix.upper())
+        Order.objects.bulk_create(
+            [Order(customer=customer, item=f"Item {i % 50}", amount=i % 1000 + 0.5, status="Pending")
+             for i in range(args.rows)], batch_size=5000)
+        page = Order.objects.filter(customer=customer).order_by("-date_created", "-id")[:args.page_size]
+
+        print(f"{'path':<14}{'ms/page':>10}{'peak KiB':>10}")
+        bodies = set()
+        for name, build in (("instances", from_instances), ("values", from_values), ("serializer", from_serializer)):
+            ms, peak, body = measure(build, page, args.repeat)
+            bodies.add(body)
+            print(f"{name:<14}{ms:>10.2f}{peak / 1024:>10.0f}")
+        if len(bodies) != 1:
+            print("Warning: the paths produced different responses")
+        transaction.set_rollback(True)
+
+
+if __name__ == "__main__":
+    main()
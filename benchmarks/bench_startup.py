@@ -0,0 +1,82 @@
+"""
+Benchmark cold start of a web worker and of a management command against a time budget.
+
+Each scenario runs in fresh interpreters: the median wall time of --repeat runs is compared with its budget,
+and one run under `python -X importtime` lists the slowest imports (cumulative, including their own imports).
+Exits with status 1 when a scenario is over budget so it can guard CI.
+
+    python benchmarks/bench_startup.py --repeat 5 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What a worker does before serving its first request: load the WSGI application and the URLconf
+WORKER_BOOT = (
+    "import os; os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'customer_app.settings'); "
+    "from customer_app.wsgi import application; "
+    "from django.urls import get_resolver; get_resolver().url_patterns"
+)
+
+SCENARIOS = {
+    "worker boot": ([sys.executable, "-c", WORKER_BOOT], "worker_budget"),
+    "manage.py command": ([sys.executable, "manage.py", "purge_idempotency_keys", "--help"], "command_budget"),
+}
+
+
+def run(command, importtime=False):
+    if importtime:
+        command = [command[0], "-X", "importtime", *command[1:]]
+    started = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - started) * 1000
+    if result.returncode:
+        sys.exit(f"{' '.join(command)} failed:\n{result.stderr}")
+    return elapsed, result.stderr
+
+
+def slowest_imports(stderr, top):
+    """
+    Parse `-X importtime` output into the top (cumulative ms, module) pairs, project modules and
+    top level packages only so nested imports are not counted twice.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if depth == 0 or name.split(".")[0] in ("api", "customer_app"):
+            imports.append((int(cumulative) / 1000, name))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list per scenario.")
+    parser.add_argument("--worker-budget", type=float, default=600, help="Worker boot budget in ms.")
+    parser.add_argument("--command-budget", type=float, default=600, help="Management command start budget in ms.")
+    args = parser.parse_args()
+
+    over_budget = False
+    for name, (command, budget_option) in SCENARIOS.items():
+        budget = getattr(args, budget_option)
+        timings = [run(command)[0] for _ in range(args.repeat)]
+        median = statistics.median(timings)
+        verdict = "ok" if median <= budget else "OVER BUDGET"
+        over_budget |= median > budget
+        print(f"{name}: {median:.0f} ms median of {args.repeat} (min {min(timings):.0f}), budget {budget:.0f} ms, {verdict}")
+        for cumulative, module in slowest_imports(run(command, importtime=True)[1], args.top):
+            print(f"    {cumulative:>8.1f} ms  {module}")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
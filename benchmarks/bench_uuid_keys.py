@@ -0,0 +1,97 @@
+"""
+Benchmark inserts keyed by random uuid4 ids against time-ordered uuid7 ids (api.ids.uuid7).
+
+Two scratch tables shaped like api_order get --rows rows each, COPYed in batches of --batch with ids from either
+generator. For each it prints the insert throughput over all rows and over the last tenth, when the primary key
+index is largest, the WAL written per row, the primary key index size and how many index blocks had to be read
+from outside shared buffers. Needs the Postgres database from the Django settings and leaves no tables behind
+unless --keep is passed.
+
+    python benchmarks/bench_uuid_keys.py --rows 10000000 --batch 50000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "customer_app.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection
+
+from api.ids import uuid7
+
+GENERATORS = {"uuid4": uuid.uuid4, "uuid7": uuid7}
+
+
+def batch_file(generate, start, size):
+    rows = io.StringIO()
+    for number in range(start, start + size):
+        rows.write(f"{generate()}\t{number % 50000}\t{number % 10000 / 100:.2f}\tPending\n")
+    rows.seek(0)
+    return rows
+
+
+def wal_position(cursor):
+    cursor.execute("SELECT pg_current_wal_lsn()")
+    return cursor.fetchone()[0]
+
+
+def load(cursor, name, generate, rows, batch):
+    table = f"bench_keys_{name}"
+    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute(
+        f"CREATE TABLE {table} (id uuid PRIMARY KEY, customer_id integer NOT NULL, amount numeric(10, 2) NOT NULL, "
+        f"status varchar(20) NOT NULL, date_created timestamptz NOT NULL DEFAULT now())")
+    wal_start = wal_position(cursor)
+    elapsed = tail_elapsed = 0.0
+    tail_from = rows - rows // 10
+    for start in range(0, rows, batch):
+        size = min(batch, rows - start)
+        data = batch_file(generate, start, size)
+        started = time.perf_counter()
+        cursor.copy_expert(f"COPY {table} (id, customer_id, amount, status) FROM STDIN", data)
+        took = time.perf_counter() - started
+        elapsed += took
+        if start >= tail_from:
+            tail_elapsed += took
+    cursor.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s)", [wal_start])
+    wal_bytes = cursor.fetchone()[0]
+    cursor.execute(
+        "SELECT pg_relation_size(indexrelid), idx_blks_read FROM pg_statio_user_indexes WHERE indexrelname = %s",
+        [f"{table}_pkey"])
+    index_size, blocks_read = cursor.fetchone()
+    tail_rows = rows - (tail_from // batch) * batch
+    print(f"{name:<8}{rows / elapsed:>12.0f}{tail_rows / tail_elapsed:>14.0f}{wal_bytes / rows:>12.0f}"
+          f"{index_size / 2 ** 20:>14.0f}{blocks_read:>14}")
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--batch", type=int, default=50_000)
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch tables for further inspection.")
+    args = parser.parse_args()
+    if connection.vendor != "postgresql":
+        parser.error("The benchmark needs a Postgres database")
+
+    tables = []
+    with connection.cursor() as cursor:
+        try:
+            print(f"{'ids':<8}{'rows/s':>12}{'last 10% /s':>14}{'WAL B/row':>12}{'pkey MiB':>14}{'pkey reads':>14}")
+            for name, generate in GENERATORS.items():
+                tables.append(load(cursor, name, generate, args.rows, args.batch))
+        finally:
+            if not args.keep and tables:
+                cursor.execute(f"DROP TABLE IF EXISTS {', '.join(tables)}")
+
+
+if __name__ == "__main__":
+    main()
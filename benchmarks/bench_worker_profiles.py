@@ -0,0 +1,158 @@
+"""
+Benchmark the gunicorn.conf.py worker profiles on a stubbed handler.
+
+Each profile serves the stub application below through the repo's gunicorn.conf.py: a request burns --cpu-ms of
+CPU and then waits --io-ms, standing in for the Postgres, Auth0 and Africa's Talking round trips of the real
+handlers. --concurrency clients send --requests requests over keep-alive connections, the throughput, latency
+percentiles and the workers' resident memory are printed per profile. Profiles whose worker package is not
+installed are skipped.
+
+    python benchmarks/bench_worker_profiles.py --workers 2 --concurrency 64 --io-ms 50
+"""
+import argparse
+import asyncio
+import http.client
+import importlib.util
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BODY = b'{"orders": []}'
+PROFILE_PACKAGES = {"sync": (), "gthread": (), "gevent": ("gevent", "psycogreen"), "uvicorn": ("uvicorn",)}
+
+
+def handle():
+    cpu_ms = float(os.environ.get("BENCH_CPU_MS", 2))
+    io_ms = float(os.environ.get("BENCH_IO_MS", 50))
+    deadline = time.thread_time() + cpu_ms / 1000
+    while time.thread_time() < deadline:
+        pass
+    time.sleep(io_ms / 1000)
+
+
+def application(environ, start_response):
+    handle()
+    start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(BODY)))])
+    return [BODY]
+
+
+async def asgi_application(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    # Django runs sync views in a thread under ASGI, so does the stub
+    await asyncio.to_thread(handle)
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": BODY})
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(port, server, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"gunicorn exited:\n{server.stderr.read().decode()}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    sys.exit("gunicorn did not start listening")
+
+
+def worker_rss_mb(master_pid):
+    """Resident memory of the master's children in MiB, pages shared copy-on-write are counted in each"""
+    total = 0
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as children:
+        for pid in children.read().split():
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+    return total / 1024
+
+
+def client(port, count):
+    latencies, errors = [], 0
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    for _ in range(count):
+        started = time.perf_counter()
+        try:
+            connection.request("GET", "/api/orders/")
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        latencies.append((time.perf_counter() - started) * 1000)
+    connection.close()
+    return latencies, errors
+
+
+def run_profile(profile, args):
+    port = free_port()
+    app = "bench_worker_profiles:asgi_application" if profile == "uvicorn" else "bench_worker_profiles:application"
+    env = {
+        **os.environ,
+        "GUNICORN_PROFILE": profile,
+        "GUNICORN_BIND": f"127.0.0.1:{port}",
+        "GUNICORN_WORKERS": str(args.workers),
+        "BENCH_CPU_MS": str(args.cpu_ms),
+        "BENCH_IO_MS": str(args.io_ms),
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+         "--chdir", os.path.join(ROOT, "benchmarks"), "--max-requests", "0", app],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        wait_until_up(port, server)
+        per_client = max(1, args.requests // args.concurrency)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            results = list(pool.map(client, [port] * args.concurrency, [per_client] * args.concurrency))
+        elapsed = time.perf_counter() - started
+        rss = worker_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{profile:8} {len(latencies) / elapsed:8.0f} req/s  p50 {statistics.median(latencies):7.1f} ms  "
+          f"p99 {p99:7.1f} ms  errors {errors}  workers RSS {rss:.0f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--profiles", default=",".join(PROFILE_PACKAGES), help="Comma separated profiles to run.")
+    parser.add_argument("--workers", type=int, default=2, help="Workers per profile, the same for all to compare.")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--cpu-ms", type=float, default=2)
+    parser.add_argument("--io-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    for profile in args.profiles.split(","):
+        missing = [package for package in PROFILE_PACKAGES[profile] if importlib.util.find_spec(package) is None]
+        if missing:
+            print(f"{profile:8} skipped, {', '.join(missing)} not installed")
+            continue
+        run_profile(profile, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@
 ASGI config for customer_app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Besides the regular views it serves the order status event streams (api.interfaces.orderevents), which need
+an ASGI server, e.g. `GUNICORN_PROFILE=uvicorn gunicorn -c gunicorn.conf.py`, which picks this application.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
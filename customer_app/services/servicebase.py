@@ -51,8 +51,10 @@ class ServiceBase(object):
 		try:
 			if self.manager is not None:
 				return self.manager.get(*args, **kwargs)
+		except self.manager.model.DoesNotExist:
+			pass
 		except Exception as e:
-			pass  # lgr.exception('%sService get exception: %s' % (self.manager.model.__name__, e))
+			lgr.exception('%sService get exception: %s' % (self.manager.model.__name__, e))
 		return None
 
 	def filter(self, *args, **kwargs):
@@ -69,7 +71,7 @@ class ServiceBase(object):
 		except self.manager.model.DoesNotExist:
 			pass
 		except Exception as e:
-			pass  # lgr.exception('%sService filter exception: %s' % (self.manager.model.__name__, e))
+			lgr.exception('%sService filter exception: %s' % (self.manager.model.__name__, e))
 		return None
 
 	def create(self, **kwargs):
@@ -45,6 +45,11 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
+    'api.middleware.LoadSheddingMiddleware',
+    'api.middleware.SlowQueryMiddleware',
+    'api.middleware.RateLimitMiddleware',
+    'api.middleware.ReplicaPinningMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilingMiddleware',
 
 ]
 
@@ -93,8 +99,34 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': '5432',
+        # Seconds a worker thread keeps its connection between requests, keep 0 for the gevent worker profile
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
+
+# Read replicas, one alias per host in DB_REPLICA_HOSTS (comma separated), sharing the primary's credentials.
+# Read-only handlers read from them through api.dbrouter.ReplicaRouter. Leave it unset for the test suite,
+# replicas mirror the test database there but cannot see data of a TestCase's open transaction.
+REPLICA_DATABASES = []
+for number, replica_host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica_{number}'] = {**DATABASES['default'], 'HOST': replica_host.strip(), 'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES.append(f'replica_{number}')
+
+# Customer sharding, opt-in. DB_SHARDS (comma separated) adds the databases shard_1, shard_2... each a Postgres
+# host sharing the primary's credentials or, for local testing, the path of an .sqlite3 file. ORDER_SHARDS lists
+# the aliases customers and their orders are spread over by a hash of the customer code, e.g. default,shard_1.
+# Only append to it and move customers with `manage.py rebalance_shards` when it changes.
+for number, shard in enumerate(filter(None, os.getenv('DB_SHARDS', '').split(',')), 1):
+    shard = shard.strip()
+    if shard.endswith('.sqlite3'):
+        DATABASES[f'shard_{number}'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': shard}
+    else:
+        DATABASES[f'shard_{number}'] = {
+            **DATABASES['default'], 'HOST': shard, 'TEST': {'NAME': f"test_{DATABASES['default']['NAME']}_shard_{number}"}}
+ORDER_SHARDS = [alias.strip() for alias in os.getenv('ORDER_SHARDS', '').split(',') if alias.strip()]
+DATABASE_ROUTERS = ['api.dbrouter.ShardRouter', 'api.dbrouter.ReplicaRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -148,6 +180,8 @@ AUTH0_M2M_CLIENT_ID = os.environ.get('AUTH0_M2M_CLIENT_ID')
 AUTH0_M2M_CLIENT_SECRET = os.environ.get('AUTH0_M2M_CLIENT_SECRET')
 AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN')
 AUTH0_AUDIENCE = os.environ.get('AUTH0_AUDIENCE')
+# Base URL of the Auth0 Management API when it is not https://AUTH0_DOMAIN, e.g. a custom domain or a local fake
+AUTH0_MANAGEMENT_URL = os.environ.get('AUTH0_MANAGEMENT_URL')
 ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY')
 AUTH0_API_URL = os.environ.get('AUTH0_API_URL')
 AUTH0_CLIENT_ID = os.environ.get('AUTH0_CLIENT_ID')
@@ -161,4 +195,95 @@ JWT_ALGORITHM = 'HS256'
 JWT_TOKEN_EXPIRATION =  30 * 24 * 60
 JWT_AUDIENCE =  'your-app-name'
 JWT_ISSUER =  'your-api-domain'
-JWT_LEEWAY = 60
\ No newline at end of file
+JWT_LEEWAY = 60
+
+# Days of orders the all orders listing returns when no date_from is given. The bound lets Postgres prune the older
+# partitions of a partitioned orders table.
+ORDER_LISTING_DAYS = int(os.environ.get('ORDER_LISTING_DAYS', 90))
+
+# Completed orders untouched for this many days are moved to the archive table by `manage.py archive_orders run`
+ORDER_ARCHIVE_AFTER_DAYS = int(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', 180))
+ORDER_ARCHIVE_STATUSES = ('Completed', 'Confirmed')
+
+# Order change feed: tombstones of deleted orders are kept this long, older cursors must resync from scratch.
+# Changes younger than the settle delay are held back until transactions writing them have committed.
+ORDER_TOMBSTONE_TTL_DAYS = int(os.environ.get('ORDER_TOMBSTONE_TTL_DAYS', 30))
+ORDER_CHANGES_SETTLE_SECONDS = 5
+
+# Order status event streams (Server-Sent Events, ASGI only): streams one worker serves at most, seconds between
+# heartbeats on an idle stream and the reconnect delay suggested to clients
+ORDER_EVENTS_MAX_STREAMS = int(os.environ.get('ORDER_EVENTS_MAX_STREAMS', 1000))
+ORDER_EVENTS_HEARTBEAT_SECONDS = 15
+ORDER_EVENTS_RETRY_MS = 3000
+
+# Sync engine (`manage.py sync_models`): rows of SYNC_MODEL models are sent to SYNC_SINK, a name in
+# api.interfaces.syncengine.SINKS or a dotted class path, created with SYNC_SINK_OPTIONS
+SYNC_SINK = os.environ.get('SYNC_SINK', 'ndjson')
+SYNC_SINK_OPTIONS = {'directory': os.environ.get('SYNC_NDJSON_DIR', os.path.join(BASE_DIR, 'sync'))}
+SYNC_BATCH_SIZE = 1000
+SYNC_POLL_SECONDS = 5
+
+# Background jobs (`manage.py run_workers`): runs before a job is kept as failed, the delay before the first
+# retry, doubled for each further one, and how often idle workers look for due jobs
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_SECONDS = 30
+JOB_POLL_SECONDS = 1
+
+# Idempotency-Key replays are kept this long. A claim older than the lease is taken over, on Postgres only once
+# the request that made it no longer holds its advisory lock.
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+IDEMPOTENCY_LEASE_SECONDS = 30
+IDEMPOTENCY_WAIT_SECONDS = 10
+
+# Per client rate limits: (path prefix, requests, period in seconds), the first matching prefix applies.
+# Buckets live in the worker ('memory'), in Postgres ('database') or in the Django cache ('cache').
+RATE_LIMIT_STORAGE = os.environ.get('RATE_LIMIT_STORAGE', 'memory')
+RATE_LIMIT_RULES = [
+    ('/api/orders/export/', 10, 60),
+    ('/api/orders/create/', 120, 60),
+    ('/api/', 600, 60),
+]
+RATE_LIMIT_TRUST_X_FORWARDED_FOR = os.environ.get('RATE_LIMIT_TRUST_X_FORWARDED_FOR', 'false').lower() == 'true'
+
+# Requests under this prefix get a 503 once a worker runs this many requests at once or requests queue
+# for longer than this on average (needs the proxy to set X-Request-Start), 0 disables a check
+LOAD_SHED_PATH_PREFIX = '/api/'
+LOAD_SHED_MAX_IN_FLIGHT = int(os.environ.get('LOAD_SHED_MAX_IN_FLIGHT', 0))
+LOAD_SHED_MAX_QUEUE_MS = int(os.environ.get('LOAD_SHED_MAX_QUEUE_MS', 2000))
+
+# API responses at least this large are compressed with brotli (if installed) or gzip, as the client accepts.
+# Levels favour CPU over the last few percent of size since every response is compressed on the fly.
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+
+# Replica selection is 'round_robin' or 'least_latency'. A replica lagging more than REPLICA_MAX_LAG_SECONDS
+# is skipped, and users read from the primary for REPLICA_STICKY_SECONDS after writing.
+REPLICA_SELECTION = os.environ.get('REPLICA_SELECTION', 'round_robin')
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+REPLICA_CHECK_INTERVAL = 10
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+
+# Queries of a request slower than SLOW_QUERY_MS (0 disables) are appended to SLOW_QUERY_LOG with their plan: the
+# first of each query per worker and this share of the rest. Plain reads are run again under EXPLAIN (ANALYZE,
+# BUFFERS), which doubles their time, other statements are only planned.
+# `manage.py slow_queries` reports on the log.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', os.path.join(BASE_DIR, 'slow_queries.ndjson'))
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_RATE', 0.05))
+
+# On-demand profiling of API requests (`manage.py profile_requests`), off unless PROFILING_ENABLED is set.
+# Requests with a signed X-Profile header and a PROFILING_SAMPLE_RATE share of the others are profiled in
+# PROFILING_SAMPLE_MODE ('cpu', 'sample' or 'memory') and the profiles are stored in PROFILING_DIR
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_DIR = os.environ.get('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILING_PATH_PREFIX = '/api/'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_SAMPLE_MODE = os.environ.get('PROFILING_SAMPLE_MODE', 'sample')
+PROFILING_TRIGGER_MAX_AGE = 60 * 60
+PROFILING_SAMPLE_INTERVAL_MS = 5
+PROFILING_TRACEMALLOC_FRAMES = 1
+PROFILING_TOP_ALLOCATIONS = 50
+
+# Authenticated users are cached per worker for this long, saving a User drops its entry
+PRINCIPAL_CACHE_TTL = int(os.environ.get('PRINCIPAL_CACHE_TTL', 60))
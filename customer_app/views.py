@@ -1,35 +1,45 @@
 import json
-from authlib.integrations.django_client import OAuth
+from functools import lru_cache
 from customer_app import settings
 from django.http import HttpResponse
 from django.shortcuts import redirect, render
 from django.template import loader
 from django.urls import reverse
 from urllib.parse import quote_plus, urlencode
+from django.db import IntegrityError
+from api.interfaces.principal import principals
 from api.models import User
 import logging
 
 logger = logging.getLogger(__name__)
 
-oauth = OAuth()
 
-oauth.register(
-    "auth0",
-    client_id=settings.AUTH0_FRONTEND_CLIENT_ID,
-    client_secret=settings.AUTH0_FRONTEND_CLIENT_SECRET,
-    client_kwargs={
-        "scope": "openid profile email",
-    },
-    server_metadata_url=f"https://{settings.AUTH0_DOMAIN}/.well-known/openid-configuration",
-)
+@lru_cache(maxsize=None)
+def get_oauth():
+    """
+    The Auth0 OAuth client, registered on the first login or callback rather than when the URLconf is loaded.
+    """
+    from authlib.integrations.django_client import OAuth
+
+    oauth = OAuth()
+    oauth.register(
+        "auth0",
+        client_id=settings.AUTH0_FRONTEND_CLIENT_ID,
+        client_secret=settings.AUTH0_FRONTEND_CLIENT_SECRET,
+        client_kwargs={
+            "scope": "openid profile email",
+        },
+        server_metadata_url=f"https://{settings.AUTH0_DOMAIN}/.well-known/openid-configuration",
+    )
+    return oauth
 
 def login(request):
-    return oauth.auth0.authorize_redirect(
+    return get_oauth().auth0.authorize_redirect(
         request, request.build_absolute_uri(reverse("callback"))
     )
 
 def callback(request):
-    token = oauth.auth0.authorize_access_token(request)
+    token = get_oauth().auth0.authorize_access_token(request)
     logger.info("Access token retrieved successfully.")
     request.session["user"] = token
 
@@ -40,16 +50,15 @@ def callback(request):
     name = user_data.get("name", "")
     role = "user"
 
-    if not User.objects.filter(email=email).exists():
-        User.objects.create(
-            openid_user_id=user_id,
-            email=email,
-            name=name,
-            role=role,
-        )
-        logger.info(f"New user created: {email}")
-    else:
-        logger.info(f"User already exists in the database: {email}")
+    # One INSERT ... ON CONFLICT: new users are created, returning ones get their email and name refreshed
+    try:
+        user, = User.objects.bulk_create(
+            [User(openid_user_id=user_id, email=email, name=name, role=role)],
+            update_conflicts=True, unique_fields=["openid_user_id"], update_fields=["email", "name", "date_modified"])
+        principals.invalidate(user)
+        logger.info(f"User saved: {email}")
+    except IntegrityError:
+        logger.warning(f"Email {email} already belongs to another user, {user_id} was not saved")
 
     return redirect(request.build_absolute_uri(reverse("index")))
 def logout(request):
@@ -0,0 +1,114 @@
+"""
+Gunicorn settings, picked up from the working directory by `gunicorn -c gunicorn.conf.py`.
+
+GUNICORN_PROFILE selects the worker model, each sized from the CPUs the container may use:
+    sync     2 * CPUs + 1 single threaded workers, one request at a time each
+    gthread  CPUs + 1 workers with GUNICORN_THREADS (4) threads each, the default. The handlers mostly wait
+             on Postgres, Auth0 and Africa's Talking, threads keep the CPU busy meanwhile
+    gevent   CPUs + 1 workers with GUNICORN_WORKER_CONNECTIONS (100) greenlets each, needs `gevent` and
+             `psycogreen` installed and DB_CONN_MAX_AGE=0
+    uvicorn  CPUs + 1 workers serving customer_app.asgi, needs `uvicorn` installed
+The profile also picks the application, customer_app.wsgi or customer_app.asgi, so leave it off the command line:
+an application given there replaces it. The uvicorn profile refuses to boot on a WSGI application.
+GUNICORN_WORKERS and GUNICORN_THREADS override the sizing, any setting can still be given on the command line.
+"""
+import inspect
+import os
+import sys
+
+WSGI_APP = "customer_app.wsgi:application"
+ASGI_APP = "customer_app.asgi:application"
+PROFILES = {
+    "sync": {"worker_class": "sync", "workers_per_cpu": 2, "threads": 1, "app": WSGI_APP},
+    "gthread": {"worker_class": "gthread", "workers_per_cpu": 1, "threads": 4, "app": WSGI_APP},
+    "gevent": {"worker_class": "gevent", "workers_per_cpu": 1, "threads": 1, "app": WSGI_APP},
+    "uvicorn": {"worker_class": "uvicorn.workers.UvicornWorker", "workers_per_cpu": 1, "threads": 1,
+                "app": ASGI_APP},
+}
+
+profile_name = os.environ.get("GUNICORN_PROFILE", "gthread")
+if profile_name not in PROFILES:
+    raise RuntimeError(f"GUNICORN_PROFILE must be one of {', '.join(PROFILES)}, not {profile_name!r}")
+profile = PROFILES[profile_name]
+
+if profile_name == "gevent":
+    # Patch before the application is preloaded, so that Django and psycopg2 are imported cooperative
+    from gevent import monkey
+
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+
+    patch_psycopg()
+
+
+def cpu_count():
+    """CPUs this process may run on, which honours the container's cpuset unlike os.cpu_count()"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = profile["worker_class"]
+workers = int(os.environ.get("GUNICORN_WORKERS", profile["workers_per_cpu"] * cpu_count() + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", profile["threads"]))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 100))
+wsgi_app = profile["app"]
+
+# Import the application once in the master, workers share its pages copy-on-write and boot faster
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# Recycle workers after a while to bound slow leaks, the jitter keeps them from restarting together
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+# Order exports stream for a while, other requests should finish well within this
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+
+def pre_fork(server, worker):
+    """
+    Close the database connections the master opened while preloading, in the master, so no worker inherits
+    a socket that another process also uses.
+    """
+    if "django.db" in sys.modules:
+        from django.db import connections
+
+        connections.close_all()
+
+
+def post_fork(server, worker):
+    """
+    Start each worker with its own HTTP clients and replica health state, modules the application has not
+    imported are left alone.
+    """
+    if "api.dbrouter" in sys.modules:
+        from api.dbrouter import selector
+
+        selector.state.clear()
+    if "api.interfaces.smsnotify" in sys.modules:
+        from api.interfaces.smsnotify import sms_client
+
+        sms_client.cache_clear()
+    if "customer_app.views" in sys.modules:
+        from customer_app.views import get_oauth
+
+        get_oauth.cache_clear()
+    server.log.info("Worker %s forked (%s profile)", worker.pid, profile_name)
+
+
+def post_worker_init(worker):
+    """
+    Stop the uvicorn profile from booting on a WSGI application, e.g. customer_app.wsgi given on the command
+    line, which UvicornWorker would call as ASGI and fail every request with. A worker failing to boot halts
+    gunicorn.
+    """
+    if profile["app"] != ASGI_APP:
+        return
+    app = worker.wsgi
+    if not (inspect.iscoroutinefunction(app) or inspect.iscoroutinefunction(getattr(app, "__call__", None))):
+        raise RuntimeError(f"The {profile_name} profile serves ASGI applications only, not the WSGI application "
+                           f"{worker.app.app_uri}. Start gunicorn without an application to serve {ASGI_APP}.")
@@ -1,10 +1,47 @@
+import csv
+import gzip
 import json
-from django.test import TestCase, Client
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from decimal import Decimal
+from io import StringIO
+from urllib.parse import parse_qs, urlparse
+from unittest import skipUnless
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse, JsonResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.urls import reverse
 from unittest.mock import patch, MagicMock
 import uuid
-from api.models import User, Customer
-from api.interfaces.jwttokens import TokenExpiredError, InvalidTokenError, BlacklistedTokenError
+from api import dbrouter
+from api.admin import DateHierarchyQuerySet, EstimatedCountPaginator
+from api.ids import UUID7Generator, uuid7
+from api.middleware import CompressionMiddleware, DatabaseStorage, LoadSheddingMiddleware, brotli
+from api.models import User, Customer, Order, ArchivedOrder, IdempotencyKey, Job, OrderTombstone, RateLimitBucket
+from api.interfaces import auth0users
+from api.interfaces.decorator import auth_required
+from api.interfaces.handleorders import send_order_sms
+from api.interfaces.jobqueue import enqueue, queue_stats, retry_failed, run_next
+from api.interfaces.jwttokens import login_required
+from api.interfaces.orderevents import event_id, hub
+from api.interfaces.orderfilters import encode_cursor
+from api.interfaces.profiling import load_index, sign_trigger
+from api.interfaces.principal import get_principal, principals
+from api.interfaces.serializers import CustomerSerializer, OrderSerializer
+from api.interfaces.slowqueries import fingerprint, load_log, normalize, plan_hints, read_only, record_slow_queries
+from api.interfaces.jwttokens import TokenExpiredError, InvalidTokenError, BlacklistedTokenError, generate_token, \
+    jwt_settings
+from api.interfaces.smsnotify import SendSms
+from api.interfaces.syncengine import sync_batch, sync_lag
 
 
 class CustomerManagerTests(TestCase):
@@ -208,4 +245,1704 @@ class CustomerManagerTests(TestCase):
             'username': self.user.name,
             'email': self.user.email,
             'is_staff': False
-        }
\ No newline at end of file
+        }
+
+class ImportCustomersCommandTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Import User',
+            email='import@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000001',
+        )
+        self.user_no_phone = User.objects.create(
+            name='No Phone User',
+            email='nophone@example.com',
+            openid_user_id=str(uuid.uuid4()),
+        )
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _write(self, filename, content):
+        path = os.path.join(self.tmpdir, filename)
+        with open(path, 'w') as handle:
+            handle.write(content)
+        return path
+
+    def _read_rejects(self, path):
+        with open(path + '.rejects.ndjson') as handle:
+            return [json.loads(line) for line in handle]
+
+    def test_import_csv_with_copy(self):
+        """Test CSV rows are imported and invalid rows are rejected"""
+        path = self._write('customers.csv', (
+            'name,user_id,email,description\n'
+            f'Alpha,{self.user.id},,first\n'
+            'Beta,,import@example.com,\n'
+            f'Gamma,{self.user_no_phone.id},,\n'
+            f',{self.user.id},,\n'
+            'Delta,not-a-uuid,,\n'
+        ))
+        out = StringIO()
+        call_command('import_customers', path, '--batch-size', '2', stdout=out)
+
+        self.assertEqual(
+            set(Customer.objects.filter(user=self.user).values_list('name', flat=True)), {'Alpha', 'Beta'})
+        self.assertEqual(Customer.objects.get(name='Alpha').description, 'first')
+        self.assertIsNone(Customer.objects.get(name='Beta').description)
+        codes = list(Customer.objects.values_list('code', flat=True))
+        self.assertEqual(len(set(codes)), 2)
+        self.assertTrue(all(len(code) == 8 for code in codes))
+        self.assertIn('5 rows processed, 2 imported, 3 rejected', out.getvalue())
+
+        rejects = {reject['line']: reject['error'] for reject in self._read_rejects(path)}
+        self.assertEqual(sorted(rejects), [4, 5, 6])
+        self.assertEqual(rejects[5], 'Name is required')
+        self.assertEqual(rejects[6], 'User ID is not a valid UUID')
+
+    def test_import_ndjson_with_bulk_create(self):
+        """Test NDJSON rows are imported through bulk_create"""
+        path = self._write('customers.ndjson', (
+            json.dumps({'name': 'One', 'user_id': str(self.user.id)}) + '\n'
+            + '{broken\n'
+            + json.dumps({'name': 'Two', 'email': 'missing@example.com'}) + '\n'
+        ))
+        call_command('import_customers', path, '--method', 'bulk', stdout=StringIO())
+
+        self.assertEqual(list(Customer.objects.values_list('name', flat=True)), ['One'])
+        rejects = self._read_rejects(path)
+        self.assertTrue(rejects[0]['error'].startswith('Invalid JSON'))
+        self.assertEqual(rejects[1]['error'], 'User not found')
+
+
+class AuthenticatedClientMixin:
+    """Patch JWT decoding so requests are authenticated as self.user"""
+
+    def authenticate(self, staff=False):
+        self.client = Client()
+        decode_token_patcher = patch('api.interfaces.jwttokens.decode_token')
+        self.mock_decode_token = decode_token_patcher.start()
+        self.mock_decode_token.return_value = {
+            'user_id': str(self.user.id),
+            'username': self.user.name,
+            'email': self.user.email,
+            'is_staff': staff
+        }
+        self.addCleanup(decode_token_patcher.stop)
+        get_token_patcher = patch('api.interfaces.jwttokens.get_token_from_request')
+        get_token_patcher.start().return_value = "fake_jwt_token_for_testing"
+        self.addCleanup(get_token_patcher.stop)
+
+
+class OrderExportTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Export User',
+            email='export@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000002',
+        )
+        self.customer = Customer.objects.create(name='Export Customer', user=self.user, code='EXPORT01')
+        other = Customer.objects.create(name='Other Customer', user=self.user, code='EXPORT02')
+        self.orders = []
+        for i in range(5):
+            order = Order.objects.create(
+                customer=self.customer if i < 4 else other, item=f'Item {i}', amount=10 + i,
+                status='Pending' if i % 2 == 0 else 'Confirmed')
+            Order.objects.filter(id=order.id).update(date_created=datetime(2025, 1, i + 1, tzinfo=dt_timezone.utc))
+            self.orders.append(order)
+        self.authenticate()
+        self.export_url = reverse('export_orders')
+
+    def _stream(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_export_csv_in_date_order(self):
+        """Test CSV export returns all orders ordered by date_created"""
+        response = self.client.get(self.export_url)
+
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(StringIO(self._stream(response).decode())))
+        self.assertEqual([row['id'] for row in rows], [str(order.id) for order in self.orders])
+        self.assertEqual(rows[0]['customer_code'], 'EXPORT01')
+
+    def test_export_ndjson_filtered_and_gzipped(self):
+        """Test NDJSON export honours filters and gzip"""
+        response = self.client.get(self.export_url, {
+            'format': 'ndjson', 'gzip': '1', 'customer_code': 'EXPORT01', 'status': 'Pending',
+            'date_from': '2025-01-02', 'date_to': '2025-01-03',
+        })
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        rows = [json.loads(line) for line in gzip.decompress(self._stream(response)).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [str(self.orders[2].id)])
+
+    def test_export_resumes_after_checkpoint(self):
+        """Test the after checkpoint skips rows already exported"""
+        rows = list(csv.DictReader(StringIO(self._stream(self.client.get(self.export_url)).decode())))
+        response = self.client.get(self.export_url, {'after': f"{rows[1]['date_created']},{rows[1]['id']}"})
+
+        lines = self._stream(response).decode().splitlines()
+        self.assertEqual([line.split(',')[0] for line in lines], [row['id'] for row in rows[2:]])
+
+    def test_export_invalid_format(self):
+        """Test unknown export formats are rejected"""
+        response = self.client.get(self.export_url, {'format': 'xml'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_command_resumes_from_checkpoint(self):
+        """Test the export command truncates a partial tail and resumes from its checkpoint"""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        output = os.path.join(tmpdir, 'orders.ndjson.gz')
+        checkpoint = os.path.join(tmpdir, 'orders.checkpoint')
+        call_command('export_orders', '--format', 'ndjson', '--gzip', '--output', output, stderr=StringIO())
+        with gzip.open(output) as handle:
+            expected = handle.read()
+
+        # A run interrupted after two rows, leaving a half written tail behind its checkpoint
+        lines = expected.splitlines(keepends=True)
+        second = json.loads(lines[1])
+        first = gzip.compress(b''.join(lines[:2]))
+        with open(output, 'wb') as handle:
+            handle.write(first + b'partial garbage')
+        with open(checkpoint, 'w') as handle:
+            json.dump({
+                'after': f"{second['date_created']},{second['id']}",
+                'offset': len(first), 'rows': 2,
+            }, handle)
+
+        err = StringIO()
+        call_command('export_orders', '--format', 'ndjson', '--gzip', '--output', output,
+                     '--checkpoint', checkpoint, stderr=err)
+
+        with gzip.open(output) as handle:
+            self.assertEqual(handle.read(), expected)
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertIn('Exported 5 orders', err.getvalue())
+
+
+class PartitionOrdersCommandTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Partition User',
+            email='partition@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000003',
+        )
+        self.customer = Customer.objects.create(name='Partition Customer', user=self.user, code='PARTIT01')
+        self.order = Order.objects.create(customer=self.customer, item='Old', amount=5, status='Pending')
+        Order.objects.filter(id=self.order.id).update(date_created=datetime(2024, 11, 15, tzinfo=dt_timezone.utc))
+
+    def test_convert_partitions_existing_orders(self):
+        """Test convert moves existing orders into monthly partitions and keeps the ORM working"""
+        with self.assertRaisesMessage(CommandError, 'id (the primary key)'):
+            call_command('partition_orders', 'convert', stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE relname = 'api_order'")
+            self.assertEqual(cursor.fetchone()[0], 'r')
+
+        call_command('partition_orders', 'convert', '--months-ahead', '1', '--allow-non-unique', stdout=StringIO())
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE relname = 'api_order'")
+            self.assertEqual(cursor.fetchone()[0], 'p')
+            cursor.execute("SELECT count(*) FROM api_order_y2024m11")
+            self.assertEqual(cursor.fetchone()[0], 1)
+        self.assertEqual(Order.objects.get(id=self.order.id).item, 'Old')
+        new_order = Order.objects.create(customer=self.customer, item='New', amount=7, status='Pending')
+        self.assertEqual(Order.objects.filter(customer=self.customer).count(), 2)
+
+        out = StringIO()
+        call_command('partition_orders', 'status', stdout=out)
+        self.assertIn(f"api_order_y{new_order.date_created:%Y}m{new_order.date_created:%m}", out.getvalue())
+        self.assertIn('api_order_default', out.getvalue())
+
+    def test_all_orders_prune_old_partitions(self):
+        """Test listing all orders skips partitions before date_from, which defaults to a recent window"""
+        call_command('partition_orders', 'convert', '--months-ahead', '1', '--allow-non-unique', stdout=StringIO())
+        Order.objects.create(customer=self.customer, item='New', amount=7, status='Pending')
+        self.authenticate()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('get_all_orders'))
+        self.assertEqual([order['item'] for order in json.loads(response.content)['orders']], ['New'])
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + queries.captured_queries[-1]['sql'])
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertNotIn('api_order_y2024m11', plan)
+
+        response = self.client.get(reverse('get_all_orders'), {'date_from': '2024-11-01'})
+        self.assertEqual(len(json.loads(response.content)['orders']), 2)
+
+
+class ArchiveOrdersTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Archive User',
+            email='archive@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000004',
+        )
+        self.customer = Customer.objects.create(name='Archive Customer', user=self.user, code='ARCHIV01')
+        self.old = Order.objects.create(customer=self.customer, item='Old', amount=5, status='Confirmed')
+        self.pending = Order.objects.create(customer=self.customer, item='Pending', amount=6, status='Pending')
+        self.recent = Order.objects.create(customer=self.customer, item='Recent', amount=7, status='Confirmed')
+        Order.objects.filter(id__in=[self.old.id, self.pending.id]).update(
+            date_modified=timezone.now() - timedelta(days=400))
+        self.authenticate()
+
+    def test_archive_moves_old_closed_orders(self):
+        """Test only closed orders past the cutoff are archived"""
+        call_command('archive_orders', 'run', '--older-than-days', '180', '--batch-size', '1', stdout=StringIO())
+
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)), {self.pending.id, self.recent.id})
+        archived = ArchivedOrder.objects.get(id=self.old.id)
+        self.assertEqual(archived.date_created, self.old.date_created)
+        self.assertEqual(archived.customer, self.customer)
+        # Archived orders are still served, moving them is not a deletion
+        self.assertFalse(OrderTombstone.objects.exists())
+
+    def test_reads_fall_back_to_archive(self):
+        """Test get_order and customer orders still return archived orders"""
+        call_command('archive_orders', 'run', stdout=StringIO())
+
+        response = self.client.get(reverse('get_order', args=[self.old.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['order']['item'], 'Old')
+
+        response = self.client.post(
+            reverse('get_customer_orders'), data=json.dumps({'customer_code': 'ARCHIV01'}),
+            content_type='application/json')
+        items = {order['item'] for order in json.loads(response.content)['orders']}
+        self.assertEqual(items, {'Old', 'Pending', 'Recent'})
+
+        response = self.client.get(reverse('get_order', args=[uuid.uuid4()]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_report_counts_tiers(self):
+        """Test the report lists hot and archived row counts"""
+        call_command('archive_orders', 'run', stdout=StringIO())
+        out = StringIO()
+        call_command('archive_orders', 'report', stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[1].split()[:2], ['hot', '2'])
+        self.assertEqual(lines[2].split()[:2], ['archived', '1'])
+
+
+class CustomerCountersTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Counter User',
+            email='counter@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000005',
+        )
+        self.customer = Customer.objects.create(name='Counter Customer', user=self.user, code='COUNT001')
+        self.authenticate()
+        sms_patcher = patch('api.interfaces.handleorders.SendSms')
+        sms_patcher.start().return_value.send.return_value = {'status': 'sent'}
+        self.addCleanup(sms_patcher.stop)
+
+    def _create_order(self, amount):
+        response = self.client.post(
+            reverse('create_order'), data=json.dumps({'customer_code': 'COUNT001', 'item': 'Mango', 'amount': amount}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return json.loads(response.content)['order_id']
+
+    def test_counters_follow_create_and_confirm(self):
+        """Test creating and confirming orders keeps the customer counters in step"""
+        first = self._create_order('420.50')
+        self._create_order('10')
+        response = self.client.post(
+            reverse('confirm_order'), data=json.dumps({'customer_code': 'COUNT001', 'order_id': first}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.order_count, 2)
+        self.assertEqual(self.customer.total_amount, Decimal('430.50'))
+        self.assertEqual(self.customer.pending_count, 1)
+        self.assertEqual(self.customer.last_order_at, Order.objects.order_by('-date_created')[0].date_created)
+
+        response = self.client.post(
+            reverse('confirm_order'), data=json.dumps({'customer_code': 'COUNT001', 'order_id': first}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.pending_count, 1)
+
+    def test_lookup_customers_returns_summary(self):
+        """Test the customer lookup exposes the counters without querying orders"""
+        self._create_order('5')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('lookup_customers'))
+
+        customer = json.loads(response.content)['customers'][0]
+        self.assertEqual((customer['order_count'], customer['total_amount']), (1, '5.00'))
+        self.assertFalse(any('api_order' in query['sql'] for query in queries.captured_queries))
+
+    def test_reconcile_repairs_drift(self):
+        """Test the reconciliation command recomputes drifted counters, archived orders included"""
+        self._create_order('7')
+        old = Order.objects.create(customer=self.customer, item='Old', amount=3, status='Confirmed')
+        Order.objects.filter(id=old.id).update(date_modified=timezone.now() - timedelta(days=400))
+        call_command('archive_orders', 'run', stdout=StringIO())
+        Customer.objects.filter(id=self.customer.id).update(order_count=99, pending_count=0)
+
+        out = StringIO()
+        call_command('reconcile_customer_counters', stdout=out)
+
+        self.assertIn('Checked 1 customers, 1 repaired', out.getvalue())
+        self.customer.refresh_from_db()
+        self.assertEqual((self.customer.order_count, self.customer.pending_count), (2, 1))
+        self.assertEqual(self.customer.total_amount, Decimal('10'))
+
+
+class CustomerOrderListingTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Listing User',
+            email='listing@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000006',
+        )
+        self.customer = Customer.objects.create(name='Listing Customer', user=self.user, code='LIST0001')
+        for i, item in enumerate(['Mango juice', 'Apple', 'Mango', 'Banana', 'Green mango', 'Pear']):
+            order = Order.objects.create(
+                customer=self.customer, item=item, amount=10 * (i + 1), status='Pending' if i % 2 else 'Confirmed')
+            Order.objects.filter(id=order.id).update(date_created=timezone.now() + timedelta(minutes=i))
+        self.authenticate()
+
+    def _list(self, **params):
+        response = self.client.post(
+            reverse('get_customer_orders'), data=json.dumps({'customer_code': 'LIST0001', **params}),
+            content_type='application/json')
+        return response.status_code, json.loads(response.content)
+
+    def test_filters(self):
+        """Test status, amount range and item search filters"""
+        _, data = self._list(status='Pending', amount_min='20', amount_max='50')
+        self.assertEqual([order['item'] for order in data['orders']], ['Banana', 'Apple'])
+
+        _, data = self._list(item='MANGO', sort='amount')
+        self.assertEqual([order['item'] for order in data['orders']], ['Mango juice', 'Mango', 'Green mango'])
+
+        _, data = self._list(item_prefix='mango', sort='-amount')
+        self.assertEqual([order['item'] for order in data['orders']], ['Mango', 'Mango juice'])
+
+    def test_keyset_pagination(self):
+        """Test walking every page with the cursor returns each order once in order"""
+        seen, cursor = [], None
+        while True:
+            status, data = self._list(limit=4, sort='-amount', **({'cursor': cursor} if cursor else {}))
+            self.assertEqual(status, 200)
+            seen.extend(order['item'] for order in data['orders'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, ['Pear', 'Green mango', 'Banana', 'Mango', 'Apple', 'Mango juice'])
+
+    def test_invalid_parameters(self):
+        """Test malformed listing parameters are rejected"""
+        for params in ({'sort': 'item'}, {'limit': 1000}, {'cursor': 'bogus'}, {'amount_min': 'ten'}):
+            status, data = self._list(**params)
+            self.assertEqual(status, 400, params)
+
+    def test_fields_projection(self):
+        """Test fields narrows the orders returned while the cursor still pages by the sort key"""
+        status, data = self._list(fields=['item'], sort='amount', limit=4)
+        self.assertEqual(status, 200)
+        self.assertEqual(data['orders'][0], {'item': 'Mango juice'})
+
+        _, data = self._list(fields='item,status', sort='amount', cursor=data['next_cursor'])
+        self.assertEqual(data['orders'], [{'item': 'Green mango', 'status': 'Confirmed'}, {'item': 'Pear', 'status': 'Pending'}])
+
+        status, _ = self._list(fields='item,password')
+        self.assertEqual(status, 400)
+
+    def test_list_endpoints_select_requested_columns_only(self):
+        """Test fields keeps unrequested columns and joins out of the SQL"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('get_all_orders'), {'fields': 'id,status'})
+        self.assertEqual(set(json.loads(response.content)['orders'][0]), {'id', 'status'})
+        self.assertNotIn('"item"', queries.captured_queries[-1]['sql'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('lookup_customers') + '?fields=code,order_count')
+        self.assertEqual(json.loads(response.content)['customers'], [{'code': 'LIST0001', 'order_count': 0}])
+        self.assertNotIn('api_user', queries.captured_queries[-1]['sql'])
+
+        response = self.client.post(reverse('lookup_customers'))
+        self.assertEqual(json.loads(response.content)['customers'][0]['email'], 'listing@example.com')
+
+        response = self.client.post(reverse('lookup_all_users') + '?fields=email')
+        self.assertEqual(json.loads(response.content)['users'], [{'email': 'listing@example.com'}])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Query plans are checked on Postgres')
+    def test_listing_queries_avoid_sequential_scans(self):
+        """Test every filter combination is served by an index at scale"""
+        customers = Customer.objects.bulk_create(
+            [Customer(name=f'Bulk {i}', user=self.user, code=f'BULK{i:04d}') for i in range(200)])
+        Order.objects.bulk_create([
+            Order(customer=customers[i % 200], item=f'Item {i % 97}', amount=i % 500,
+                  status='Pending' if i % 3 else 'Confirmed')
+            for i in range(30000)], batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE api_order')
+
+        for params in ({}, {'status': 'Pending'}, {'amount_min': '10', 'amount_max': '90', 'sort': 'amount'},
+                       {'date_from': '2020-01-01', 'sort': 'date_created'}, {'item': 'ango'},
+                       {'item_prefix': 'Ma', 'sort': '-amount'}):
+            with CaptureQueriesContext(connection) as queries:
+                status, _ = self._list(**params)
+            self.assertEqual(status, 200)
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN ' + queries.captured_queries[-1]['sql'])
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+            self.assertNotIn('Seq Scan on api_order ', plan + ' ', params)
+
+
+class IdempotentCreateOrderTests(AuthenticatedClientMixin, TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Idempotent User',
+            email='idempotent@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000007',
+        )
+        self.customer = Customer.objects.create(name='Idempotent Customer', user=self.user, code='IDEMP001')
+        self.authenticate()
+        sms_patcher = patch('api.interfaces.handleorders.SendSms')
+        self.mock_send = sms_patcher.start().return_value.send
+        self.mock_send.return_value = {'status': 'sent'}
+        self.addCleanup(sms_patcher.stop)
+
+    def _create(self, key, item='Mango', client=None):
+        return (client or self.client).post(
+            reverse('create_order'), data=json.dumps({'customer_code': 'IDEMP001', 'item': item, 'amount': '42'}),
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_stored_response(self):
+        """Test a retry returns the first response without inserting or texting again"""
+        first = self._create('key-1')
+        retry = self._create('key-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Job.objects.count(), 1)
+
+        self.assertEqual(self._create('key-2').status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_with_different_body(self):
+        """Test reusing a key for a different request is rejected"""
+        self._create('key-1')
+        response = self._create('key-1', item='Apple')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_concurrent_duplicates_execute_once(self):
+        """Test concurrent duplicates wait for the first request instead of running in parallel"""
+        def slow_enqueue(*args, **kwargs):
+            time.sleep(0.3)
+            return enqueue(*args, **kwargs)
+        enqueue_patcher = patch('api.interfaces.handleorders.enqueue', side_effect=slow_enqueue)
+        enqueue_patcher.start()
+        self.addCleanup(enqueue_patcher.stop)
+        responses = []
+
+        def worker():
+            try:
+                responses.append(self._create('key-1', client=Client()))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [201, 201, 201])
+        self.assertEqual(len({response.content for response in responses}), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Job.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_LEASE_SECONDS=0)
+    def test_running_request_keeps_key_past_lease(self):
+        """Test a duplicate waits for a request still running past its lease, only a dead one is taken over"""
+        def slow_enqueue(*args, **kwargs):
+            time.sleep(0.5)
+            return enqueue(*args, **kwargs)
+        enqueue_patcher = patch('api.interfaces.handleorders.enqueue', side_effect=slow_enqueue)
+        enqueue_patcher.start()
+        self.addCleanup(enqueue_patcher.stop)
+        responses = []
+
+        def worker():
+            try:
+                responses.append(self._create('key-1', client=Client()))
+            finally:
+                connection.close()
+
+        first = threading.Thread(target=worker)
+        first.start()
+        time.sleep(0.2)
+        duplicate = threading.Thread(target=worker)
+        duplicate.start()
+        first.join()
+        duplicate.join()
+        self.assertEqual([response.status_code for response in responses], [201, 201])
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+        # A claim left behind by a request that died holds no lock
+        IdempotencyKey.objects.create(user_id=str(self.user.id), endpoint='create_order', key='key-2',
+                                      request_hash='', expires_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(self._create('key-2').status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+
+@override_settings(RATE_LIMIT_RULES=[('/api/orders/', 3, 60)], RATE_LIMIT_STORAGE='memory')
+class RateLimitTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Limited User',
+            email='limited@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000008',
+        )
+        self.url = reverse('get_all_orders')
+
+    def _exhaust(self, client):
+        responses = [client.get(self.url) for _ in range(4)]
+        self.assertNotIn(429, [response.status_code for response in responses[:3]])
+        return responses
+
+    def test_anonymous_clients_limited_by_ip(self):
+        """Test requests over the limit get a 429 with Retry-After"""
+        responses = self._exhaust(Client())
+
+        self.assertEqual(responses[2]['X-RateLimit-Remaining'], '0')
+        self.assertEqual(responses[3].status_code, 429)
+        self.assertEqual(responses[3]['Retry-After'], '20')
+        self.assertNotEqual(Client(REMOTE_ADDR='10.0.0.2').get(self.url).status_code, 429)
+
+    def test_authenticated_clients_limited_by_user(self):
+        """Test each user gets their own bucket"""
+        self.authenticate()
+        self.assertEqual(self._exhaust(self.client)[3].status_code, 429)
+
+        self.mock_decode_token.return_value = dict(self.mock_decode_token.return_value, user_id=str(uuid.uuid4()))
+        self.assertNotEqual(self.client.get(self.url).status_code, 429)
+
+    def test_undecodable_tokens_limited_by_ip(self):
+        """Test a token failing to decode unexpectedly is counted by IP and answered by login_required"""
+        self.authenticate()
+        self.mock_decode_token.side_effect = RuntimeError('JWT_SECRET must be set in Django settings')
+        responses = self._exhaust(self.client)
+        self.assertEqual([response.status_code for response in responses], [401, 401, 401, 429])
+
+        # A signed token without user_id, from another address
+        self.mock_decode_token.side_effect = None
+        self.mock_decode_token.return_value = {'username': self.user.name}
+        self.assertEqual(Client(REMOTE_ADDR='10.0.0.3').get(self.url).status_code, 401)
+
+    def test_unmatched_paths_not_limited(self):
+        """Test paths outside the rules are not counted"""
+        client = Client()
+        statuses = [client.get('/login-missing/').status_code for _ in range(5)]
+
+        self.assertNotIn(429, statuses)
+
+    @override_settings(RATE_LIMIT_STORAGE='database')
+    def test_database_storage(self):
+        """Test buckets shared through the database"""
+        self.assertEqual(self._exhaust(Client())[3].status_code, 429)
+        self.assertLess(RateLimitBucket.objects.get().tokens, 1)
+
+        # Another worker sees the same bucket
+        self.assertEqual(Client().get(self.url).status_code, 429)
+
+        DatabaseStorage().prune(0)
+        self.assertFalse(RateLimitBucket.objects.exists())
+
+
+class LoadSheddingTests(TestCase):
+    def _request(self, started=None):
+        headers = {'HTTP_X_REQUEST_START': f"t={started * 1000:.0f}"} if started else {}
+        return RequestFactory().get('/api/orders/all-orders/', **headers)
+
+    @override_settings(LOAD_SHED_MAX_QUEUE_MS=100, LOAD_SHED_MAX_IN_FLIGHT=0)
+    def test_sheds_while_requests_queue(self):
+        """Test requests are shed while the smoothed queue time is over the threshold and resume after"""
+        middleware = LoadSheddingMiddleware(lambda request: MagicMock(status_code=200))
+
+        response = middleware(self._request(time.time() - 5))
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+        statuses = [middleware(self._request(time.time())).status_code for _ in range(20)]
+        self.assertEqual(statuses[0], 503)
+        self.assertEqual(statuses[-1], 200)
+
+    @override_settings(LOAD_SHED_MAX_QUEUE_MS=0, LOAD_SHED_MAX_IN_FLIGHT=1)
+    def test_sheds_over_in_flight_limit(self):
+        """Test a request arriving while the worker is busy is shed"""
+        nested = []
+
+        def get_response(request):
+            nested.append(middleware(self._request()))
+            return MagicMock(status_code=200)
+        middleware = LoadSheddingMiddleware(get_response)
+
+        self.assertEqual(middleware(self._request()).status_code, 200)
+        self.assertEqual(nested[0].status_code, 503)
+        self.assertEqual(middleware.in_flight, 0)
+
+
+class CompressionTests(TestCase):
+    def setUp(self):
+        self.payload = JsonResponse({'orders': [{'id': str(uuid.uuid4()), 'item': 'Mango', 'amount': '42.00'}] * 100})
+        self.middleware = CompressionMiddleware(lambda request: self.response)
+
+    def _get(self, response, accept_encoding):
+        self.response = response
+        return self.middleware(RequestFactory().get('/api/orders/', HTTP_ACCEPT_ENCODING=accept_encoding))
+
+    def test_gzip(self):
+        """Test JSON bodies are gzipped when the client accepts it"""
+        body = self.payload.content
+        response = self._get(self.payload, 'gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), body)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_brotli_preferred(self):
+        """Test brotli wins over gzip unless the client weighs it lower"""
+        body = self.payload.content
+        response = self._get(self.payload, 'gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), body)
+
+        self.assertEqual(self._get(JsonResponse({'orders': [body.decode()]}), 'br;q=0.5, gzip')['Content-Encoding'], 'gzip')
+
+    def test_left_uncompressed(self):
+        """Test small, binary and refused responses are sent as is"""
+        self.assertFalse(self._get(JsonResponse({'ok': True}), 'gzip').has_header('Content-Encoding'))
+        self.assertFalse(self._get(HttpResponse(b'x' * 5000, content_type='image/png'), 'gzip').has_header('Content-Encoding'))
+        self.assertFalse(self._get(self.payload, 'gzip;q=0, identity').has_header('Content-Encoding'))
+
+
+@override_settings(REPLICA_DATABASES=['replica_test'], REPLICA_SELECTION='round_robin', REPLICA_MAX_LAG_SECONDS=5)
+class ReadReplicaTests(AuthenticatedClientMixin, TransactionTestCase):
+    """The replica is a second connection to the test database, standing in for a streaming replica"""
+    databases = {'default', 'replica_test'}
+
+    @classmethod
+    def setUpClass(cls):
+        connections.settings['replica_test'] = dict(connections['default'].settings_dict)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica_test'].close()
+        del connections['replica_test']
+        del connections.settings['replica_test']
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        dbrouter.selector.state.clear()
+        self.user = User.objects.create(
+            name='Replica User',
+            email='replica@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000009',
+        )
+        self.customer = Customer.objects.create(name='Replica Customer', user=self.user, code='REPL0001')
+        self.authenticate()
+
+    def _queries_by_alias(self, request):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica_test']) as replica:
+            response = request()
+        self.assertEqual(response.status_code, 200)
+        return ' '.join(query['sql'] for query in primary), ' '.join(query['sql'] for query in replica)
+
+    def _list_orders(self):
+        return self.client.post(
+            reverse('get_customer_orders'), data=json.dumps({'customer_code': 'REPL0001'}),
+            content_type='application/json')
+
+    def test_read_only_handlers_read_from_replica(self):
+        """Test lookups and listings are served by the replica"""
+        for request in (lambda: self.client.post(reverse('lookup_customers')), self._list_orders,
+                        lambda: self.client.get(reverse('get_all_orders'))):
+            primary, replica = self._queries_by_alias(request)
+            self.assertNotIn('api_customer', primary)
+            self.assertNotIn('api_order', primary)
+            self.assertIn('FROM "api_', replica)
+
+    @patch('api.interfaces.handleorders.SendSms')
+    def test_reads_stick_to_primary_after_a_write(self, mock_sms):
+        """Test a user reads their own writes from the primary right after writing"""
+        mock_sms.return_value.send.return_value = {'status': 'sent'}
+        response = self.client.post(
+            reverse('create_order'), data=json.dumps({'customer_code': 'REPL0001', 'item': 'Mango', 'amount': '42'}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+        primary, replica = self._queries_by_alias(self._list_orders)
+        self.assertIn('api_order', primary)
+        self.assertNotIn('api_order', replica)
+
+        cache.delete(dbrouter.pin_key(self.user.id))
+        primary, replica = self._queries_by_alias(self._list_orders)
+        self.assertIn('api_order', replica)
+
+    @override_settings(REPLICA_MAX_LAG_SECONDS=-1)
+    def test_lagging_replica_falls_back_to_primary(self):
+        """Test a replica behind by more than the allowed lag is skipped"""
+        primary, replica = self._queries_by_alias(self._list_orders)
+
+        self.assertIn('api_order', primary)
+        self.assertNotIn('api_order', replica)
+        self.assertFalse(dbrouter.selector.state['replica_test']['healthy'])
+
+    @override_settings(REPLICA_DATABASES=['replica_test', 'replica_slow'])
+    def test_selection(self):
+        """Test round robin alternates replicas and least latency picks the fastest"""
+        now = time.monotonic()
+        dbrouter.selector.state.update({
+            'replica_test': {'healthy': True, 'latency': 0.001, 'checked_at': now},
+            'replica_slow': {'healthy': True, 'latency': 0.050, 'checked_at': now},
+        })
+        self.assertEqual({dbrouter.selector.choose() for _ in range(4)}, {'replica_test', 'replica_slow'})
+        with override_settings(REPLICA_SELECTION='least_latency'):
+            self.assertEqual({dbrouter.selector.choose() for _ in range(4)}, {'replica_test'})
+
+
+class PrincipalCacheTests(TestCase):
+    def setUp(self):
+        principals.clear()
+        self.addCleanup(principals.clear)
+        self.user = User.objects.create(
+            name='Principal User',
+            email='principal@example.com',
+            openid_user_id='auth0|principal',
+            phone_number='+254700000010',
+        )
+        self.request = RequestFactory().get('/api/orders/', HTTP_AUTHORIZATION='Bearer token')
+
+    def test_cached_until_user_saved(self):
+        """Test a user is read once for both keys and re-read after it is saved"""
+        with self.assertNumQueries(1):
+            principal = get_principal(user_id=str(self.user.id))
+            self.assertEqual(get_principal(openid_user_id='auth0|principal'), principal)
+        self.assertEqual((principal.phone_number, principal.is_staff), ('+254700000010', False))
+
+        self.user.role = 'admin'
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertTrue(get_principal(openid_user_id='auth0|principal').is_staff)
+
+    @override_settings(PRINCIPAL_CACHE_TTL=0)
+    def test_expires_after_ttl(self):
+        """Test entries older than the TTL are reloaded"""
+        with self.assertNumQueries(2):
+            get_principal(user_id=self.user.id)
+            get_principal(user_id=self.user.id)
+
+    @patch('api.interfaces.decorator.verify_token')
+    def test_auth_required_shares_cache(self, mock_verify):
+        """Test auth_required resolves the user once, login_required reuses the cached principal"""
+        mock_verify.return_value = {'sub': 'auth0|principal', 'email': 'principal@example.com'}
+
+        class View:
+            @auth_required
+            def get(self, request):
+                return JsonResponse({'email': request.user.email})
+
+        with self.assertNumQueries(1):
+            for _ in range(3):
+                self.assertEqual(json.loads(View().get(self.request).content), {'email': 'principal@example.com'})
+
+        @login_required
+        def view(request):
+            return JsonResponse({'role': request.principal.role})
+
+        with patch('api.interfaces.jwttokens.decode_token', return_value={'user_id': str(self.user.id)}), \
+                self.assertNumQueries(0):
+            self.assertEqual(json.loads(view(self.request).content), {'role': 'user'})
+
+    @patch('api.interfaces.decorator.verify_token')
+    def test_unknown_user(self, mock_verify):
+        """Test tokens of users missing from the database are refused"""
+        mock_verify.return_value = {'sub': 'auth0|missing', 'email': 'missing@example.com'}
+
+        class View:
+            @auth_required
+            def get(self, request):
+                return JsonResponse({})
+
+        self.assertEqual(View().get(self.request).status_code, 403)
+
+
+class SerializerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Serializer User',
+            email='serializer@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000011',
+        )
+        self.customer = Customer.objects.create(name='Serializer Customer', user=self.user, code='SERI0001')
+        Order.objects.create(customer=self.customer, item='Mango', amount=Decimal('42.50'), status='Pending')
+
+    def test_matches_model_encoding(self):
+        """Test serialized rows encode exactly like values() dicts through DjangoJSONEncoder"""
+        for serializer, queryset in ((OrderSerializer(), Order.objects.all()),
+                                     (CustomerSerializer(), Customer.objects.all())):
+            expected = json.loads(JsonResponse({'rows': list(queryset.values(*serializer.columns))}).content)['rows']
+            expected = [{name: row[lookup] for name, lookup, _ in serializer.fields} for row in expected]
+            self.assertEqual(serializer.serialize(serializer.rows(queryset)), expected)
+
+    def test_projection_and_extra_columns(self):
+        """Test only requested fields are output while extra lookups are still selected"""
+        serializer = OrderSerializer(['amount'])
+        rows = list(serializer.rows(Order.objects.all(), 'id'))
+
+        self.assertEqual(len(rows[0]), 2)
+        self.assertEqual(serializer.serialize(rows), [{'amount': '42.50'}])
+
+
+class LookupPaginationTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        User.objects.bulk_create([
+            User(name=f'Paged {i}', email=f'paged{i}@example.com', openid_user_id=f'paged|{i}', password='secret')
+            for i in range(25)])
+        self.user = User.objects.get(email='paged0@example.com')
+        self.authenticate()
+
+    def _lookup(self, **params):
+        response = self.client.post(f"{reverse('lookup_all_users')}?{'&'.join(f'{k}={v}' for k, v in params.items())}")
+        return response.status_code, json.loads(response.content)
+
+    def test_keyset_pagination(self):
+        """Test walking the cursor returns every user once in creation order"""
+        seen, cursor = [], ''
+        while cursor is not None:
+            status, data = self._lookup(per_page=10, cursor=cursor)
+            self.assertEqual(status, 200)
+            self.assertNotIn('total_pages', data)
+            seen.extend(user['email'] for user in data['users'])
+            cursor = data['next_cursor']
+        expected = list(User.objects.order_by('date_created', 'id').values_list('email', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_page_mode_returns_cursor(self):
+        """Test page based requests keep working and hand out a cursor to continue from"""
+        _, first = self._lookup(per_page=10, page=1)
+        _, second = self._lookup(per_page=10, cursor=first['next_cursor'])
+        _, page_two = self._lookup(per_page=10, page=2)
+
+        self.assertEqual(first['total_pages'], 3)
+        self.assertEqual(second['users'], page_two['users'])
+
+    def test_only_emitted_columns_read(self):
+        """Test the password column is never selected"""
+        with CaptureQueriesContext(connection) as queries:
+            self._lookup(cursor='')
+        self.assertNotIn('password', queries.captured_queries[-1]['sql'])
+
+    def test_invalid_parameters(self):
+        """Test per_page is capped and malformed paging parameters are rejected"""
+        for params in ({'per_page': 1000}, {'per_page': 0}, {'per_page': 'all'}, {'page': -1}, {'cursor': 'bogus'}):
+            status, _ = self._lookup(**params)
+            self.assertEqual(status, 400, params)
+
+
+class LazyClientTests(TestCase):
+    @patch('api.interfaces.smsnotify.sms_client')
+    def test_sms_client_created_on_send(self, mock_client):
+        """Test the AfricasTalking client is only created when a message is sent"""
+        sms = SendSms()
+        mock_client.assert_not_called()
+
+        sms.send('254700000001', 'Hello')
+        mock_client.return_value.send.assert_called_once_with('Hello', ['+254700000001'], sms.sender)
+
+    def test_jwt_settings_read_on_first_use(self):
+        """Test a missing JWT_SECRET only fails when a token is generated, and settings changes are picked up"""
+        user = User(name='Token User', email='token@example.com')
+        with override_settings(JWT_SECRET=None), self.assertRaises(RuntimeError):
+            generate_token(user)
+        with override_settings(JWT_SECRET='rotated-secret', JWT_TOKEN_EXPIRATION=5):
+            self.assertEqual(jwt_settings().secret, 'rotated-secret')
+            self.assertEqual(generate_token(user)['expires_in'], 300)
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(
+            name='Admin User', email='admin@example.com', openid_user_id='auth0|admin', role='admin')
+        self.client.force_login(self.admin)
+        self.customer = Customer.objects.create(name='Admin Customer', user=self.admin, code='ADMIN001')
+
+    def _create_orders(self, count):
+        Order.objects.bulk_create(
+            Order(customer=self.customer, item='Mango', amount=10, status='Pending') for _ in range(count))
+
+    def _changelist_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:api_order_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_independent_of_rows(self):
+        """Test customers are joined rather than loaded one query per row"""
+        self._create_orders(2)
+        few = self._changelist_queries()
+        few_searched = self._changelist_queries(q='admin cust', status__exact='Pending')
+        self._create_orders(20)
+        self.assertEqual(self._changelist_queries(), few)
+        self.assertEqual(self._changelist_queries(q='admin cust', status__exact='Pending'), few_searched)
+
+    def test_estimated_count_when_unfiltered(self):
+        """Test unfiltered lists of large tables read the planner estimate, filtered lists count exactly"""
+        self._create_orders(5)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE api_order')
+        with patch('api.admin.ESTIMATED_COUNT_THRESHOLD', 1), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(EstimatedCountPaginator(Order.objects.order_by('id'), 10).count, 5)
+            filtered = Order.objects.filter(status='Completed').order_by('id')
+            self.assertEqual(EstimatedCountPaginator(filtered, 10).count, 0)
+        self.assertIn('pg_class', queries.captured_queries[0]['sql'])
+        self.assertIn('COUNT(*)', queries.captured_queries[1]['sql'])
+
+    def test_date_hierarchy_periods_from_bounds(self):
+        """Test the drill-down lists every period between the first and the last order"""
+        self._create_orders(2)
+        first, last = Order.objects.all()
+        Order.objects.filter(id=first.id).update(date_created=datetime(2025, 11, 30, 23, 0, tzinfo=dt_timezone.utc))
+        Order.objects.filter(id=last.id).update(date_created=datetime(2026, 2, 1, 8, 0, tzinfo=dt_timezone.utc))
+        queryset = DateHierarchyQuerySet(Order)
+
+        self.assertEqual([period.year for period in queryset.datetimes('date_created', 'year')], [2025, 2026])
+        self.assertEqual([(period.year, period.month) for period in queryset.datetimes('date_created', 'month')],
+                         [(2025, 11), (2025, 12), (2026, 1), (2026, 2)])
+        self.assertEqual(len(queryset.datetimes('date_created', 'day')), 64)
+        response = self.client.get(reverse('admin:api_order_changelist'), {'date_created__year': 2026})
+        self.assertContains(response, 'date_created__month=2')
+
+
+@override_settings(ORDER_CHANGES_SETTLE_SECONDS=0)
+class OrderChangeFeedTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Feed User',
+            email='feed@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000012',
+        )
+        self.customer = Customer.objects.create(name='Feed Customer', user=self.user, code='FEED0001')
+        self.orders = []
+        for i, item in enumerate(['Mango', 'Apple', 'Banana', 'Pear', 'Avocado']):
+            order = Order.objects.create(customer=self.customer, item=item, amount=10, status='Pending')
+            Order.objects.filter(id=order.id).update(date_modified=timezone.now() - timedelta(hours=5 - i))
+            self.orders.append(order)
+        self.authenticate()
+
+    def _changes(self, **params):
+        response = self.client.get(reverse('get_order_changes'), params)
+        return response.status_code, json.loads(response.content)
+
+    def _catch_up(self, cursor=None):
+        changes = []
+        while True:
+            status, data = self._changes(limit=2, **({'since': cursor} if cursor else {}))
+            self.assertEqual(status, 200)
+            changes.extend(data['changes'])
+            cursor = data['next_cursor']
+            if not data['has_more']:
+                return changes, cursor
+
+    def test_pages_through_changes_in_order(self):
+        """Test walking the feed returns every order once, oldest change first, and then nothing new"""
+        changes, cursor = self._catch_up()
+        self.assertEqual([change['order']['item'] for change in changes], ['Mango', 'Apple', 'Banana', 'Pear', 'Avocado'])
+        self.assertEqual({change['op'] for change in changes}, {'upsert'})
+
+        status, data = self._changes(since=cursor)
+        self.assertEqual((status, data['changes'], data['next_cursor']), (200, [], cursor))
+
+    def test_modifications_and_deletions_after_cursor(self):
+        """Test only orders changed since the cursor are returned, deleted orders as tombstones"""
+        _, cursor = self._catch_up()
+        Order.objects.filter(id=self.orders[1].id).update(status='Confirmed', date_modified=timezone.now())
+        deleted_id = self.orders[3].id
+        self.orders[3].delete()
+
+        changes, _ = self._catch_up(cursor)
+        self.assertEqual(changes, [
+            {'op': 'upsert', 'order': {**changes[0]['order'], 'id': str(self.orders[1].id), 'status': 'Confirmed'}},
+            {'op': 'delete', 'id': str(deleted_id), 'customer_id': str(self.customer.id)},
+        ])
+
+    def test_cascaded_deletes_leave_tombstones(self):
+        """Test orders deleted along with their user get tombstones, hot and archived ones alike"""
+        user = User.objects.create(name='Gone User', email='gone@example.com', openid_user_id=str(uuid.uuid4()))
+        customer = Customer.objects.create(name='Gone Customer', user=user, code='FEED0002')
+        hot = Order.objects.create(customer=customer, item='Kiwi', amount=10, status='Pending')
+        archived = ArchivedOrder.objects.create(
+            id=uuid.uuid4(), customer=customer, item='Lime', amount=10, status='Confirmed',
+            date_created=timezone.now(), date_modified=timezone.now())
+        user.delete()
+
+        self.assertEqual(set(OrderTombstone.objects.values_list('id', 'customer_id')),
+                         {(hot.id, customer.id), (archived.id, customer.id)})
+
+    @override_settings(ORDER_CHANGES_SETTLE_SECONDS=60)
+    def test_recent_changes_held_back(self):
+        """Test changes younger than the settle delay wait for the next poll"""
+        _, cursor = self._catch_up()
+        Order.objects.filter(id=self.orders[0].id).update(date_modified=timezone.now())
+        self.assertEqual(self._changes(since=cursor)[1]['changes'], [])
+
+    def test_invalid_and_expired_cursors(self):
+        """Test malformed cursors are rejected and cursors older than the tombstones kept must resync"""
+        self.assertEqual(self._changes(since='bogus')[0], 400)
+        self.assertEqual(self._changes(limit=0)[0], 400)
+        expired = encode_cursor('changed_at', {'changed_at': timezone.now() - timedelta(days=31), 'id': uuid.uuid4()})
+        status, data = self._changes(since=expired)
+        self.assertEqual((status, data['code']), (410, 'cursor_expired'))
+
+
+class OrderEventStreamTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Events User',
+            email='events@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000013',
+        )
+        self.customer = Customer.objects.create(name='Events Customer', user=self.user, code='EVT00001')
+        self.orders = [
+            Order.objects.create(customer=self.customer, item=item, amount=10, status='Pending')
+            for item in ('Mango', 'Apple')]
+        self.authenticate()
+        listener_patcher = patch.object(hub, 'ensure_listener')
+        listener_patcher.start()
+        self.addCleanup(listener_patcher.stop)
+        self.addCleanup(hub.subscribers.clear)
+        self.addCleanup(setattr, hub, 'count', 0)
+
+    def _publish(self, order, status, date_modified):
+        hub.publish(json.dumps({
+            'id': str(order.id), 'customer_id': str(self.customer.id), 'status': status,
+            'date_modified': date_modified.isoformat()}))
+
+    @override_settings(ORDER_EVENTS_HEARTBEAT_SECONDS=0.01)
+    async def test_replays_missed_events_then_streams_live(self):
+        """Test a reconnect gets the events after Last-Event-ID, then live events and heartbeats"""
+        first, second = self.orders
+        response = await self.async_client.get(
+            reverse('order_events', args=['EVT00001']),
+            headers={'Last-Event-ID': event_id(first.id, first.date_modified)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        replayed = (await anext(stream)).decode()
+        self.assertIn(f'id: {event_id(second.id, second.date_modified)}\nevent: status\n', replayed)
+        self.assertIn('"status": "Pending"', replayed)
+
+        # The replayed change arriving live again is skipped, the confirmation is sent
+        self._publish(second, 'Pending', second.date_modified)
+        confirmed_at = timezone.now()
+        self._publish(first, 'Confirmed', confirmed_at)
+        live = (await anext(stream)).decode()
+        self.assertIn(f'id: {event_id(first.id, confirmed_at)}\n', live)
+        self.assertIn('"status": "Confirmed"', live)
+        self.assertEqual(await anext(stream), b': heartbeat\n\n')
+
+    @patch('api.interfaces.orderevents.REPLAY_LIMIT', 1)
+    async def test_replay_reads_past_the_batch_size(self):
+        """Test a client further behind than one replay batch gets every missed event before live ones"""
+        first, second = self.orders
+        response = await self.async_client.get(
+            reverse('order_events', args=['EVT00001']),
+            headers={'Last-Event-ID': event_id(uuid.UUID(int=0), first.date_modified - timedelta(seconds=1))})
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        for order in (first, second):
+            self.assertIn(f'id: {event_id(order.id, order.date_modified)}\n', (await anext(stream)).decode())
+
+        confirmed_at = timezone.now()
+        self._publish(second, 'Confirmed', confirmed_at)
+        self.assertIn(f'id: {event_id(second.id, confirmed_at)}\n', (await anext(stream)).decode())
+
+    async def test_stream_cap_and_bad_requests(self):
+        """Test streams over the per worker cap are refused and malformed requests rejected"""
+        url = reverse('order_events', args=['EVT00001'])
+        with override_settings(ORDER_EVENTS_MAX_STREAMS=0):
+            response = await self.async_client.get(url)
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '5'))
+        response = await self.async_client.get(url, headers={'Last-Event-ID': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get(reverse('order_events', args=['MISSING']))
+        self.assertEqual(response.status_code, 404)
+        self.mock_decode_token.side_effect = RuntimeError('JWT_SECRET must be set in Django settings')
+        self.assertEqual((await self.async_client.get(url)).status_code, 401)
+
+    def test_wsgi_refused_and_writes_notify(self):
+        """Test the stream needs the ASGI app and confirming an order sends a pg_notify"""
+        self.assertEqual(self.client.get(reverse('order_events', args=['EVT00001'])).status_code, 501)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('confirm_order'),
+                data=json.dumps({'customer_code': 'EVT00001', 'order_id': str(self.orders[0].id)}),
+                content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any('pg_notify' in query['sql'] for query in queries.captured_queries))
+
+
+class UUID7Tests(TestCase):
+    def test_ids_time_ordered_and_monotonic(self):
+        """Test ids are version 7, strictly increasing and the model default"""
+        ids = [uuid7() for _ in range(10000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual({(value.version, value.variant) for value in ids}, {(7, uuid.RFC_4122)})
+
+        user = User.objects.create(name='Ordered User', email='ordered@example.com', openid_user_id='auth0|ordered')
+        self.assertEqual(user.id.version, 7)
+        self.assertGreater(user.id, ids[-1])
+
+    def test_clock_going_back_keeps_order(self):
+        """Test the sequence keeps increasing when the clock stands still or steps back"""
+        generator = UUID7Generator()
+        with patch('api.ids.time.time_ns', side_effect=[2_000_000_000, 2_000_000_000, 1_000_000_000]):
+            ids = [generator() for _ in range(3)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual({value.int >> 80 for value in ids}, {2000})
+
+
+class SyncEngineTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Sync User',
+            email='sync@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000013',
+        )
+        self.customer = Customer.objects.create(name='Sync Customer', user=self.user, code='SYNC0001')
+        self.orders = [
+            Order.objects.create(customer=self.customer, item=item, amount=10, status='Pending')
+            for item in ['Mango', 'Apple', 'Banana']]
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _synced(self, label):
+        with open(os.path.join(self.tmpdir, f'{label}.ndjson')) as lines:
+            return [json.loads(line) for line in lines]
+
+    def test_batches_sent_and_marked_synced(self):
+        """Test unsynced rows are written to the sink in batches, oldest first, and not sent again"""
+        with override_settings(SYNC_SINK_OPTIONS={'directory': self.tmpdir}):
+            call_command('sync_models', 'run', '--batch-size', '2', stdout=StringIO())
+            self.assertEqual([record['item'] for record in self._synced('api.Order')], ['Mango', 'Apple', 'Banana'])
+            self.assertEqual(self._synced('api.Customer')[0]['code'], 'SYNC0001')
+            self.assertFalse(Order.objects.filter(synced=False).exists())
+
+            call_command('sync_models', 'run', stdout=StringIO())
+            self.assertEqual(len(self._synced('api.Order')), 3)
+
+    def test_writes_unset_synced(self):
+        """Test saving or confirming a synced order queues it again"""
+        Order.objects.update(synced=True)
+        order = self.orders[0]
+        order.item = 'Papaya'
+        order.save(update_fields=['item'])
+        self.authenticate()
+        self.client.post(reverse('confirm_order'), json.dumps(
+            {'order_id': str(self.orders[1].id), 'customer_code': 'SYNC0001'}), content_type='application/json')
+        self.assertEqual(set(Order.objects.filter(synced=False).values_list('id', flat=True)),
+                         {self.orders[0].id, self.orders[1].id})
+
+    def test_sink_failure_leaves_rows_unsynced(self):
+        """Test a batch whose sink write fails stays unsynced"""
+        sink = MagicMock()
+        sink.write.side_effect = OSError('disk full')
+        with self.assertRaises(OSError):
+            sync_batch(Order, sink, 10)
+        self.assertEqual(Order.objects.filter(synced=False).count(), 3)
+
+    def test_lag_reported(self):
+        """Test the lag counts unsynced rows and the age of the oldest change"""
+        Order.objects.filter(id=self.orders[0].id).update(date_modified=timezone.now() - timedelta(minutes=10))
+        stats = sync_lag(Order)
+        self.assertEqual(stats['unsynced'], 3)
+        self.assertGreaterEqual(stats['lag_seconds'], 600)
+
+        self.authenticate(staff=True)
+        response = self.client.get(reverse('lookup_sync_lag'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({model['model'] for model in json.loads(response.content)['models']},
+                         {'api.Order', 'api.Customer'})
+
+    def test_lag_staff_only(self):
+        """Test the sync lag lookup is refused to users without staff privileges"""
+        self.authenticate()
+        response = self.client.get(reverse('lookup_sync_lag'))
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(ORDER_SHARDS=['default', 'shard_test'], ORDER_CHANGES_SETTLE_SECONDS=0)
+class ShardingTests(AuthenticatedClientMixin, TestCase):
+    """The second shard is an in-memory SQLite database, migrated for the test case"""
+    databases = {'default', 'shard_test'}
+
+    @classmethod
+    def setUpClass(cls):
+        connections.settings['shard_test'] = {
+            **connections['default'].settings_dict, 'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+        call_command('migrate', database='shard_test', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['shard_test'].close()
+        del connections['shard_test']
+        del connections.settings['shard_test']
+
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Shard User',
+            email='shard@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000014',
+        )
+        self.codes = {}
+        for number in range(1000):
+            self.codes.setdefault(dbrouter.shard_for_code(f'SHRD{number:04d}'), f'SHRD{number:04d}')
+        for alias, code in self.codes.items():
+            with dbrouter.use_shard(alias):
+                Customer.objects.create(name=f'Customer on {alias}', user=self.user, code=code)
+        self.authenticate()
+        sms_patcher = patch('api.interfaces.handleorders.SendSms')
+        sms_patcher.start().return_value.send.return_value = {'status': 'sent'}
+        self.addCleanup(sms_patcher.stop)
+
+    def _create_order(self, alias, item):
+        response = self.client.post(
+            reverse('create_order'), data=json.dumps({'customer_code': self.codes[alias], 'item': item, 'amount': '5'}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return json.loads(response.content)['order_id']
+
+    def test_codes_hash_to_stable_shards(self):
+        """Test codes spread over the shards and appending one moves only the codes landing on it"""
+        codes = [f'CODE{number:04d}' for number in range(3000)]
+        before = [dbrouter.shard_for_code(code, ['a', 'b', 'c']) for code in codes]
+        after = [dbrouter.shard_for_code(code, ['a', 'b', 'c', 'd']) for code in codes]
+        self.assertEqual(before, [dbrouter.shard_for_code(code, ['a', 'b', 'c']) for code in codes])
+        self.assertTrue(all(900 < before.count(shard) < 1100 for shard in 'abc'))
+        moved = [new for old, new in zip(before, after) if old != new]
+        self.assertEqual(set(moved), {'d'})
+        self.assertTrue(600 < len(moved) < 900)
+        with override_settings(ORDER_SHARDS=[]):
+            self.assertIsNone(dbrouter.shard_for_code('CODE0001'))
+
+    def test_user_foreign_key_kept_on_default(self):
+        """Test only the shards lose the customer to user constraint, their users live on the default database"""
+        def user_foreign_keys(alias):
+            with connections[alias].cursor() as cursor:
+                constraints = connections[alias].introspection.get_constraints(cursor, Customer._meta.db_table)
+            return [name for name, constraint in constraints.items()
+                    if constraint['foreign_key'] and constraint['columns'] == ['user_id']]
+        self.assertEqual(len(user_foreign_keys('default')), 1)
+        self.assertEqual(user_foreign_keys('shard_test'), [])
+
+    def test_orders_live_on_their_customers_shard(self):
+        """Test orders are written, read and confirmed on the shard of their customer"""
+        shard_order = self._create_order('shard_test', 'Mango')
+        self._create_order('default', 'Apple')
+        self.assertEqual(list(Order.objects.using('shard_test').values_list('item', flat=True)), ['Mango'])
+        self.assertEqual(list(Order.objects.using('default').values_list('item', flat=True)), ['Apple'])
+        self.assertEqual(Customer.objects.using('shard_test').get(code=self.codes['shard_test']).order_count, 1)
+
+        response = self.client.get(reverse('get_order', args=[shard_order]))
+        self.assertEqual(json.loads(response.content)['order']['item'], 'Mango')
+        response = self.client.post(reverse('get_customer_orders'), data=json.dumps(
+            {'customer_code': self.codes['shard_test']}), content_type='application/json')
+        self.assertEqual([order['item'] for order in json.loads(response.content)['orders']], ['Mango'])
+        response = self.client.post(reverse('confirm_order'), data=json.dumps(
+            {'customer_code': self.codes['shard_test'], 'order_id': shard_order}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.using('shard_test').get().status, 'Confirmed')
+
+    def test_listings_merge_shards(self):
+        """Test staff-wide listings gather every shard, in order"""
+        self._create_order('shard_test', 'Mango')
+        self._create_order('default', 'Apple')
+        self._create_order('shard_test', 'Banana')
+
+        response = self.client.get(reverse('get_all_orders'))
+        self.assertEqual([order['item'] for order in json.loads(response.content)['orders']], ['Mango', 'Apple', 'Banana'])
+        response = self.client.get(reverse('get_order_changes'))
+        self.assertEqual(
+            [change['order']['item'] for change in json.loads(response.content)['changes']], ['Mango', 'Apple', 'Banana'])
+
+        response = self.client.post(reverse('lookup_customers') + '?cursor=&per_page=1')
+        data = json.loads(response.content)
+        response = self.client.post(reverse('lookup_customers') + f'?cursor={data["next_cursor"]}&per_page=1')
+        customers = data['customers'] + json.loads(response.content)['customers']
+        self.assertEqual({customer['code'] for customer in customers}, set(self.codes.values()))
+        self.assertEqual({customer['email'] for customer in customers}, {'shard@example.com'})
+        self.assertEqual(self.client.post(reverse('lookup_customers')).status_code, 400)
+
+    def test_rebalance_moves_customers(self):
+        """Test copy then prune moves customers with their orders, timestamps included, to a new shard"""
+        self._create_order('default', 'Apple')
+        customer = Customer.objects.using('default').get()
+        order = Order.objects.using('default').get()
+        out = StringIO()
+        call_command('rebalance_shards', 'plan', '--from', 'default', '--shards', 'shard_test', stdout=out)
+        self.assertIn('default -> shard_test: 1 customers to move', out.getvalue())
+
+        call_command('rebalance_shards', 'copy', '--from', 'default', '--shards', 'shard_test', stdout=StringIO())
+        call_command('rebalance_shards', 'copy', '--from', 'default', '--shards', 'shard_test', stdout=StringIO())
+        copied = Order.objects.using('shard_test').get(id=order.id)
+        self.assertEqual((copied.date_created, copied.date_modified), (order.date_created, order.date_modified))
+        self.assertEqual(Customer.objects.using('shard_test').get(id=customer.id).order_count, 1)
+
+        call_command('rebalance_shards', 'prune', '--from', 'default', '--shards', 'shard_test', stdout=StringIO())
+        self.assertFalse(Customer.objects.using('default').exists())
+        self.assertFalse(Order.objects.using('default').exists())
+
+
+class JobQueueTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Job User',
+            email='jobs@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000015',
+        )
+        self.customer = Customer.objects.create(name='Job Customer', user=self.user, code='JOBS0001')
+        sms_patcher = patch('api.interfaces.handleorders.SendSms')
+        self.mock_send = sms_patcher.start().return_value.send
+        self.mock_send.return_value = {'status': 'sent'}
+        self.addCleanup(sms_patcher.stop)
+
+    def test_order_sms_sent_by_worker(self):
+        """Test creating an order queues its SMS and a worker sends it"""
+        self.authenticate()
+        response = self.client.post(
+            reverse('create_order'), data=json.dumps({'customer_code': 'JOBS0001', 'item': 'Mango', 'amount': '42'}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.mock_send.assert_not_called()
+        self.assertEqual(Job.objects.get().func, 'api.interfaces.handleorders.send_order_sms')
+
+        out = StringIO()
+        call_command('run_workers', '--burst', stdout=out)
+
+        self.assertEqual(self.mock_send.call_args[0][0], '+254700000015')
+        self.assertFalse(Job.objects.exists())
+        self.assertIn('Ran 1 jobs', out.getvalue())
+
+    def test_rolled_back_enqueue_leaves_no_job(self):
+        """Test a job queued in a transaction that rolls back is never run"""
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                enqueue(send_order_sms, args=('+254700000015', 'Hello'))
+                raise RuntimeError('rollback')
+        self.assertFalse(Job.objects.exists())
+
+    def test_priority_and_schedule(self):
+        """Test due jobs run by priority and scheduled jobs wait for their time"""
+        enqueue(send_order_sms, args=('+254700000015', 'low'))
+        enqueue(send_order_sms, args=('+254700000015', 'high'), priority=5)
+        enqueue(send_order_sms, args=('+254700000015', 'later'), run_at=timezone.now() + timedelta(hours=1))
+
+        while run_next():
+            pass
+
+        self.assertEqual([call[0][1] for call in self.mock_send.call_args_list], ['high', 'low'])
+        self.assertEqual(queue_stats()[0]['scheduled'], 1)
+
+    @override_settings(JOB_RETRY_SECONDS=0)
+    def test_failed_runs_retried_then_kept(self):
+        """Test a failing job is retried with backoff until out of attempts, then kept as failed"""
+        self.mock_send.return_value = {'error': 'network down'}
+        job = enqueue(send_order_sms, args=('+254700000015', 'Hello'), max_attempts=2)
+
+        self.assertEqual(run_next(), (job.func, 'retried'))
+        self.assertEqual(run_next(), (job.func, 'failed'))
+        self.assertIsNone(run_next())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn('network down', job.last_error)
+
+        self.assertEqual(retry_failed(), 1)
+        self.mock_send.return_value = {'status': 'sent'}
+        self.assertEqual(run_next(), (job.func, 'done'))
+        self.assertFalse(Job.objects.exists())
+
+
+class ProfilingTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Profile User',
+            email='profile@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000016',
+        )
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _get(self, **headers):
+        self.authenticate(staff=True)
+        response = self.client.get(reverse('lookup_sync_lag'), **headers)
+        self.assertEqual(response.status_code, 200)
+        return load_index(self.tmpdir)
+
+    def test_disabled_by_default(self):
+        """Test the middleware stays out of the stack unless enabled, even for a signed request"""
+        with override_settings(PROFILING_DIR=self.tmpdir):
+            self.assertEqual(self._get(HTTP_X_PROFILE=sign_trigger('cpu')), [])
+
+    @override_settings(PROFILING_ENABLED=True)
+    def test_signed_trigger_profiles_request(self):
+        """Test each mode stores a profile for a signed request and the report aggregates it by endpoint"""
+        with override_settings(PROFILING_DIR=self.tmpdir):
+            for mode in ('cpu', 'sample', 'memory'):
+                self._get(HTTP_X_PROFILE=sign_trigger(mode))
+            records = load_index(self.tmpdir)
+            self.assertEqual([record['mode'] for record in records], ['cpu', 'sample', 'memory'])
+            self.assertEqual({record['endpoint'] for record in records}, {'lookup_sync_lag'})
+
+            out = StringIO()
+            call_command('profile_requests', 'report', stdout=out)
+            self.assertIn('lookup_sync_lag: 3 profiles', out.getvalue())
+            self.assertIn('cpu, 1 profiles', out.getvalue())
+            self.assertIn('memory, 1 profiles', out.getvalue())
+
+    @override_settings(PROFILING_ENABLED=True)
+    def test_unsigned_trigger_ignored(self):
+        """Test a forged or unsampled request is not profiled"""
+        with override_settings(PROFILING_DIR=self.tmpdir):
+            self.assertEqual(self._get(HTTP_X_PROFILE='cpu'), [])
+            self.assertEqual(self._get(), [])
+
+    @override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1, PROFILING_SAMPLE_MODE='cpu')
+    def test_sample_rate(self):
+        """Test sampled requests are profiled without a header"""
+        with override_settings(PROFILING_DIR=self.tmpdir):
+            self.assertEqual(len(self._get()), 1)
+
+
+class SlowQueryLogTests(AuthenticatedClientMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name='Slow User',
+            email='slow@example.com',
+            openid_user_id=str(uuid.uuid4()),
+            phone_number='+254700000017',
+        )
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.log = os.path.join(self.tmpdir, 'slow.ndjson')
+
+    def _get(self):
+        self.authenticate(staff=True)
+        self.assertEqual(self.client.get(reverse('lookup_sync_lag')).status_code, 200)
+
+    def test_fingerprint_ignores_literals(self):
+        """Test runs of a query differing in literals and IN list lengths share a fingerprint"""
+        first = normalize('SELECT * FROM "api_order" WHERE "id" IN (%s, %s) AND "amount" > 10 AND "item" = \'Mango\'')
+        second = normalize('SELECT * FROM "api_order" WHERE "id" IN (%s)  AND "amount" > 25 AND "item" = \'Apple\'')
+        self.assertEqual(first, second)
+        self.assertEqual(fingerprint(first), fingerprint(second))
+
+    def test_slow_queries_logged_by_endpoint(self):
+        """Test queries over the threshold are logged with their endpoint and reported by fingerprint"""
+        with override_settings(SLOW_QUERY_MS=0.000001, SLOW_QUERY_LOG=self.log):
+            self._get()
+            entries = load_log(self.log)
+            self.assertTrue(entries)
+            self.assertEqual({entry['endpoint'] for entry in entries}, {'lookup_sync_lag'})
+            if connection.vendor == 'postgresql':
+                self.assertTrue(any(entry.get('plan') for entry in entries))
+
+            out = StringIO()
+            call_command('slow_queries', 'report', stdout=out)
+            self.assertIn('lookup_sync_lag', out.getvalue())
+            self.assertIn(f'{len(entries)} slow queries', out.getvalue())
+
+    def test_only_plain_reads_analyzed(self):
+        """Test statements with side effects are never run again under EXPLAIN ANALYZE, only planned"""
+        self.assertTrue(read_only('SELECT "api_order"."date_deleted" FROM "api_order" WHERE "item" = \'delete\''))
+        self.assertTrue(read_only('WITH recent AS (SELECT "id" FROM "api_order") SELECT * FROM recent'))
+        for sql in ('SELECT pg_notify(%s, %s)', 'SELECT nextval(\'api_seq\')', 'SELECT * FROM "api_order" FOR UPDATE',
+                    'WITH gone AS (DELETE FROM "api_order" RETURNING "id") SELECT * FROM gone',
+                    'UPDATE "api_order" SET "status" = %s'):
+            self.assertFalse(read_only(sql), sql)
+
+        if connection.vendor != 'postgresql':
+            return
+        with override_settings(SLOW_QUERY_MS=0.000001, SLOW_QUERY_LOG=self.log), \
+                CaptureQueriesContext(connection) as queries, record_slow_queries('test'):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_notify(%s, %s)', ['slow_query_test', 'once'])
+        entry, = load_log(self.log)
+        self.assertEqual((entry['analyzed'], entry['plan'][0]['Plan']['Node Type']), (False, 'Result'))
+        self.assertEqual([query['sql'] for query in queries.captured_queries if 'ANALYZE' in query['sql']], [])
+
+    def test_disabled_by_default(self):
+        """Test nothing is logged without a threshold"""
+        with override_settings(SLOW_QUERY_LOG=self.log):
+            self._get()
+        self.assertFalse(os.path.exists(self.log))
+
+    def test_plan_hints(self):
+        """Test sequential scans discarding rows and disk sorts are pointed out"""
+        plan = [{'Plan': {'Node Type': 'Sort', 'Sort Space Type': 'Disk', 'Sort Space Used': 2048,
+                          'Sort Key': ['date_created'],
+                          'Plans': [{'Node Type': 'Seq Scan', 'Relation Name': 'api_order',
+                                     'Rows Removed by Filter': 99000, 'Filter': "(status = 'Pending')"}]}}]
+        self.assertEqual(plan_hints(plan), [
+            'Sort on disk (2048 kB) by date_created',
+            'Seq Scan on api_order, 99000 rows removed by filter ((status = ?))',
+        ])
+
+
+class FakeAuth0Handler(BaseHTTPRequestHandler):
+    """The token and paged users endpoints of the Auth0 Management API, serving FakeAuth0Handler.users"""
+    users = []
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._json({'access_token': 'fake-management-token'})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        FakeAuth0Handler.requests.append(params)
+        if url.path != '/api/v2/users' or self.headers.get('Authorization') != 'Bearer fake-management-token':
+            return self._json({'statusCode': 401}, status=401)
+        users = sorted(self.users, key=lambda user: user['created_at'])
+        if 'q' in params:
+            since = params['q'].split('[', 1)[1].split(' TO ', 1)[0]
+            users = [user for user in users if user['created_at'] >= since]
+        page, per_page = int(params['page']), int(params['per_page'])
+        if (page + 1) * per_page > auth0users.MAX_QUERY_RESULTS:
+            return self._json({'statusCode': 400, 'message': 'Result window too large'}, status=400)
+        self._json({'users': users[page * per_page:(page + 1) * per_page], 'total': len(users),
+                    'start': page * per_page, 'limit': per_page})
+
+
+class Auth0UserSyncTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAuth0Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        FakeAuth0Handler.users = [
+            {'user_id': f'auth0|{number}', 'email': f'tenant{number}@example.com', 'name': f'Tenant {number}',
+             'created_at': f'2024-01-0{number}T00:00:00.000Z', 'app_metadata': {'phone_number': f'+25471100000{number}'}}
+            for number in range(1, 8)]
+        FakeAuth0Handler.requests = []
+        settings_override = override_settings(
+            AUTH0_MANAGEMENT_URL=f'http://127.0.0.1:{self.server.server_port}', AUTH0_DOMAIN='tenant.example.com')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Small query windows, so the sync has to move its window forward like on a tenant of thousands
+        window_patcher = patch('api.interfaces.auth0users.MAX_QUERY_RESULTS', 4)
+        window_patcher.start()
+        self.addCleanup(window_patcher.stop)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_sync_upserts_every_page(self):
+        """Test every Auth0 user is inserted or refreshed, keeping local roles and skipping taken emails"""
+        admin = User.objects.create(name='Old Name', email='old@example.com', openid_user_id='auth0|1', role='admin')
+        User.objects.create(name='Local', email='tenant7@example.com', openid_user_id='local|7')
+
+        out = StringIO()
+        call_command('sync_auth0_users', '--per-page', '2', '--workers', '3', stdout=out)
+
+        self.assertIn('Synced 6 Auth0 users, 1 skipped', out.getvalue())
+        self.assertEqual(User.objects.filter(openid_user_id__startswith='auth0|').count(), 6)
+        admin.refresh_from_db()
+        self.assertEqual((admin.name, admin.email, admin.role), ('Tenant 1', 'tenant1@example.com', 'admin'))
+        self.assertEqual(User.objects.get(openid_user_id='auth0|3').phone_number, '+254711000003')
+        self.assertTrue(any('q' in params for params in FakeAuth0Handler.requests))
+
+    def test_checkpoint_resumes(self):
+        """Test a rerun starts from the checkpointed created_at and the checkpoint is removed when done"""
+        checkpoint = os.path.join(self.tmpdir, 'auth0.checkpoint')
+        with open(checkpoint, 'w') as handle:
+            json.dump({'since': '2024-01-05T00:00:00.000Z'}, handle)
+
+        call_command('sync_auth0_users', '--checkpoint', checkpoint, '--per-page', '2', stdout=StringIO())
+
+        self.assertEqual(sorted(User.objects.values_list('openid_user_id', flat=True)),
+                         ['auth0|5', 'auth0|6', 'auth0|7'])
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_page_larger_than_window(self):
+        """Test a page size above the query window is capped to it and still reads every user"""
+        out = StringIO()
+        call_command('sync_auth0_users', '--per-page', '10', stdout=out)
+
+        self.assertIn('Synced 7 Auth0 users', out.getvalue())
+        self.assertTrue(all(int(params['per_page']) <= 4
+                            for params in FakeAuth0Handler.requests if 'per_page' in params))
+
+    @patch('customer_app.views.get_oauth')
+    def test_callback_upserts_in_one_query(self, mock_oauth):
+        """Test a login creates the user once and refreshes it on later logins"""
+        token = {'userinfo': {'sub': 'auth0|login', 'email': 'login@example.com', 'name': 'First'}}
+        mock_oauth.return_value.auth0.authorize_access_token.return_value = token
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('callback')).status_code, 302)
+        self.assertEqual(len([query for query in queries.captured_queries if 'api_user' in query['sql']]), 1)
+
+        token['userinfo']['name'] = 'Second'
+        self.client.get(reverse('callback'))
+        self.assertEqual(User.objects.get(openid_user_id='auth0|login').name, 'Second')
+